@@ -69,6 +69,12 @@ class Config:
         DB_PATH = os.path.join(BASE_DIR, "data", "fund.db")
         DB_URL = f"sqlite:///{DB_PATH}"
 
+    # Connection pool
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "64"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))        # seconds to wait for a free connection
+    DB_POOL_LIVENESS_AGE = float(os.getenv("DB_POOL_LIVENESS_AGE", "60"))  # ping only connections idle longer than this
+
     # Data Sources
     DEFAULT_DATA_SOURCE = "eastmoney"
 
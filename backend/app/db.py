@@ -2,27 +2,36 @@ import sqlite3
 import logging
 import os
 import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from contextvars import ContextVar
 from pathlib import Path
 from contextlib import contextmanager
 from .config import Config
+from .dialect import PGConnection, table_exists, list_tables, drop_table_sql
+from .migrations import CURRENT_SCHEMA_VERSION, apply_migrations
 
 # PostgreSQL support
 try:
     import psycopg2
     import psycopg2.extras
+    import psycopg2.extensions
+    import psycopg2.pool
     PSYCOPG2_AVAILABLE = True
 except ImportError:
     PSYCOPG2_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
-# Current database schema version (after rebuild)
-CURRENT_SCHEMA_VERSION = 1
-
-# Thread-local storage for connection pooling
+# Thread-local storage for the connection leased by get_db_connection() outside a db_scope()
 _thread_local = threading.local()
 
 
+class PoolTimeoutError(RuntimeError):
+    """Raised when no pooled connection becomes available within DB_POOL_TIMEOUT."""
+
+
 def get_db_type() -> str:
     """
     获取当前数据库类型
@@ -33,75 +42,388 @@ def get_db_type() -> str:
     return Config.DB_TYPE
 
 
+def _create_sqlite_connection() -> sqlite3.Connection:
+    if not Config.DB_PATH:
+        raise RuntimeError("DB_PATH is not configured for SQLite")
+
+    # 确保数据库目录存在
+    db_dir = Path(Config.DB_PATH).parent
+    db_dir.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite3.connect(Config.DB_PATH, check_same_thread=False, timeout=30.0)
+    conn.row_factory = sqlite3.Row
+
+    # Performance optimizations for concurrent access
+    # WAL mode is persistent, only needs to be set once (already enabled)
+    # But we set it here to ensure it's enabled even if DB is recreated
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Faster writes, still safe with WAL
+    conn.execute("PRAGMA cache_size=-64000")   # 64MB cache
+    conn.execute("PRAGMA temp_store=MEMORY")   # Use memory for temp tables
+    conn.execute("PRAGMA busy_timeout=30000")  # 30s timeout for lock contention
+    return conn
+
+
+def _is_closed(conn) -> bool:
+    """Cheap closed-state check that does not touch the server."""
+    if hasattr(conn, "closed"):  # psycopg2
+        return bool(conn.closed)
+    try:
+        conn.total_changes  # raises ProgrammingError on a closed sqlite3 connection
+        return False
+    except sqlite3.ProgrammingError:
+        return True
+
+
+def _ping(conn) -> bool:
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+class ConnectionPool(ABC):
+    """
+    Bounded, blocking connection pool.
+
+    Checkout waits up to ``timeout`` seconds for a free slot. Connections idle
+    for longer than ``liveness_age`` seconds are pinged once on checkout;
+    fresher ones are handed out without a round trip.
+    """
+
+    def __init__(self, maxconn: int, timeout: float, liveness_age: float):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.liveness_age = liveness_age
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "timeouts": 0,
+            "liveness_checks": 0,
+            "discarded": 0,
+            "in_use": 0,
+        }
+
+    # Backend-specific hooks
+    @abstractmethod
+    def _get(self):
+        """Return a connection (new or reused); a slot is already held."""
+
+    @abstractmethod
+    def _put(self, conn, discard: bool):
+        """Take a connection back, closing it when ``discard`` is set."""
+
+    @abstractmethod
+    def _close_all(self):
+        """Close every connection the backend still holds."""
+
+    def checkout(self):
+        start = time.monotonic()
+        if not self._slots.acquire(blocking=False):
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._stats_lock:
+                    self._stats["timeouts"] += 1
+                raise PoolTimeoutError(f"No database connection available within {self.timeout}s (pool size {self.maxconn})")
+            waited = time.monotonic() - start
+            with self._stats_lock:
+                self._stats["waits"] += 1
+                self._stats["wait_seconds_total"] += waited
+                self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+
+        try:
+            conn = self._get()
+            last_used = self._last_used.get(id(conn))
+            stale = last_used is not None and time.monotonic() - last_used > self.liveness_age
+            if _is_closed(conn) or stale:
+                if stale:
+                    with self._stats_lock:
+                        self._stats["liveness_checks"] += 1
+                if _is_closed(conn) or not _ping(conn):
+                    self._discard(conn)
+                    conn = self._get()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+        return conn
+
+    def checkin(self, conn):
+        try:
+            if _is_closed(conn):
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._put(conn, discard=False)
+        finally:
+            with self._stats_lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        with self._stats_lock:
+            self._stats["discarded"] += 1
+        try:
+            self._put(conn, discard=True)
+        except Exception as e:
+            logger.debug(f"Error discarding pooled connection: {e}")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["max_size"] = self.maxconn
+        stats["wait_seconds_avg"] = (
+            stats["wait_seconds_total"] / stats["waits"] if stats["waits"] else 0.0
+        )
+        return stats
+
+    def close(self):
+        self._close_all()
+        self._last_used.clear()
+
+
+class SQLiteConnectionPool(ConnectionPool):
+    """Bounded pool of sqlite3 connections (LIFO, so hot connections keep their page cache)."""
+
+    def __init__(self, maxconn: int, timeout: float, liveness_age: float):
+        super().__init__(maxconn, timeout, liveness_age)
+        self._idle = deque()
+        self._idle_lock = threading.Lock()
+
+    def _get(self):
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop()
+        return _create_sqlite_connection()
+
+    def _put(self, conn, discard: bool):
+        if discard:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        with self._idle_lock:
+            self._idle.append(conn)
+
+    def _close_all(self):
+        with self._idle_lock:
+            while self._idle:
+                try:
+                    self._idle.pop().close()
+                except Exception:
+                    pass
+
+
+class PostgresConnectionPool(ConnectionPool):
+    """
+    psycopg2 ThreadedConnectionPool behind a blocking semaphore.
+
+    Connections are handed out wrapped in dialect.PGConnection so SQLite-syntax
+    queries run unchanged; DictCursor rows support both row["col"] and row[0].
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, liveness_age: float):
+        super().__init__(maxconn, timeout, liveness_age)
+        self._pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn, Config.DB_URL,
+            cursor_factory=psycopg2.extras.DictCursor
+        )
+        self._wrappers = {}
+
+    def _get(self):
+        raw = self._pool.getconn()
+        wrapper = self._wrappers.get(id(raw))
+        if wrapper is None or wrapper.raw is not raw:
+            wrapper = PGConnection(raw)
+            self._wrappers[id(raw)] = wrapper
+        return wrapper
+
+    def _put(self, conn, discard: bool):
+        raw = conn.raw
+        if discard:
+            self._wrappers.pop(id(raw), None)
+        elif raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            raw.rollback()
+        self._pool.putconn(raw, close=discard)
+
+    def _close_all(self):
+        self._pool.closeall()
+        self._wrappers.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Get (lazily creating) the process-wide connection pool."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if get_db_type() == "postgresql":
+                    if not PSYCOPG2_AVAILABLE:
+                        raise RuntimeError("psycopg2 is not installed. Run: pip install psycopg2-binary")
+                    if not Config.DB_URL:
+                        raise RuntimeError("DATABASE_URL is not configured for PostgreSQL")
+                    _pool = PostgresConnectionPool(
+                        Config.DB_POOL_MIN, Config.DB_POOL_MAX,
+                        Config.DB_POOL_TIMEOUT, Config.DB_POOL_LIVENESS_AGE
+                    )
+                else:
+                    _pool = SQLiteConnectionPool(
+                        Config.DB_POOL_MAX, Config.DB_POOL_TIMEOUT, Config.DB_POOL_LIVENESS_AGE
+                    )
+    return _pool
+
+
+def get_pool_stats() -> dict:
+    """Pool usage and wait metrics."""
+    return get_pool().stats()
+
+
+def close_pool() -> None:
+    """Close all pooled connections (application shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+class _Lease:
+    """
+    A connection checked out lazily and returned by release().
+
+    Used both for a db_scope() (one request, scheduler job or worker task)
+    and, outside any scope, for the calling thread; threading.local drops its
+    attributes when the owning thread exits, which releases a thread lease.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self.conn = None
+        self._lock = threading.Lock()
+
+    def connection(self):
+        with self._lock:
+            if self.conn is not None and _is_closed(self.conn):
+                self._release_locked()
+            if self.conn is None:
+                self.conn = self.pool.checkout()
+            return self.conn
+
+    def active(self):
+        """The leased connection, or None if nothing is checked out."""
+        conn = self.conn
+        return conn if conn is not None and not _is_closed(conn) else None
+
+    def _release_locked(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            self.pool.checkin(conn)
+
+    def release(self):
+        with self._lock:
+            self._release_locked()
+
+    def __del__(self):
+        try:
+            self._release_locked()
+        except Exception:
+            pass
+
+
+# Lease of the enclosing db_scope(); anyio worker threads inherit it with the context
+_scope_lease: ContextVar = ContextVar("db_scope_lease", default=None)
+
+
+def _current_lease():
+    lease = _scope_lease.get()
+    if lease is None:
+        lease = getattr(_thread_local, "lease", None)
+    return lease
+
+
+@contextmanager
+def db_scope():
+    """
+    Bound the connection used by get_db_connection() to a unit of work.
+
+    Inside the scope every get_db_connection() call (including calls from
+    anyio worker threads started within it) shares one connection, checked out
+    on first use and returned to the pool, with any uncommitted transaction
+    rolled back, when the scope exits. Each HTTP request runs in a scope
+    (DBScopeMiddleware); scheduler jobs and worker tasks open their own.
+    Nested scopes share the outer one.
+
+    Usage:
+        with db_scope():
+            run_job()
+    """
+    if _scope_lease.get() is not None:
+        yield
+        return
+    lease = _Lease(get_pool())
+    token = _scope_lease.set(lease)
+    try:
+        yield
+    finally:
+        _scope_lease.reset(token)
+        lease.release()
+
+
 def get_db_connection():
     """
-    Get database connection based on DB_TYPE configuration.
+    Get the pooled database connection of the current db_scope().
 
-    Supports both SQLite and PostgreSQL with thread-local connection pooling.
+    Outside a scope the connection is leased to the calling thread and
+    returned when the thread exits or release_db_connection() is called.
+    Callers must not close() it.
 
     Returns:
         Connection object (sqlite3.Connection or psycopg2.connection)
     """
-    # Reuse connection within same thread to reduce lock contention
-    if hasattr(_thread_local, 'conn') and _thread_local.conn:
-        try:
-            # Test if connection is still alive
-            cursor = _thread_local.conn.cursor()
-            cursor.execute("SELECT 1")
-            cursor.close()
-            return _thread_local.conn
-        except:
-            # Connection is dead, create new one
-            _thread_local.conn = None
-
-    db_type = get_db_type()
-
-    if db_type == "postgresql":
-        # PostgreSQL connection
-        if not PSYCOPG2_AVAILABLE:
-            raise RuntimeError("psycopg2 is not installed. Run: pip install psycopg2-binary")
-
-        if not Config.DB_URL:
-            raise RuntimeError("DATABASE_URL is not configured for PostgreSQL")
-
-        conn = psycopg2.connect(
-            Config.DB_URL,
-            cursor_factory=psycopg2.extras.RealDictCursor
-        )
-        # PostgreSQL uses autocommit=False by default, which is what we want
-
-    else:
-        # SQLite connection
-        if not Config.DB_PATH:
-            raise RuntimeError("DB_PATH is not configured for SQLite")
-
-        # 确保数据库目录存在
-        db_dir = Path(Config.DB_PATH).parent
-        db_dir.mkdir(parents=True, exist_ok=True)
-
-        conn = sqlite3.connect(Config.DB_PATH, check_same_thread=False, timeout=30.0)
-        conn.row_factory = sqlite3.Row
-
-        # Performance optimizations for concurrent access
-        # WAL mode is persistent, only needs to be set once (already enabled)
-        # But we set it here to ensure it's enabled even if DB is recreated
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA synchronous=NORMAL")  # Faster writes, still safe with WAL
-        conn.execute("PRAGMA cache_size=-64000")   # 64MB cache
-        conn.execute("PRAGMA temp_store=MEMORY")   # Use memory for temp tables
-        conn.execute("PRAGMA busy_timeout=30000")  # 30s timeout for lock contention
-
-    _thread_local.conn = conn
-    return conn
+    lease = _current_lease()
+    if lease is None:
+        lease = _thread_local.lease = _Lease(get_pool())
+    return lease.connection()
+
+
+def release_db_connection() -> None:
+    """
+    Return the current scope's (or thread's) connection to the pool early,
+    e.g. before a long-lived stream that no longer needs the database.
+    A later get_db_connection() checks out a connection again.
+    """
+    lease = _current_lease()
+    if lease is not None:
+        lease.release()
 
 
 @contextmanager
 def db_connection():
     """
-    Context manager for database transactions with thread-local connection pooling.
+    Context manager for database transactions with explicit pool checkout.
 
-    This context manager reuses the thread-local connection and only commits/rollbacks
-    transactions, without closing the connection (which would break the pooling).
+    A connection is checked out from the pool on entry and returned on exit.
+    Inside a db_scope(), or if the thread already holds a leased connection
+    (get_db_connection), that connection is used instead, so a unit of work
+    never waits on its own uncommitted SQLite write lock.
 
     Usage:
         with db_connection() as conn:
@@ -109,13 +431,23 @@ def db_connection():
             cursor.execute(...)
             # Auto-commits on success, auto-rollbacks on exception
     """
-    conn = get_db_connection()
+    scope = _scope_lease.get()
+    lease = getattr(_thread_local, "lease", None)
+    conn = scope.connection() if scope is not None else (lease.active() if lease is not None else None)
+    owned = conn is None
+    if owned:
+        pool = get_pool()
+        conn = pool.checkout()
+
     try:
         yield conn
         conn.commit()
     except Exception:
         conn.rollback()
         raise
+    finally:
+        if owned:
+            pool.checkin(conn)
 
 
 def check_database_version() -> int:
@@ -130,11 +462,7 @@ def check_database_version() -> int:
 
     try:
         # Check if schema_version table exists
-        cursor.execute("""
-            SELECT name FROM sqlite_master
-            WHERE type='table' AND name='schema_version'
-        """)
-        if not cursor.fetchone():
+        if not table_exists(cursor, "schema_version"):
             return 0
 
         # Get current version
@@ -148,20 +476,14 @@ def check_database_version() -> int:
 
 def get_all_tables() -> list[str]:
     """
-    Get all table names in the database (excluding SQLite internal tables).
+    Get all table names in the database (excluding engine-internal tables).
 
     Returns:
         list[str]: List of table names
     """
     conn = get_db_connection()
     cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT name FROM sqlite_master
-        WHERE type='table' AND name NOT LIKE 'sqlite_%'
-        ORDER BY name
-    """)
-    return [row[0] for row in cursor.fetchall()]
+    return list_tables(cursor)
 
 
 def drop_all_tables() -> None:
@@ -176,7 +498,7 @@ def drop_all_tables() -> None:
     tables = get_all_tables()
 
     for table in tables:
-        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(drop_table_sql(table))
         logger.info(f"Dropped table: {table}")
 
     conn.commit()
@@ -184,182 +506,16 @@ def drop_all_tables() -> None:
 
 
 def init_db():
-    """Initialize the database schema for multi-user mode. Drops all tables if version mismatch."""
+    """
+    Initialize the database schema for multi-user mode.
+
+    Pending migrations are applied in order on top of the existing data;
+    nothing is dropped when the schema version changes.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # Ensure schema_version table exists
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS schema_version (
-            version INTEGER PRIMARY KEY,
-            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    current_version = check_database_version()
-    logger.info(f"Current database schema version: {current_version}")
-
-    # If version mismatch, drop all tables and rebuild
-    if current_version > 0 and current_version != CURRENT_SCHEMA_VERSION:
-        logger.warning(f"Database schema version mismatch (current: {current_version}, expected: {CURRENT_SCHEMA_VERSION}). Dropping all tables and rebuilding...")
-
-        drop_all_tables()
-
-        # Recreate schema_version table
-        cursor.execute("""
-            CREATE TABLE schema_version (
-                version INTEGER PRIMARY KEY,
-                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        current_version = 0
-        logger.info("All tables dropped. Rebuilding database...")
-
-    # ============================================================================
-    # Multi-user tables
-    # ============================================================================
-
-    # Users table - store user accounts
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            is_admin INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
-
-    # Accounts table - store fund accounts (multi-account support)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS accounts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            user_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(name, user_id),
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_accounts_user_id ON accounts(user_id)")
-
-    # ============================================================================
-    # Fund data tables
-    # ============================================================================
-
-    # Funds table - store fund basic info
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS funds (
-            code TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            type TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_funds_name ON funds(name)")
-
-    # Positions table - store user holdings (per account)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS positions (
-            account_id INTEGER NOT NULL,
-            code TEXT NOT NULL,
-            cost REAL NOT NULL DEFAULT 0.0,
-            shares REAL NOT NULL DEFAULT 0.0,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (account_id, code),
-            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
-        )
-    """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_positions_account_id ON positions(account_id)")
-
-    # Transactions table - add/reduce position log (per account)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            account_id INTEGER NOT NULL,
-            code TEXT NOT NULL,
-            op_type TEXT NOT NULL,
-            amount_cny REAL,
-            shares_redeemed REAL,
-            confirm_date TEXT NOT NULL,
-            confirm_nav REAL,
-            shares_added REAL,
-            cost_after REAL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            applied_at TIMESTAMP,
-            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
-        )
-    """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account_id ON transactions(account_id)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_code ON transactions(code)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_confirm_date ON transactions(confirm_date)")
-
-    # Fund history table - cache historical NAV data (shared across users)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS fund_history (
-            code TEXT NOT NULL,
-            date TEXT NOT NULL,
-            nav REAL NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (code, date)
-        )
-    """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fund_history_code ON fund_history(code)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fund_history_date ON fund_history(date)")
-
-    # Intraday snapshots table - store intraday valuation data (shared across users)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS fund_intraday_snapshots (
-            fund_code TEXT NOT NULL,
-            date TEXT NOT NULL,
-            time TEXT NOT NULL,
-            estimate REAL NOT NULL,
-            PRIMARY KEY (fund_code, date, time)
-        )
-    """)
-
-    # ============================================================================
-    # User-specific tables
-    # ============================================================================
-
-    # Subscriptions table - store email alert settings (per user)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS subscriptions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            code TEXT NOT NULL,
-            email TEXT NOT NULL,
-            user_id INTEGER NOT NULL,
-            threshold_up REAL,
-            threshold_down REAL,
-            enable_digest INTEGER DEFAULT 0,
-            digest_time TEXT DEFAULT '14:45',
-            enable_volatility INTEGER DEFAULT 1,
-            last_notified_at TIMESTAMP,
-            last_digest_at TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(code, email, user_id),
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_user_id ON subscriptions(user_id)")
-
-    # Settings table - store configuration (system-level: user_id=NULL, user-level: user_id=<id>)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT NOT NULL,
-            value TEXT,
-            encrypted INTEGER DEFAULT 0,
-            user_id INTEGER,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (key, user_id),
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_settings_user_id ON settings(user_id)")
+    apply_migrations(conn)
 
     # Initialize default system settings (user_id = NULL)
     default_settings = [
@@ -377,62 +533,5 @@ def init_db():
     cursor.executemany("""
         INSERT OR IGNORE INTO settings (key, value, encrypted, user_id) VALUES (?, ?, ?, ?)
     """, default_settings)
-
-    # AI prompts table - store custom AI prompts (per user)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS ai_prompts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            prompt TEXT NOT NULL,
-            user_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(name, user_id),
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    """)
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ai_prompts_user_id ON ai_prompts(user_id)")
-
-    # AI analysis history table - store AI analysis results (per user)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS ai_analysis_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            account_id INTEGER NOT NULL,
-            fund_code TEXT NOT NULL,
-            fund_name TEXT NOT NULL,
-            prompt_id INTEGER,
-            prompt_name TEXT NOT NULL,
-            markdown TEXT NOT NULL,
-            indicators_json TEXT,
-            status TEXT NOT NULL CHECK(status IN ('success', 'failed')) DEFAULT 'success',
-            error_message TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
-        )
-    """)
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_analysis_history_main
-        ON ai_analysis_history(user_id, account_id, fund_code, created_at DESC)
-    """)
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_analysis_history_prompt
-        ON ai_analysis_history(user_id, prompt_id, created_at DESC)
-    """)
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_analysis_history_user_id
-        ON ai_analysis_history(user_id, id)
-    """)
-
-    # ============================================================================
-    # Set schema version
-    # ============================================================================
-
-    if current_version == 0:
-        cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (CURRENT_SCHEMA_VERSION,))
-        logger.info(f"Database initialized with schema version {CURRENT_SCHEMA_VERSION}")
-
     conn.commit()
-    conn.close()
     logger.info("Database initialized.")
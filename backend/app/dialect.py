@@ -0,0 +1,494 @@
+"""
+SQL dialect layer.
+
+Service code is written once in SQLite syntax (``?`` / ``:name`` placeholders,
+``INSERT OR REPLACE`` / ``INSERT OR IGNORE``, ``AUTOINCREMENT`` DDL). In
+PostgreSQL mode every pooled connection is wrapped in PGConnection, whose
+cursors translate statements on the fly (translations are cached), so the
+same queries run natively on PostgreSQL. Frequently executed SELECTs are
+promoted to server-side prepared statements per connection.
+
+Helpers that cannot be expressed as a translation (bulk insert, introspection,
+write-lock acquisition, error classification) are exposed as functions that
+dispatch on the configured DB_TYPE.
+"""
+import logging
+import re
+import sqlite3
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence
+
+from .config import Config
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    PSYCOPG2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Conflict targets used to translate INSERT OR REPLACE / INSERT OR IGNORE
+TABLE_KEYS = {
+    "account_summary": ("account_id",),
+    "funds": ("code",),
+    "fund_history": ("code", "date"),
+    "fund_ids": ("code",),
+    "fund_intraday": ("day", "fund_id", "minute"),
+    "fund_intraday_15m": ("fund_id", "day", "bucket"),
+    "fund_intraday_daily": ("fund_id", "day"),
+    "nav_publications": ("code", "nav_date"),
+    "positions": ("account_id", "code"),
+    "settings": ("key", "user_id"),
+    "schema_version": ("version",),
+    "user_holdings": ("user_id", "code"),
+}
+
+# Tables keyed by a serial id: INSERTs get "RETURNING id" so cursor.lastrowid works
+SERIAL_TABLES = {"users", "accounts", "transactions", "subscriptions", "ai_prompts", "ai_analysis_history"}
+
+# Composite keys containing a nullable column (settings.user_id IS NULL = system level).
+# PostgreSQL forbids NULL in primary keys, so these become UNIQUE NULLS NOT DISTINCT (PG 15+).
+NULLABLE_KEY_TABLES = {"settings"}
+
+# A SELECT executed this many times on one connection is turned into a prepared statement
+PREPARE_THRESHOLD = 3
+# Upper bound of prepared statements kept per connection
+MAX_PREPARED_PER_CONNECTION = 128
+
+_INSERT_OR_RE = re.compile(
+    r"^\s*INSERT\s+OR\s+(REPLACE|IGNORE)\s+INTO\s+(\w+)\s*\(([^)]*)\)",
+    re.IGNORECASE,
+)
+_INSERT_INTO_RE = re.compile(r"^\s*INSERT\s+INTO\s+(\w+)", re.IGNORECASE)
+_CREATE_TABLE_RE = re.compile(r"^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+_ADD_COLUMN_RE = re.compile(r"^\s*ALTER\s+TABLE\s+\w+\s+ADD\s+COLUMN\b", re.IGNORECASE)
+_REAL_RE = re.compile(r"\bREAL\b", re.IGNORECASE)
+_NAMED_PARAM_RE = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+
+def is_postgres() -> bool:
+    return Config.DB_TYPE == "postgresql"
+
+
+def _split_literals(sql: str) -> List[tuple]:
+    """Split SQL into (is_literal, text) chunks so rewrites never touch quoted strings."""
+    chunks = []
+    buf = []
+    in_literal = False
+    i = 0
+    while i < len(sql):
+        ch = sql[i]
+        if ch == "'":
+            if in_literal and i + 1 < len(sql) and sql[i + 1] == "'":
+                buf.append("''")
+                i += 2
+                continue
+            if in_literal:
+                buf.append(ch)
+                chunks.append((True, "".join(buf)))
+                buf = []
+            else:
+                if buf:
+                    chunks.append((False, "".join(buf)))
+                buf = [ch]
+            in_literal = not in_literal
+        else:
+            buf.append(ch)
+        i += 1
+    if buf:
+        chunks.append((in_literal, "".join(buf)))
+    return chunks
+
+
+def _rewrite_params(sql: str, style: str) -> str:
+    """
+    Rewrite placeholders outside string literals.
+
+    style "pyformat": ? -> %s, :name -> %(name)s, literal % -> %%
+    style "numeric":  ? -> $1, $2, ... (for PREPARE)
+    """
+    out = []
+    counter = 0
+    for is_literal, text in _split_literals(sql):
+        if is_literal:
+            out.append(text.replace("%", "%%") if style == "pyformat" else text)
+            continue
+        if style == "pyformat":
+            text = text.replace("%", "%%").replace("?", "%s")
+            text = _NAMED_PARAM_RE.sub(r"%(\1)s", text)
+        else:
+            parts = text.split("?")
+            rebuilt = [parts[0]]
+            for part in parts[1:]:
+                counter += 1
+                rebuilt.append(f"${counter}{part}")
+            text = "".join(rebuilt)
+        out.append(text)
+    return "".join(out)
+
+
+def _widen_real(sql: str) -> str:
+    """SQLite REAL is an 8-byte float; PostgreSQL REAL is float4, so declare DOUBLE PRECISION."""
+    return "".join(text if is_literal else _REAL_RE.sub("DOUBLE PRECISION", text)
+                   for is_literal, text in _split_literals(sql))
+
+
+def _rewrite_statement(sql: str) -> str:
+    """Rewrite SQLite-only statement forms into PostgreSQL equivalents."""
+    stripped = sql.strip().rstrip(";")
+
+    m = _INSERT_OR_RE.match(stripped)
+    if m:
+        mode, table, cols = m.group(1).upper(), m.group(2), m.group(3)
+        columns = [c.strip() for c in cols.split(",") if c.strip()]
+        body = f"INSERT INTO {table} ({cols})" + stripped[m.end():]
+        keys = TABLE_KEYS.get(table)
+        if mode == "IGNORE" or not keys:
+            return body + " ON CONFLICT DO NOTHING"
+        updates = [c for c in columns if c not in keys]
+        if not updates:
+            return body + " ON CONFLICT DO NOTHING"
+        sets = ", ".join(f"{c} = EXCLUDED.{c}" for c in updates)
+        return body + f" ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {sets}"
+
+    m = _CREATE_TABLE_RE.match(stripped)
+    if m:
+        stripped = re.sub(r"INTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT", "SERIAL PRIMARY KEY", stripped, flags=re.IGNORECASE)
+        stripped = _widen_real(stripped)
+        stripped = re.sub(r"\)\s*WITHOUT\s+ROWID\s*$", ")", stripped, flags=re.IGNORECASE)
+        if m.group(1) in NULLABLE_KEY_TABLES:
+            stripped = re.sub(r"PRIMARY\s+KEY\s*\(", "UNIQUE NULLS NOT DISTINCT (", stripped, flags=re.IGNORECASE)
+        return stripped
+
+    if _ADD_COLUMN_RE.match(stripped):
+        return _widen_real(stripped)
+
+    m = _INSERT_INTO_RE.match(stripped)
+    if m and m.group(1) in SERIAL_TABLES and not re.search(r"\bRETURNING\b", stripped, re.IGNORECASE):
+        return stripped + " RETURNING id"
+
+    return stripped
+
+
+@lru_cache(maxsize=1024)
+def translate(sql: str, has_params: bool = True) -> str:
+    """Translate a SQLite-syntax statement for psycopg2 execution."""
+    stmt = _rewrite_statement(sql)
+    return _rewrite_params(stmt, "pyformat") if has_params else stmt
+
+
+@lru_cache(maxsize=1024)
+def translate_for_prepare(sql: str) -> str:
+    """Translate a positional-parameter statement into PREPARE form ($1, $2, ...)."""
+    return _rewrite_params(_rewrite_statement(sql), "numeric")
+
+
+def _is_noop_on_postgres(sql: str) -> bool:
+    head = sql.lstrip()[:16].upper()
+    return head.startswith("PRAGMA") or head.startswith("BEGIN IMMEDIATE")
+
+
+# ============================================================================
+# PostgreSQL connection adapter
+# ============================================================================
+
+class PGCursor:
+    """psycopg2 cursor that accepts SQLite-syntax statements."""
+
+    def __init__(self, conn: "PGConnection"):
+        self._conn = conn
+        self._cur = conn.raw.cursor()
+        self.lastrowid = None
+
+    def execute(self, sql: str, params=None):
+        self.lastrowid = None
+        if _is_noop_on_postgres(sql):
+            return self
+        try:
+            prepared = self._conn.prepared_name(sql, params)
+            if prepared:
+                try:
+                    args = ", ".join(["%s"] * len(params))
+                    self._cur.execute(f"EXECUTE {prepared} ({args})" if params else f"EXECUTE {prepared}", tuple(params))
+                except Exception as e:
+                    if getattr(e, "pgcode", None) != "26000":  # invalid_sql_statement_name
+                        raise
+                    self._conn.recover()
+                    self._conn.forget_prepared(sql)
+                    self._cur.execute(translate(sql, True), params)
+            else:
+                self._cur.execute(translate(sql, params is not None), params)
+        except Exception:
+            self._conn.recover()
+            raise
+
+        if self._cur.description and self._cur.description[0].name == "id" and _INSERT_INTO_RE.match(sql):
+            row = self._cur.fetchone()
+            self.lastrowid = row[0] if row else None
+        return self
+
+    def executemany(self, sql: str, seq_of_params):
+        try:
+            stmt = translate(sql, True)
+            if stmt.endswith(" RETURNING id"):
+                stmt = stmt[: -len(" RETURNING id")]
+            self._cur.executemany(stmt, list(seq_of_params))
+        except Exception:
+            self._conn.recover()
+            raise
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._cur.fetchmany(size) if size else self._cur.fetchmany()
+
+    def close(self):
+        self._cur.close()
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    @property
+    def raw(self):
+        return self._cur
+
+    def __iter__(self):
+        return iter(self._cur)
+
+
+class PGConnection:
+    """
+    Wraps a psycopg2 connection so sqlite3-style call sites work unchanged:
+    cursor() returns a translating cursor and execute() is available on the
+    connection itself.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._use_counts = {}
+        self._prepared = {}
+        self._unpreparable = set()
+        # Open savepoint() blocks; a failure inside one is rolled back to the savepoint, not recovered here
+        self.savepoints = 0
+        # Return timestamps/dates as ISO strings, matching what sqlite3 hands back
+        as_text = psycopg2.extensions.new_type((1114, 1184, 1082), "FV_TEXT_TS", lambda value, cur: value)
+        psycopg2.extensions.register_type(as_text, raw)
+
+    def cursor(self):
+        return PGCursor(self)
+
+    def execute(self, sql: str, params=None):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def get_transaction_status(self):
+        return self.raw.get_transaction_status()
+
+    def recover(self):
+        """
+        A failed statement aborts the whole PostgreSQL transaction, unlike SQLite.
+        Roll back so the pooled connection stays usable for the caller's next statement.
+        Inside a savepoint() block the block rolls back to its savepoint instead,
+        keeping the rest of the caller's transaction.
+        """
+        if self.savepoints:
+            return
+        if self.raw.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            self.raw.rollback()
+
+    def forget_prepared(self, sql: str) -> None:
+        self._prepared.pop(sql, None)
+        self._unpreparable.add(sql)
+
+    def prepared_name(self, sql: str, params) -> Optional[str]:
+        """Return the prepared statement name for a hot SELECT, preparing it on first promotion."""
+        if params is None or isinstance(params, dict) or sql in self._unpreparable:
+            return None
+        name = self._prepared.get(sql)
+        if name:
+            return name
+        if not sql.lstrip()[:6].upper() == "SELECT":
+            return None
+
+        count = self._use_counts.get(sql, 0) + 1
+        self._use_counts[sql] = count
+        if count < PREPARE_THRESHOLD or len(self._prepared) >= MAX_PREPARED_PER_CONNECTION:
+            return None
+
+        name = f"fv_stmt_{len(self._prepared) + 1}"
+        cur = self.raw.cursor()
+        try:
+            cur.execute("SAVEPOINT fv_prepare")
+            cur.execute(f"PREPARE {name} AS {translate_for_prepare(sql)}")
+            cur.execute("RELEASE SAVEPOINT fv_prepare")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT fv_prepare")
+            self._unpreparable.add(sql)
+            logger.debug(f"Statement not preparable, using plain execution: {e}")
+            return None
+        finally:
+            cur.close()
+        self._prepared[sql] = name
+        self._use_counts.pop(sql, None)
+        return name
+
+
+# ============================================================================
+# Dialect-dispatching helpers
+# ============================================================================
+
+def begin_write(conn) -> None:
+    """Start a write transaction, taking SQLite's write lock up front."""
+    if not is_postgres():
+        conn.execute("BEGIN IMMEDIATE")
+
+
+@contextmanager
+def savepoint(cursor, name: str = "fv_row"):
+    """
+    Run a group of statements that may fail on its own: on error everything
+    since the savepoint is rolled back and the error re-raised, while the
+    enclosing transaction (and the work done before the block) stays intact.
+    Needed on PostgreSQL, where a failed statement otherwise aborts the whole
+    transaction; per-row imports use it on both backends.
+    """
+    conn = getattr(cursor, "_conn", None)  # PGConnection behind a PGCursor
+    if conn is None and not cursor.connection.in_transaction:
+        # SQLite: an outermost SAVEPOINT would commit on RELEASE
+        cursor.execute("BEGIN")
+    cursor.execute(f"SAVEPOINT {name}")
+    if conn is not None:
+        conn.savepoints += 1
+    try:
+        yield
+    except Exception:
+        if conn is not None:
+            conn.savepoints -= 1
+        cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+        cursor.execute(f"RELEASE SAVEPOINT {name}")
+        raise
+    if conn is not None:
+        conn.savepoints -= 1
+    cursor.execute(f"RELEASE SAVEPOINT {name}")
+
+
+def bulk_insert(cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence],
+                on_conflict: Optional[str] = None, timestamp_columns: Sequence[str] = ()) -> None:
+    """
+    Insert many rows in one round trip (executemany on SQLite, execute_values on PostgreSQL).
+
+    Args:
+        cursor: Cursor from get_db_connection()/db_connection()
+        table: Target table
+        columns: Column names supplied by each row tuple
+        rows: Row tuples in column order
+        on_conflict: None, "replace" or "ignore"
+        timestamp_columns: Extra columns set to CURRENT_TIMESTAMP (e.g. updated_at)
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    all_columns = list(columns) + list(timestamp_columns)
+    cols = ", ".join(all_columns)
+    stamps = ", CURRENT_TIMESTAMP" * len(timestamp_columns)
+
+    if is_postgres():
+        sql = f"INSERT INTO {table} ({cols}) VALUES %s"
+        keys = TABLE_KEYS.get(table)
+        if on_conflict == "ignore" or (on_conflict == "replace" and not keys):
+            sql += " ON CONFLICT DO NOTHING"
+        elif on_conflict == "replace":
+            updates = [c for c in all_columns if c not in keys]
+            if updates:
+                sets = ", ".join(f"{c} = EXCLUDED.{c}" for c in updates)
+                sql += f" ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {sets}"
+            else:
+                sql += " ON CONFLICT DO NOTHING"
+        template = "(" + ", ".join(["%s"] * len(columns)) + stamps + ")"
+        raw = cursor.raw if isinstance(cursor, PGCursor) else cursor
+        psycopg2.extras.execute_values(raw, sql, rows, template=template, page_size=1000)
+        return
+
+    verb = {"replace": "INSERT OR REPLACE", "ignore": "INSERT OR IGNORE"}.get(on_conflict, "INSERT")
+    placeholders = ", ".join("?" * len(columns)) + stamps
+    cursor.executemany(f"{verb} INTO {table} ({cols}) VALUES ({placeholders})", rows)
+
+
+def table_exists(cursor, name: str) -> bool:
+    if is_postgres():
+        cursor.execute("SELECT 1 FROM information_schema.tables WHERE table_schema = current_schema() AND table_name = ?", (name,))
+    else:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table: str, column: str) -> bool:
+    if is_postgres():
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = ? AND column_name = ?
+        """, (table, column))
+        return cursor.fetchone() is not None
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def list_tables(cursor) -> List[str]:
+    """User table names, excluding engine-internal tables."""
+    if is_postgres():
+        cursor.execute("""
+            SELECT table_name FROM information_schema.tables
+            WHERE table_schema = current_schema() AND table_type = 'BASE TABLE'
+            ORDER BY table_name
+        """)
+    else:
+        cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type='table' AND name NOT LIKE 'sqlite_%'
+            ORDER BY name
+        """)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def drop_table_sql(name: str) -> str:
+    if is_postgres():
+        return f"DROP TABLE IF EXISTS {name} CASCADE"
+    return f"DROP TABLE IF EXISTS {name}"
+
+
+def is_unique_violation(e: Exception) -> bool:
+    """Whether an exception is a UNIQUE/primary-key violation on either backend."""
+    if isinstance(e, sqlite3.IntegrityError) and "UNIQUE constraint failed" in str(e):
+        return True
+    if PSYCOPG2_AVAILABLE and getattr(e, "pgcode", None) == "23505":
+        return True
+    return "UNIQUE constraint failed" in str(e)
@@ -2,18 +2,38 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
+import gzip
+import hashlib
 import os
+import re
 import sys
 import json
 import logging
+import time
 from logging.handlers import RotatingFileHandler
+from typing import Optional
 
 from .routers import funds, ai, account, settings, data, auth, system
-from .db import init_db
+from .db import init_db, close_pool, db_scope
 from .services.scheduler import start_scheduler
+from .services import response_cache
+from .auth import SESSION_COOKIE_NAME, get_session_user
+
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    DefaultResponse = JSONResponse
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
 
 # Request size limit (10MB)
 MAX_REQUEST_SIZE = 10 * 1024 * 1024
@@ -81,6 +101,220 @@ class RequestSizeLimitMiddleware(BaseHTTPMiddleware):
             )
         return await call_next(request)
 
+class DBScopeMiddleware:
+    """
+    Run each HTTP request in a db_scope(): the connection it leases (from the
+    event loop or any worker thread) goes back to the pool when the response
+    has been sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with db_scope():
+            await self.app(scope, receive, send)
+
+# 只读接口的响应缓存规则：(路径正则, TTL 秒, 是否按用户区分)
+RESPONSE_CACHE_RULES = (
+    (re.compile(r"^/api/fund/[^/]+/history$"), 300, True),
+    (re.compile(r"^/api/fund/[^/]+/intraday$"), 60, False),
+    (re.compile(r"^/api/categories$"), 600, False),
+    (re.compile(r"^/api/search$"), 300, False),
+    (re.compile(r"^/api/account/transactions$"), 30, True),
+)
+RESPONSE_CACHE_MAX_ENTRIES = 2048
+RESPONSE_CACHE_MAX_BODY = 1024 * 1024  # 超过 1MB 的响应不缓存
+
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """
+    只读接口的响应缓存 + 条件请求。
+
+    - 命中规则的 GET 以 (路径, 查询串[, 用户]) 为键缓存 200 响应体，按规则 TTL 过期（LRU 淘汰）；
+    - ETag 为响应体的 SHA-256（接口自带 ETag 时沿用），If-None-Match 匹配直接返回 304；
+    - 按用户区分的接口先校验会话，以会话对应的 user_id 区分；无有效会话的请求不读写缓存，
+      交给接口返回 401；该用户的任意写请求清空其缓存条目（同一用户的所有会话共用），
+      后台改动（待确认流水应用）经 response_cache.invalidate_users 清空；
+    - 接口带 Cache-Control: no-store 的响应（如降级的空结果）不缓存。
+    其余请求（包括流式响应）原样透传。条目存储见 services/response_cache。
+    """
+
+    @staticmethod
+    def _match(path: str):
+        for pattern, ttl, per_user in RESPONSE_CACHE_RULES:
+            if pattern.match(path):
+                return ttl, per_user
+        return None
+
+    @staticmethod
+    def _session_user(request) -> Optional[int]:
+        session_id = request.cookies.get(SESSION_COOKIE_NAME)
+        return get_session_user(session_id) if session_id else None
+
+    def _respond(self, request, status, headers, body, etag):
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "content-type"})
+        return Response(content=body, status_code=status, headers=headers)
+
+    async def dispatch(self, request, call_next):
+        if request.method != "GET":
+            # 先解析会话：登出等写请求会使会话失效
+            user = self._session_user(request)
+            response = await call_next(request)
+            if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400:
+                if user is not None:
+                    response_cache.invalidate_users([user])
+            return response
+
+        rule = self._match(request.url.path)
+        if rule is None:
+            return await call_next(request)
+        ttl, per_user = rule
+        user = None
+        if per_user:
+            user = self._session_user(request)
+            if user is None:
+                return await call_next(request)
+        key = (request.url.path, request.url.query, user)
+
+        now = time.monotonic()
+        entry = response_cache.get(key, now)
+        if entry is not None:
+            _, status, headers, body, etag = entry
+            return self._respond(request, status, headers, body, etag)
+
+        response = await call_next(request)
+        if response.status_code != 200 or "no-store" in response.headers.get("cache-control", ""):
+            return response
+
+        chunks = []
+        async for chunk in response.body_iterator:
+            chunks.append(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+        body = b"".join(chunks)
+
+        etag = response.headers.get("etag") or '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        headers = {
+            "content-type": response.headers.get("content-type", "application/json"),
+            "etag": etag,
+            "cache-control": response.headers.get("cache-control") or ("private, no-cache" if per_user else "no-cache"),
+        }
+        if per_user:
+            headers["vary"] = "Cookie"
+
+        if len(body) <= RESPONSE_CACHE_MAX_BODY:
+            response_cache.put(key, (now + ttl, 200, headers, body, etag), RESPONSE_CACHE_MAX_ENTRIES)
+        return self._respond(request, 200, headers, body, etag)
+
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/css", "text/plain",
+                      "application/javascript", "text/javascript", "image/svg+xml",
+                      "application/octet-stream")
+
+
+def negotiate_encoding(accept_encoding: str):
+    """按 Accept-Encoding 选择编码：zstd（可用时）优先于 gzip，q=0 视为拒绝"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(token.strip())
+    if ZSTD_AVAILABLE and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _tag_etag(etag: str, encoding: str) -> str:
+    """同一资源的不同编码用不同的强 ETag（"abc" 变为 "abc-gzip"）"""
+    return etag[:-1] + f"-{encoding}\"" if etag.endswith('"') else etag
+
+
+class CompressionMiddleware:
+    """
+    按 Accept-Encoding 协商 zstd / gzip 压缩整块响应（纯 ASGI）。
+
+    - 只压缩一次性发出的响应体（JSON 等），流式响应（SSE / NDJSON）逐帧透传，不影响推送延迟；
+    - 压缩后的 ETag 带编码后缀，请求中的 If-None-Match 去掉后缀再交给内层比较；
+      只有 If-None-Match 带后缀（客户端拿到的是压缩版本）时，304 的 ETag 才加回后缀。
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        suffix = f"-{encoding}\""
+        request_headers = MutableHeaders(scope=scope)
+        if_none_match = request_headers.get("if-none-match")
+        tagged_validator = bool(if_none_match and if_none_match.endswith(suffix))
+        if tagged_validator:
+            request_headers["if-none-match"] = if_none_match[:-len(suffix)] + '"'
+
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if start["status"] == 304:
+                headers.add_vary_header("Accept-Encoding")
+                if tagged_validator and "etag" in headers:
+                    headers["etag"] = _tag_etag(headers["etag"], encoding)
+            content_type = headers.get("content-type", "").split(";")[0].strip()
+            if (message.get("more_body", False) or "content-encoding" in headers
+                    or len(body) < self.minimum_size or content_type not in COMPRESSIBLE_TYPES):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress_body(body, encoding)
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers:
+                headers["etag"] = _tag_etag(headers["etag"], encoding)
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
 # 读取版本号
 def get_version():
     """从 package.json 读取版本号"""
@@ -106,17 +340,21 @@ APP_VERSION = get_version()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    init_db()
+    with db_scope():
+        init_db()
     start_scheduler()
     yield
     # Shutdown
-    pass
+    close_pool()
 
-app = FastAPI(title="Fund Intraday Valuation API", lifespan=lifespan)
+app = FastAPI(title="Fund Intraday Valuation API", lifespan=lifespan, default_response_class=DefaultResponse)
 
 # Request size limit middleware
 app.add_middleware(RequestSizeLimitMiddleware)
 
+# Response cache + conditional GET for read endpoints
+app.add_middleware(ResponseCacheMiddleware)
+
 # CORS: allow all for MVP
 app.add_middleware(
     CORSMiddleware,
@@ -126,6 +364,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Negotiated zstd/gzip compression (after cache and CORS, so their headers are already set)
+app.add_middleware(CompressionMiddleware)
+
+# One pooled connection per request, returned when the response completes (outermost)
+app.add_middleware(DBScopeMiddleware)
+
 # API routes
 app.include_router(system.router, prefix="/api")  # System routes (no auth required)
 app.include_router(auth.router, prefix="/api")
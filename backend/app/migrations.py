@@ -0,0 +1,660 @@
+"""
+Versioned, non-destructive schema migrations.
+
+Each migration has a version, a transactional step and optional online index
+builds. Migrations are applied in version order; every step must be
+idempotent (IF NOT EXISTS / IF EXISTS) so a migration interrupted half-way
+can simply run again. The transactional step and its schema_version row are
+committed together. Online indexes are built after the transactional step:
+CREATE INDEX CONCURRENTLY on PostgreSQL (outside any transaction, so writers
+are not blocked), a plain CREATE INDEX on SQLite. Index builds are idempotent
+and every migration's indexes are checked at each startup, so a build
+interrupted by a crash is completed on the next start.
+
+Adding a schema change: append a new @migration with the next version number.
+Never edit a migration that has shipped, and keep migrations self-contained:
+copy any logic they need here rather than importing services, whose code
+keeps changing.
+"""
+import logging
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .dialect import begin_write, bulk_insert, column_exists, is_postgres, list_tables, table_exists
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OnlineIndex:
+    """Index built without holding a write lock on PostgreSQL."""
+    name: str
+    table: str
+    columns: str
+    where: Optional[str] = None
+    unique: bool = False
+    # Access method (e.g. "gin"); PostgreSQL-only, such indexes are skipped on SQLite
+    method: Optional[str] = None
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    apply: Callable
+    indexes: Tuple[OnlineIndex, ...] = field(default_factory=tuple)
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str, indexes: Tuple[OnlineIndex, ...] = ()):
+    """Register a migration step (cursor) -> None."""
+    def decorator(fn):
+        MIGRATIONS.append(Migration(version, description, fn, tuple(indexes)))
+        return fn
+    return decorator
+
+
+# ============================================================================
+# Migrations
+# ============================================================================
+
+@migration(1, "baseline multi-user schema")
+def _v1_baseline(cursor):
+    # ============================================================================
+    # Multi-user tables
+    # ============================================================================
+
+    # Users table - store user accounts
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            is_admin INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+
+    # Accounts table - store fund accounts (multi-account support)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(name, user_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_accounts_user_id ON accounts(user_id)")
+
+    # ============================================================================
+    # Fund data tables
+    # ============================================================================
+
+    # Funds table - store fund basic info
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS funds (
+            code TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            type TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_funds_name ON funds(name)")
+
+    # Positions table - store user holdings (per account)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS positions (
+            account_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            cost REAL NOT NULL DEFAULT 0.0,
+            shares REAL NOT NULL DEFAULT 0.0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (account_id, code),
+            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_positions_account_id ON positions(account_id)")
+
+    # Transactions table - add/reduce position log (per account)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            op_type TEXT NOT NULL,
+            amount_cny REAL,
+            shares_redeemed REAL,
+            confirm_date TEXT NOT NULL,
+            confirm_nav REAL,
+            shares_added REAL,
+            cost_after REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            applied_at TIMESTAMP,
+            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_account_id ON transactions(account_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_code ON transactions(code)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_confirm_date ON transactions(confirm_date)")
+
+    # Fund history table - cache historical NAV data (shared across users)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fund_history (
+            code TEXT NOT NULL,
+            date TEXT NOT NULL,
+            nav REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (code, date)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fund_history_code ON fund_history(code)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fund_history_date ON fund_history(date)")
+
+    # Intraday snapshots table - store intraday valuation data (shared across users)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fund_intraday_snapshots (
+            fund_code TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            estimate REAL NOT NULL,
+            PRIMARY KEY (fund_code, date, time)
+        )
+    """)
+
+    # ============================================================================
+    # User-specific tables
+    # ============================================================================
+
+    # Subscriptions table - store email alert settings (per user)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL,
+            email TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            threshold_up REAL,
+            threshold_down REAL,
+            enable_digest INTEGER DEFAULT 0,
+            digest_time TEXT DEFAULT '14:45',
+            enable_volatility INTEGER DEFAULT 1,
+            last_notified_at TIMESTAMP,
+            last_digest_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(code, email, user_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_user_id ON subscriptions(user_id)")
+
+    # Settings table - store configuration (system-level: user_id=NULL, user-level: user_id=<id>)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT NOT NULL,
+            value TEXT,
+            encrypted INTEGER DEFAULT 0,
+            user_id INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (key, user_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_settings_user_id ON settings(user_id)")
+
+    # AI prompts table - store custom AI prompts (per user)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ai_prompts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(name, user_id),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ai_prompts_user_id ON ai_prompts(user_id)")
+
+    # AI analysis history table - store AI analysis results (per user)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ai_analysis_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            fund_code TEXT NOT NULL,
+            fund_name TEXT NOT NULL,
+            prompt_id INTEGER,
+            prompt_name TEXT NOT NULL,
+            markdown TEXT NOT NULL,
+            indicators_json TEXT,
+            status TEXT NOT NULL CHECK(status IN ('success', 'failed')) DEFAULT 'success',
+            error_message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_analysis_history_main
+        ON ai_analysis_history(user_id, account_id, fund_code, created_at DESC)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_analysis_history_prompt
+        ON ai_analysis_history(user_id, prompt_id, created_at DESC)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_analysis_history_user_id
+        ON ai_analysis_history(user_id, id)
+    """)
+
+
+@migration(2, "NAV publication log")
+def _v2_nav_publications(cursor):
+    # NAV publication log - when each fund's NAV for a date was first obtained (shared across users)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS nav_publications (
+            code TEXT NOT NULL,
+            nav_date TEXT NOT NULL,
+            obtained_at TEXT NOT NULL,
+            PRIMARY KEY (code, nav_date)
+        )
+    """)
+
+
+@migration(3, "hot-path indexes", indexes=(
+    # process_pending_transactions: WHERE applied_at IS NULL ... ORDER BY confirm_date, id
+    OnlineIndex("idx_transactions_pending", "transactions", "confirm_date, id", where="applied_at IS NULL"),
+    # Scheduler: SELECT DISTINCT code FROM positions WHERE shares > 0
+    OnlineIndex("idx_positions_held_code", "positions", "code", where="shares > 0"),
+))
+def _v3_hot_path_indexes(cursor):
+    # (code) is a prefix of the (code, date) primary key; the extra index only costs writes
+    cursor.execute("DROP INDEX IF EXISTS idx_fund_history_code")
+
+
+# Intraday storage layout as of v4/v5, frozen here so later changes to
+# services/intraday_store.py cannot alter what these migrations do.
+_INTRADAY_PARTITION_RE = re.compile(r"^fund_intraday_(\d{8})$")
+_BUCKET_MINUTES = 15
+
+
+def _day(date_str: str) -> int:
+    return int(date_str[:10].replace("-", ""))
+
+
+def _minute(time_str: str) -> int:
+    hh, mm = time_str[:5].split(":")
+    return int(hh) * 60 + int(mm)
+
+
+def _v4_ensure_partition(cursor, date_str: str) -> str:
+    name = f"fund_intraday_{_day(date_str)}"
+    if is_postgres():
+        day = _day(date_str)
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF fund_intraday "
+            f"FOR VALUES FROM ({day}) TO ({day + 1})"
+        )
+    else:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                fund_id INTEGER NOT NULL,
+                minute INTEGER NOT NULL,
+                estimate REAL NOT NULL,
+                PRIMARY KEY (fund_id, minute)
+            ) WITHOUT ROWID
+        """)
+    return name
+
+
+def _v4_fund_ids(cursor, codes) -> Dict[str, int]:
+    codes = sorted({c for c in codes if c})
+    if not codes:
+        return {}
+    bulk_insert(cursor, "fund_ids", ("code",), [(c,) for c in codes], on_conflict="ignore")
+    placeholders = ",".join("?" * len(codes))
+    cursor.execute(f"SELECT id, code FROM fund_ids WHERE code IN ({placeholders})", codes)
+    return {row["code"]: row["id"] for row in cursor.fetchall()}
+
+
+@migration(4, "day-partitioned intraday snapshot storage")
+def _v4_intraday_partitions(cursor):
+    # fund_intraday_snapshots (TEXT code/date/time per row) -> fund_ids + per-day partitions
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fund_ids (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL UNIQUE
+        )
+    """)
+    if is_postgres():
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fund_intraday (
+                day INTEGER NOT NULL,
+                fund_id INTEGER NOT NULL,
+                minute SMALLINT NOT NULL,
+                estimate REAL NOT NULL,
+                PRIMARY KEY (day, fund_id, minute)
+            ) PARTITION BY RANGE (day)
+        """)
+
+    if not table_exists(cursor, "fund_intraday_snapshots"):
+        return
+    cursor.execute("SELECT fund_code, date, time, estimate FROM fund_intraday_snapshots ORDER BY date")
+    by_date: Dict[str, list] = {}
+    for row in cursor.fetchall():
+        by_date.setdefault(row["date"], []).append((row["fund_code"], row["time"], row["estimate"]))
+
+    moved = 0
+    for date_str, rows in by_date.items():
+        table = _v4_ensure_partition(cursor, date_str)
+        ids = _v4_fund_ids(cursor, (r[0] for r in rows))
+        if is_postgres():
+            day = _day(date_str)
+            bulk_insert(cursor, "fund_intraday", ("day", "fund_id", "minute", "estimate"),
+                        [(day, ids[code], _minute(t), float(est)) for code, t, est in rows],
+                        on_conflict="replace")
+        else:
+            bulk_insert(cursor, table, ("fund_id", "minute", "estimate"),
+                        [(ids[code], _minute(t), float(est)) for code, t, est in rows],
+                        on_conflict="replace")
+        moved += len(rows)
+
+    cursor.execute("DROP TABLE fund_intraday_snapshots")
+    logger.info(f"Moved {moved} intraday snapshots into {len(by_date)} day partitions")
+
+
+def _v5_rollup_day(cursor, table: str, day: int) -> None:
+    """15-minute OHLC and daily summary for one raw partition"""
+    cursor.execute(f"SELECT fund_id, minute, estimate FROM {table} ORDER BY fund_id, minute")
+    bars: Dict[Tuple[int, int], List[float]] = {}
+    for row in cursor.fetchall():
+        key = (row["fund_id"], row["minute"] - row["minute"] % _BUCKET_MINUTES)
+        est = float(row["estimate"])
+        bar = bars.get(key)
+        if bar is None:
+            bars[key] = [est, est, est, est]
+        else:
+            bar[1] = max(bar[1], est)
+            bar[2] = min(bar[2], est)
+            bar[3] = est
+    if not bars:
+        return
+
+    summary: Dict[int, List[float]] = {}
+    for (fid, _), bar in sorted(bars.items()):
+        s = summary.get(fid)
+        if s is None:
+            summary[fid] = list(bar)
+        else:
+            s[1] = max(s[1], bar[1])
+            s[2] = min(s[2], bar[2])
+            s[3] = bar[3]
+
+    bulk_insert(cursor, "fund_intraday_15m", ("fund_id", "day", "bucket", "open", "high", "low", "close"),
+                [(fid, day, bucket, *bar) for (fid, bucket), bar in bars.items()],
+                on_conflict="replace")
+    bulk_insert(cursor, "fund_intraday_daily", ("fund_id", "day", "open", "high", "low", "close"),
+                [(fid, day, *s) for fid, s in summary.items()],
+                on_conflict="replace")
+
+
+@migration(5, "intraday rollup tiers")
+def _v5_intraday_rollups(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fund_intraday_15m (
+            fund_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            bucket SMALLINT NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            PRIMARY KEY (fund_id, day, bucket)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fund_intraday_daily (
+            fund_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            PRIMARY KEY (fund_id, day)
+        ) WITHOUT ROWID
+    """)
+    # Backfill from the raw partitions that already exist
+    for table in sorted(list_tables(cursor)):
+        m = _INTRADAY_PARTITION_RE.match(table)
+        if m:
+            _v5_rollup_day(cursor, table, int(m.group(1)))
+
+
+@migration(6, "substring search index on funds", indexes=(
+    # LIKE '%q%' on PostgreSQL is served by trigram GIN indexes
+    OnlineIndex("idx_funds_code_trgm", "funds", "code gin_trgm_ops", method="gin"),
+    OnlineIndex("idx_funds_name_trgm", "funds", "name gin_trgm_ops", method="gin"),
+))
+def _v6_fund_search(cursor):
+    if is_postgres():
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        return
+    # SQLite: external-content FTS5 table over funds, rebuilt after each fund list refresh
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS funds_fts USING fts5(
+                code, name, content='funds', content_rowid='rowid', tokenize='trigram'
+            )
+        """)
+    except Exception as e:
+        logger.warning(f"FTS5 trigram tokenizer unavailable (SQLite {sqlite3.sqlite_version}), fund search stays on LIKE: {e}")
+        return
+    cursor.execute("INSERT INTO funds_fts(funds_fts) VALUES('rebuild')")
+
+
+@migration(7, "denormalized fund category", indexes=(
+    OnlineIndex("idx_funds_category", "funds", "category"),
+))
+def _v7_fund_category(cursor):
+    # Category rules as of v7 (services/fund_categories.py may evolve independently)
+    rules = [
+        ("货币类", re.compile(r"^货币(?:型|$)")),
+        ("偏债类", re.compile(r"^(?:债券型-|混合型-偏债|混合型-绝对收益|QDII-纯债|QDII-混合债|指数型-固收)|^债券$")),
+        ("商品类", re.compile(r"商品|REITs|Reits")),
+        ("偏股类", re.compile(
+            r"股票型|混合型-偏股|混合型-平衡|混合型-灵活|指数型-股票|指数型-海外股票|指数型-其他"
+            r"|QDII-普通股票|QDII-混合偏股|QDII-混合平衡|QDII-混合灵活|FOF-|QDII-FOF"
+        )),
+    ]
+
+    def classify_fund_type(fund_type):
+        if not fund_type:
+            return "未分类"
+        for category, pattern in rules:
+            if pattern.search(fund_type):
+                return category
+        return "未分类"
+
+    if not column_exists(cursor, "funds", "category"):
+        cursor.execute("ALTER TABLE funds ADD COLUMN category TEXT")
+    # Few distinct types: classify each once and update by type
+    cursor.execute("SELECT DISTINCT type FROM funds")
+    types = [row[0] for row in cursor.fetchall()]
+    cursor.executemany(
+        "UPDATE funds SET category = ? WHERE type = ?",
+        [(classify_fund_type(t), t) for t in types if t]
+    )
+    cursor.execute("UPDATE funds SET category = ? WHERE type IS NULL OR type = ''", (classify_fund_type(None),))
+
+
+@migration(8, "precomputed per-account summary")
+def _v8_account_summary(cursor):
+    # 汇总在首次读取或持仓/估值变化时补算，这里只建表
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS account_summary (
+            account_id INTEGER PRIMARY KEY,
+            total_market_value REAL NOT NULL DEFAULT 0.0,
+            total_cost REAL NOT NULL DEFAULT 0.0,
+            total_day_income REAL NOT NULL DEFAULT 0.0,
+            total_income REAL NOT NULL DEFAULT 0.0,
+            total_return_rate REAL NOT NULL DEFAULT 0.0,
+            position_count INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 1,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+        )
+    """)
+
+
+@migration(9, "materialized per-user aggregate holdings")
+def _v9_user_holdings(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_holdings (
+            user_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            shares REAL NOT NULL,
+            cost_basis REAL NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, code),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("DELETE FROM user_holdings")
+    cursor.execute("""
+        INSERT INTO user_holdings (user_id, code, shares, cost_basis)
+        SELECT a.user_id, p.code, SUM(p.shares), SUM(p.shares * p.cost)
+        FROM positions p
+        JOIN accounts a ON a.id = p.account_id
+        WHERE p.shares > 0
+        GROUP BY a.user_id, p.code
+    """)
+
+
+@migration(10, "double-precision REAL columns on PostgreSQL")
+def _v10_widen_real(cursor):
+    # Tables created before the dialect mapped REAL to DOUBLE PRECISION hold float4
+    # (about 7 significant digits). SQLite REAL is already 8 bytes.
+    if not is_postgres():
+        return
+    cursor.execute("""
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND data_type = 'real'
+        ORDER BY table_name, column_name
+    """)
+    for table, column in [(row[0], row[1]) for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE DOUBLE PRECISION")
+
+
+CURRENT_SCHEMA_VERSION = max(m.version for m in MIGRATIONS)
+
+
+# ============================================================================
+# Runner
+# ============================================================================
+
+def _ensure_schema_version_table(conn) -> None:
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+
+def _applied_versions(conn) -> set:
+    cursor = conn.cursor()
+    cursor.execute("SELECT version FROM schema_version")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _build_online_index(conn, index: OnlineIndex) -> None:
+    unique = "UNIQUE " if index.unique else ""
+    where = f" WHERE {index.where}" if index.where else ""
+
+    if not is_postgres():
+        if index.method:
+            return
+        conn.execute(f"CREATE {unique}INDEX IF NOT EXISTS {index.name} ON {index.table}({index.columns}){where}")
+        conn.commit()
+        return
+
+    # CONCURRENTLY cannot run inside a transaction block
+    raw = conn.raw
+    raw.commit()
+    raw.autocommit = True
+    try:
+        cur = raw.cursor()
+        # A failed concurrent build leaves an INVALID index that IF NOT EXISTS would skip forever
+        cur.execute("""
+            SELECT i.indisvalid FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s
+        """, (index.name,))
+        row = cur.fetchone()
+        if row is not None and not row[0]:
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}")
+        using = f" USING {index.method}" if index.method else ""
+        cur.execute(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {index.table}{using} ({index.columns}){where}")
+        cur.close()
+    finally:
+        raw.autocommit = False
+
+
+def apply_migrations(conn) -> int:
+    """
+    Apply all pending migrations in version order.
+
+    Returns:
+        int: Number of migrations applied
+    """
+    _ensure_schema_version_table(conn)
+    applied = _applied_versions(conn)
+    current = max(applied) if applied else 0
+    logger.info(f"Current database schema version: {current}")
+
+    if current > CURRENT_SCHEMA_VERSION:
+        logger.warning(
+            f"Database schema version {current} is newer than this build ({CURRENT_SCHEMA_VERSION}); "
+            f"leaving schema untouched"
+        )
+        return 0
+
+    count = 0
+    for m in sorted(MIGRATIONS, key=lambda m: m.version):
+        if m.version in applied:
+            continue
+
+        logger.info(f"Applying migration {m.version}: {m.description}")
+        try:
+            begin_write(conn)
+            cursor = conn.cursor()
+            m.apply(cursor)
+            cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (m.version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Migration {m.version} failed, rolled back")
+            raise
+        applied.add(m.version)
+        count += 1
+
+    # Online indexes of every applied migration (IF NOT EXISTS: cheap once built)
+    for m in sorted(MIGRATIONS, key=lambda m: m.version):
+        if m.version in applied:
+            for index in m.indexes:
+                _build_online_index(conn, index)
+
+    if count:
+        logger.info(f"Applied {count} migrations, schema now at version {CURRENT_SCHEMA_VERSION}")
+    return count
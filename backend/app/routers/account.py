@@ -1,13 +1,24 @@
-from fastapi import APIRouter, HTTPException, Body, Query, Depends
+from fastapi import APIRouter, HTTPException, Body, Query, Depends, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Iterator, Optional, List
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+import hashlib
+import itertools
 import logging
 
 from ..services.account import get_all_positions, upsert_position, remove_position
+from ..services.portfolio import (
+    stream_accounts, stream_user, value_user, load_holdings, load_user_holdings, LivePortfolio,
+)
+from ..services import valuation_hub, account_summary
 from ..services.trade import add_position_trade, reduce_position_trade, list_transactions
-from ..db import get_db_connection
+from ..db import get_db_connection, release_db_connection
+from ..dialect import is_unique_violation
 from ..auth import User, require_auth, get_current_user
-from ..utils import verify_account_ownership
+from ..utils import verify_account_ownership, encode_frame, STREAM_HEADERS, SSE_KEEPALIVE
 
 logger = logging.getLogger(__name__)
 
@@ -68,7 +79,7 @@ def create_account(data: AccountModel, current_user: User = Depends(require_auth
     except HTTPException:
         raise
     except Exception as e:
-        if "UNIQUE constraint failed" in str(e):
+        if is_unique_violation(e):
             raise HTTPException(status_code=400, detail="账户名称已存在")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -93,7 +104,7 @@ def update_account(
         
         return {"status": "ok"}
     except Exception as e:
-        if "UNIQUE constraint failed" in str(e):
+        if is_unique_violation(e):
             raise HTTPException(status_code=400, detail="账户名称已存在")
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -115,6 +126,7 @@ def delete_account(account_id: int, current_user: User = Depends(require_auth)):
 
             raise HTTPException(status_code=400, detail="账户下有持仓，无法删除")
 
+        cursor.execute("DELETE FROM account_summary WHERE account_id = ?", (account_id,))
         cursor.execute("DELETE FROM accounts WHERE id = ?", (account_id,))
         conn.commit()
 
@@ -125,242 +137,248 @@ def delete_account(account_id: int, current_user: User = Depends(require_auth)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Summary endpoints
+def _summary_response(request: Request, rows: List[Dict[str, Any]]) -> Response:
+    """
+    账户汇总响应：ETag 取各账户汇总的 version，Last-Modified 取最近一次变化时间。
+    If-None-Match 优先于 If-Modified-Since，命中返回 304。
+    """
+    etag = '"' + hashlib.sha1(
+        ",".join(f"{row['account_id']}:{row['version']}" for row in rows).encode("utf-8")
+    ).hexdigest()[:16] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    last_modified = None
+    if rows:
+        last_modified = max(datetime.fromisoformat(row["updated_at"].replace("Z", "+00:00")) for row in rows)
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match == etag:
+            return Response(status_code=304, headers=headers)
+    elif last_modified is not None and request.headers.get("if-modified-since"):
+        try:
+            if last_modified.replace(microsecond=0) <= parsedate_to_datetime(request.headers["if-modified-since"]):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    body = {
+        "summary": account_summary.combine(rows),
+        "position_count": sum(row["position_count"] for row in rows),
+        "updated_at": max((row["updated_at"] for row in rows), default=None),
+    }
+    return JSONResponse(body, headers=headers)
+
+
+@router.get("/account/summary")
+def get_account_summary(
+    request: Request,
+    account_id: int = Query(..., description="账户 ID"),
+    current_user: User = Depends(require_auth)
+):
+    """获取指定账户的预计算汇总（顶栏数字），支持 ETag / Last-Modified 条件请求"""
+    # 验证所有权
+    verify_account_ownership(account_id, current_user)
+
+    try:
+        return _summary_response(request, account_summary.get_summaries([account_id]))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/accounts/summary")
+def get_accounts_summary(request: Request, current_user: User = Depends(require_auth)):
+    """获取当前用户所有账户合计的预计算汇总，支持 ETag / Last-Modified 条件请求"""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM accounts WHERE user_id = ?", (current_user.id,))
+        account_ids = [row["id"] for row in cursor.fetchall()]
+        return _summary_response(request, account_summary.get_summaries(account_ids))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Position endpoints
 @router.get("/positions/aggregate")
-def get_aggregate_positions(current_user: User = Depends(require_auth)):
+def get_aggregate_positions(
+    category: Optional[str] = Query(None, description="按分类过滤"),
+    format: str = Query("rows", pattern="^(rows|columnar)$", description="positions 布局：rows 或 columnar"),
+    max_age: int = Query(0, ge=0, le=120, description="盘中快照可用的最大分钟数，0 表示全部实时拉取"),
+    current_user: User = Depends(require_auth)
+):
     """获取当前用户所有账户的聚合持仓"""
     try:
-        # 获取用户的所有账户
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # 读物化的跨账户聚合持仓（每只基金一行）后统一估值
+        return value_user(current_user.id, category, columnar=format == "columnar", max_age=max_age)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        cursor.execute("SELECT id FROM accounts WHERE user_id = ?", (current_user.id,))
 
-        account_ids = [row["id"] for row in cursor.fetchall()]
-        
+@router.get("/account/positions")
+def get_positions(
+    account_id: int = Query(..., description="账户 ID"),
+    category: Optional[str] = Query(None, description="按分类过滤（货币类/偏债类/偏股类/商品类/未分类）"),
+    format: str = Query("rows", pattern="^(rows|columnar)$", description="positions 布局：rows 或 columnar"),
+    max_age: int = Query(0, ge=0, le=120, description="盘中快照可用的最大分钟数，0 表示全部实时拉取"),
+    current_user: User = Depends(require_auth)
+):
+    """获取指定账户的持仓"""
+    # 验证所有权
+    verify_account_ownership(account_id, current_user)
 
-        if not account_ids:
-            return {
-                "summary": {
-                    "total_market_value": 0.0,
-                    "total_cost": 0.0,
-                    "total_day_income": 0.0,
-                    "total_income": 0.0,
-                    "total_return_rate": 0.0
-                },
-                "positions": []
-            }
-
-        # 获取所有账户的持仓并聚合
-        from ..services.account import get_combined_valuation, get_fund_type
-        from concurrent.futures import ThreadPoolExecutor, as_completed
+    try:
+        return get_all_positions(account_id, current_user.id, category=category,
+                                 columnar=format == "columnar", max_age=max_age)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+def _stream_positions(frames: Iterator[Dict[str, Any]], fmt: str) -> StreamingResponse:
+    """
+    把估值帧写成 NDJSON（每行一个 JSON）或 SSE（event: 帧类型）。
 
-        # 获取所有持仓
-        # Defensive: Limit batch size to prevent SQL statement overflow
-        if len(account_ids) > 100:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Too many accounts ({len(account_ids)}), maximum 100 allowed"
-            )
+    首帧（骨架）在返回响应前同步取出，查库错误仍以 HTTP 错误返回。
+    """
+    try:
+        first = next(frames)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        placeholders = ",".join("?" * len(account_ids))
-        cursor.execute(
-            f"SELECT * FROM positions WHERE account_id IN ({placeholders}) AND shares > 0",
-            account_ids
-        )
-        rows = cursor.fetchall()
-        
+    def body():
+        try:
+            for frame in itertools.chain([first], frames):
+                yield encode_frame(frame, fmt)
+        except Exception as e:
+            logger.error(f"Position stream aborted: {e}")
+            yield encode_frame({"type": "error", "detail": str(e)}, fmt)
+        finally:
+            frames.close()
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if fmt == "sse" else "application/x-ndjson",
+        headers=STREAM_HEADERS,
+    )
+
+
+@router.get("/positions/aggregate/stream")
+def stream_aggregate_positions(
+    category: Optional[str] = Query(None, description="按分类过滤"),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$", description="流格式：ndjson 或 sse"),
+    max_age: int = Query(0, ge=0, le=120, description="盘中快照可用的最大分钟数，0 表示全部实时拉取"),
+    current_user: User = Depends(require_auth)
+):
+    """流式返回当前用户所有账户的聚合持仓（帧格式见 portfolio.stream_holdings）"""
+    try:
+        return _stream_positions(stream_user(current_user.id, category, max_age), format)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # 按基金代码聚合
-        code_positions = {}
-        for row in rows:
-            code = row["code"]
-            if code not in code_positions:
-                code_positions[code] = {
-                    "cost": 0.0,
-                    "shares": 0.0,
-                    "total_cost_basis": 0.0
-                }
-            # 累加份额和成本基础
-            shares = float(row["shares"])
-            cost = float(row["cost"])
-            code_positions[code]["shares"] += shares
-            code_positions[code]["total_cost_basis"] += shares * cost
-
-        # 计算加权平均成本
-        position_map = {}
-        for code, data in code_positions.items():
-            if data["shares"] > 0:
-                weighted_avg_cost = data["total_cost_basis"] / data["shares"]
-                position_map[code] = {
-                    "code": code,
-                    "cost": weighted_avg_cost,
-                    "shares": data["shares"]
-                }
-
-        # 获取实时估值（复用 get_all_positions 的逻辑）
-        positions = []
-        total_market_value = 0.0
-        total_cost = 0.0
-        total_day_income = 0.0
-
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_code = {
-                executor.submit(get_combined_valuation, code): code
-                for code in position_map.keys()
-            }
-
-            for future in as_completed(future_to_code):
-                code = future_to_code[future]
-                row = position_map[code]
-
-                try:
-                    data = future.result() or {}
-                    name = data.get("name")
-                    fund_type = None
-
-                    if not name:
-                        conn_temp = get_db_connection()
-                        try:
-                            cursor_temp = conn_temp.cursor()
-                            cursor_temp.execute("SELECT name, type FROM funds WHERE code = ?", (code,))
-                            db_row = cursor_temp.fetchone()
-                            if db_row:
-                                name = db_row["name"]
-                                fund_type = db_row["type"]
-                            else:
-                                name = code
-                        finally:
-                            conn_temp.close()
-
-                    if not fund_type:
-                        fund_type = get_fund_type(code, name)
-
-                    from datetime import datetime
-                    today_str = datetime.now().strftime("%Y-%m-%d")
-                    conn_temp = get_db_connection()
-                    try:
-                        cursor_temp = conn_temp.cursor()
-                        cursor_temp.execute(
-                            "SELECT date FROM fund_history WHERE code = ? ORDER BY date DESC LIMIT 1",
-                            (code,)
-                        )
-                        latest_nav_row = cursor_temp.fetchone()
-                        nav_updated_today = latest_nav_row and latest_nav_row["date"] == today_str
-                    finally:
-                        conn_temp.close()
-
-                    nav = float(data.get("nav", 0.0))
-                    estimate = float(data.get("estimate", 0.0))
-                    current_price = estimate if estimate > 0 else nav
-
-                    cost = float(row["cost"])
-                    shares = float(row["shares"])
-
-                    nav_market_value = nav * shares
-                    cost_basis = cost * shares
-
-                    est_rate = data.get("est_rate", data.get("estRate", 0.0))
-
-                    is_est_valid = False
-                    if estimate > 0 and nav > 0:
-                        if abs(est_rate) < 10.0 or "ETF" in name or "联接" in name:
-                            is_est_valid = True
-
-                    accumulated_income = nav_market_value - cost_basis
-                    accumulated_return_rate = (accumulated_income / cost_basis * 100) if cost_basis > 0 else 0.0
-
-                    if is_est_valid:
-                        day_income = (estimate - nav) * shares
-                        est_market_value = estimate * shares
-                    else:
-                        day_income = 0.0
-                        est_market_value = nav_market_value
-
-                    total_income = accumulated_income + day_income
-                    total_return_rate = (total_income / cost_basis * 100) if cost_basis > 0 else 0.0
-
-                    positions.append({
-                        "code": code,
-                        "name": name,
-                        "type": fund_type,
-                        "cost": cost,
-                        "shares": shares,
-                        "nav": nav,
-                        "nav_date": data.get("navDate", "--"),
-                        "nav_updated_today": nav_updated_today,
-                        "estimate": estimate,
-                        "est_rate": est_rate,
-                        "is_est_valid": is_est_valid,
-                        "cost_basis": round(cost_basis, 2),
-                        "nav_market_value": round(nav_market_value, 2),
-                        "est_market_value": round(est_market_value, 2),
-                        "accumulated_income": round(accumulated_income, 2),
-                        "accumulated_return_rate": round(accumulated_return_rate, 2),
-                        "day_income": round(day_income, 2),
-                        "total_income": round(total_income, 2),
-                        "total_return_rate": round(total_return_rate, 2),
-                        "update_time": data.get("time", "--")
-                    })
-
-                    total_market_value += est_market_value
-                    total_day_income += day_income
-                    total_cost += cost_basis
-
-                except Exception as e:
-                    logger.error(f"Error processing position {code}: {e}")
-                    positions.append({
-                        "code": code,
-                        "name": "Error",
-                        "cost": float(row["cost"]),
-                        "shares": float(row["shares"]),
-                        "nav": 0.0,
-                        "estimate": 0.0,
-                        "est_market_value": 0.0,
-                        "day_income": 0.0,
-                        "total_income": 0.0,
-                        "total_return_rate": 0.0,
-                        "accumulated_income": 0.0,
-                        "est_rate": 0.0,
-                        "is_est_valid": False,
-                        "update_time": "--"
-                    })
-
-        total_income = total_market_value - total_cost
-        total_return_rate = (total_income / total_cost * 100) if total_cost > 0 else 0.0
 
-        return {
-            "summary": {
-                "total_market_value": round(total_market_value, 2),
-                "total_cost": round(total_cost, 2),
-                "total_day_income": round(total_day_income, 2),
-                "total_income": round(total_income, 2),
-                "total_return_rate": round(total_return_rate, 2)
-            },
-            "positions": sorted(positions, key=lambda x: x["est_market_value"], reverse=True)
-        }
+@router.get("/account/positions/stream")
+def stream_positions(
+    account_id: int = Query(..., description="账户 ID"),
+    category: Optional[str] = Query(None, description="按分类过滤（货币类/偏债类/偏股类/商品类/未分类）"),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$", description="流格式：ndjson 或 sse"),
+    max_age: int = Query(0, ge=0, le=120, description="盘中快照可用的最大分钟数，0 表示全部实时拉取"),
+    current_user: User = Depends(require_auth)
+):
+    """
+    流式返回指定账户的持仓：先推确认净值骨架，再逐只推实时估值，最后推汇总。
+    """
+    # 验证所有权
+    verify_account_ownership(account_id, current_user)
+
+    try:
+        return _stream_positions(stream_accounts([account_id], category, max_age), format)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# 心跳间隔（秒）
+LIVE_HEARTBEAT = 20
 
-@router.get("/account/positions")
-def get_positions(
+
+def _live_positions(view: LivePortfolio) -> StreamingResponse:
+    """
+    SSE：订阅推送中心中该视图的基金，先推骨架（确认净值 + 已缓存的实时估值），
+    之后每批估值变化推送变化的持仓行及新的汇总。帧格式同 stream_holdings。
+    """
+    # 视图已从库中加载完毕，长连接期间不再占用连接池
+    release_db_connection()
+
+    def skeleton():
+        for code, data in valuation_hub.get_cached(view.codes).items():
+            view.update(code, data)
+        return view.snapshot()
+
+    def apply(updates):
+        rows = [view.update(code, data) for code, data in updates.items()]
+        return rows, view.snapshot()["summary"]
+
+    async def events():
+        sub = valuation_hub.subscribe(view.codes)
+        try:
+            # 估值计算（NumPy）放在线程池，不阻塞事件循环
+            yield encode_frame({"type": "skeleton", **await run_in_threadpool(skeleton)})
+            while True:
+                updates = await sub.get(timeout=LIVE_HEARTBEAT)
+                if updates is None:
+                    yield SSE_KEEPALIVE
+                    continue
+                rows, summary = await run_in_threadpool(apply, updates)
+                for row in rows:
+                    yield encode_frame({"type": "position", "position": row})
+                yield encode_frame({"type": "summary", "summary": summary})
+        finally:
+            valuation_hub.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=STREAM_HEADERS)
+
+
+@router.get("/positions/aggregate/live")
+def live_aggregate_positions(
+    category: Optional[str] = Query(None, description="按分类过滤"),
+    current_user: User = Depends(require_auth)
+):
+    """SSE 推送当前用户所有账户的聚合持仓（估值变化时推送增量）"""
+    try:
+        return _live_positions(LivePortfolio(load_user_holdings(current_user.id, category)))
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/account/positions/live")
+def live_positions(
     account_id: int = Query(..., description="账户 ID"),
+    category: Optional[str] = Query(None, description="按分类过滤（货币类/偏债类/偏股类/商品类/未分类）"),
     current_user: User = Depends(require_auth)
 ):
-    """获取指定账户的持仓"""
+    """SSE 推送指定账户的持仓（估值变化时推送增量）"""
     # 验证所有权
     verify_account_ownership(account_id, current_user)
 
     try:
-        return get_all_positions(account_id, current_user.id)
+        return _live_positions(LivePortfolio(load_holdings([account_id], category)))
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
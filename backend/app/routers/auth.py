@@ -18,6 +18,8 @@ from ..auth import (
     SESSION_EXPIRY_DAYS
 )
 from ..db import get_db_connection, check_database_version, CURRENT_SCHEMA_VERSION
+from ..dialect import is_unique_violation
+from ..services.account import sync_user_holdings
 
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -166,7 +168,7 @@ def init_admin(request: InitAdminRequest):
         }
     except Exception as e:
         conn.rollback()
-        if "UNIQUE constraint failed" in str(e):
+        if is_unique_violation(e):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="用户名已存在"
@@ -616,8 +618,13 @@ def delete_user(user_id: int, admin: User = Depends(require_admin)):
         WHERE account_id IN (SELECT id FROM accounts WHERE user_id = ?)
     """, (user_id,))
 
-    # 3. 删除用户的账户
+    # 3. 删除账户汇总与用户的账户，并重算聚合持仓（此时为空）
+    cursor.execute("""
+        DELETE FROM account_summary
+        WHERE account_id IN (SELECT id FROM accounts WHERE user_id = ?)
+    """, (user_id,))
     cursor.execute("DELETE FROM accounts WHERE user_id = ?", (user_id,))
+    sync_user_holdings(cursor, user_id)
 
     # 4. 删除用户的配置
     cursor.execute("DELETE FROM settings WHERE user_id = ?", (user_id,))
@@ -1,8 +1,13 @@
 import logging
 from typing import Optional
-from fastapi import APIRouter, HTTPException, Query, Body, Depends
+from fastapi import APIRouter, HTTPException, Query, Body, Depends, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from ..services.fund import search_funds, get_fund_intraday, get_fund_history
+from ..services.fund_categories import get_snapshot as get_category_snapshot
 from ..config import Config
+from ..services import valuation_hub
+from ..services.series_codec import FORMAT_PATTERN, BINARY_MEDIA_TYPE, to_binary, to_columnar
+from ..utils import encode_frame, STREAM_HEADERS, SSE_KEEPALIVE
 from ..auth import User, get_current_user, require_auth
 
 from ..services.subscription import add_subscription
@@ -11,59 +16,21 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.get("/categories")
-def get_fund_categories():
+def get_fund_categories(request: Request):
     """
     Get all unique fund categories from database.
     Returns major categories (simplified) sorted by frequency.
-    """
-    from ..db import db_connection
-
-    with db_connection() as conn:
-        cursor = conn.cursor()
-
-        # Get all unique types with their counts
-        cursor.execute("""
-            SELECT type, COUNT(*) as count
-            FROM funds
-            WHERE type IS NOT NULL AND type != ''
-            GROUP BY type
-            ORDER BY count DESC
-        """)
-
-        rows = cursor.fetchall()
-
-    # Map to major categories
-    major_categories = {}
-    for row in rows:
-        fund_type = row["type"]
-        count = row["count"]
-
-        # Simplify to major categories
-        if "股票" in fund_type or "偏股" in fund_type:
-            major = "股票型"
-        elif "混合" in fund_type:
-            major = "混合型"
-        elif "债" in fund_type:
-            major = "债券型"
-        elif "指数" in fund_type:
-            major = "指数型"
-        elif "QDII" in fund_type:
-            major = "QDII"
-        elif "货币" in fund_type:
-            major = "货币型"
-        elif "FOF" in fund_type:
-            major = "FOF"
-        elif "REITs" in fund_type or "Reits" in fund_type:
-            major = "REITs"
-        else:
-            major = "其他"
 
-        major_categories[major] = major_categories.get(major, 0) + count
+    Served from the category cache (rebuilt when the fund list changes) with
+    an ETag; a matching If-None-Match gets 304 Not Modified.
+    """
+    snapshot = get_category_snapshot()
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
 
-    # Sort by count
-    categories = sorted(major_categories.keys(), key=lambda x: major_categories[x], reverse=True)
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status_code=304, headers=headers)
 
-    return {"categories": categories}
+    return JSONResponse({"categories": snapshot.categories}, headers=headers)
 
 @router.get("/search")
 def search(q: str = Query(..., min_length=1)):
@@ -72,6 +39,39 @@ def search(q: str = Query(..., min_length=1)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# 单个连接最多订阅的基金数
+MAX_STREAM_CODES = 200
+
+
+@router.get("/valuations/stream")
+def stream_valuations(codes: str = Query(..., description="逗号分隔的基金代码")):
+    """
+    SSE 订阅一组基金的实时估值。
+
+    首帧推送已缓存的估值，之后每当共享估值缓存中这些基金有变化，推送
+    {"type": "valuations", "valuations": {code: data}}（只含变化的基金）。
+    """
+    code_list = list(dict.fromkeys(c.strip() for c in codes.split(",") if c.strip()))
+    if not code_list:
+        raise HTTPException(status_code=400, detail="codes 不能为空")
+    if len(code_list) > MAX_STREAM_CODES:
+        raise HTTPException(status_code=400, detail=f"Too many codes ({len(code_list)}), maximum {MAX_STREAM_CODES} allowed")
+
+    async def events():
+        sub = valuation_hub.subscribe(code_list)
+        try:
+            yield encode_frame({"type": "valuations", "valuations": valuation_hub.get_cached(code_list)})
+            while True:
+                updates = await sub.get(timeout=20)
+                if updates is None:
+                    yield SSE_KEEPALIVE
+                    continue
+                yield encode_frame({"type": "valuations", "valuations": updates})
+        finally:
+            valuation_hub.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=STREAM_HEADERS)
+
 @router.get("/fund/{fund_id}")
 def fund_detail(fund_id: str):
     try:
@@ -81,16 +81,47 @@ def fund_detail(fund_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# 各序列输出的字段（columnar / binary 按此顺序成列）
+HISTORY_FIELDS = ("date", "nav")
+INTRADAY_FIELDS = {
+    "raw": ("time", "estimate"),
+    "15m": ("date", "time", "open", "high", "low", "estimate"),
+    "daily": ("date", "open", "high", "low", "estimate", "range"),
+}
+
+
+def _series_response(body: dict, key: str, fields, format: str, date_offsets: bool):
+    """
+    按 format 输出含序列的响应：body[key] 为序列行，其余字段原样保留。
+
+    - rows: 原样返回
+    - columnar: body[key] 换成列式（见 series_codec.to_columnar）
+    - binary: 二进制序列，其余字段写入头部（见 series_codec.to_binary）
+    """
+    if format == "columnar":
+        return {**body, key: to_columnar(body[key], fields, offsets=date_offsets)}
+    if format == "binary":
+        meta = {k: v for k, v in body.items() if k != key}
+        return Response(content=to_binary(body[key], fields, meta), media_type=BINARY_MEDIA_TYPE)
+    return body
+
+
 @router.get("/fund/{fund_id}/history")
 def fund_history(
     fund_id: str,
+    response: Response,
     limit: int = 30,
     account_id: int = Query(None),
+    format: str = Query("rows", pattern=FORMAT_PATTERN, description="history 编码：rows、columnar 或 binary"),
+    date_offsets: bool = Query(False, description="columnar 时日期写成相对 base_date 的天数"),
     current_user: User = Depends(require_auth)
 ):
     """
     Get historical NAV data for charts.
     Optionally include transaction markers if account_id is provided (需要验证所有权).
+
+    format=columnar 返回 {"history": {"dates": [...], "navs": [...]}, ...}，
+    format=binary 返回打包的 int32 日期偏移 + float32 净值（布局见 series_codec）。
     """
     try:
         history = get_fund_history(fund_id, limit=limit)
@@ -125,26 +156,55 @@ def fund_history(
                         "shares": float(row["shares_redeemed"]) if row["shares_redeemed"] else None
                     })
 
-        return {
+        body = {
             "history": history,
             "transactions": transactions
         }
     except Exception as e:
-        # Don't break UI if history fails
+        # Don't break UI if history fails; the empty fallback must not be cached
         print(f"History error: {e}")
-        return {"history": [], "transactions": []}
+        body = {"history": [], "transactions": []}
+        failed = True
+    else:
+        failed = False
+
+    result = _series_response(body, "history", HISTORY_FIELDS, format, date_offsets)
+    if failed:
+        (result if isinstance(result, Response) else response).headers["Cache-Control"] = "no-store"
+    return result
 
 @router.get("/fund/{fund_id}/intraday")
-def fund_intraday(fund_id: str, date: str = None):
+def fund_intraday(
+    fund_id: str,
+    date: str = None,
+    days: int = Query(1, ge=1, le=365),
+    format: str = Query("rows", pattern=FORMAT_PATTERN, description="snapshots 编码：rows、columnar 或 binary"),
+    date_offsets: bool = Query(False, description="columnar 时日期写成天数偏移、时间写成分钟数"),
+):
     """
     Get intraday valuation snapshots for charts.
     Returns today's data by default.
+
+    The storage tier follows the requested range (days, ending at date):
+    - raw: a single day whose raw partition still exists (today)
+    - 15m: up to 30 days of 15-minute OHLC bars
+    - daily: longer ranges, one close/high/low/range point per day
+
+    format=columnar / binary encode snapshots compactly (see series_codec);
+    the columns follow the tier (INTRADAY_FIELDS).
     """
-    from datetime import datetime
+    from datetime import datetime, timedelta
     from ..db import db_connection
+    from ..services.intraday_store import (
+        BAR_RETENTION_DAYS, get_series, get_bars, get_daily_summaries, has_raw
+    )
 
     if not date:
         date = datetime.now().strftime("%Y-%m-%d")
+    try:
+        start_date = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
 
     with db_connection() as conn:
         cursor = conn.cursor()
@@ -154,30 +214,33 @@ def fund_intraday(fund_id: str, date: str = None):
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail="Fund not found")
 
-        # 1. Get previous day NAV
+        # 1. Get NAV of the day before the range
         cursor.execute("""
             SELECT nav FROM fund_history
             WHERE code = ? AND date < ?
             ORDER BY date DESC
             LIMIT 1
-        """, (fund_id, date))
+        """, (fund_id, start_date))
         row = cursor.fetchone()
         prev_nav = float(row["nav"]) if row else None
 
-        # 2. Get intraday snapshots
-        cursor.execute("""
-            SELECT time, estimate FROM fund_intraday_snapshots
-            WHERE fund_code = ? AND date = ?
-            ORDER BY time ASC
-        """, (fund_id, date))
-        snapshots = [{"time": r["time"], "estimate": float(r["estimate"])} for r in cursor.fetchall()]
+        # 2. Get intraday snapshots from the matching tier
+        if days == 1 and has_raw(date):
+            tier, snapshots = "raw", get_series(fund_id, date)
+        elif days <= BAR_RETENTION_DAYS:
+            tier, snapshots = "15m", get_bars(fund_id, start_date, date)
+        else:
+            tier, snapshots = "daily", get_daily_summaries(fund_id, start_date, date)
 
-    return {
+    body = {
         "date": date,
+        "startDate": start_date,
+        "tier": tier,
         "prevNav": prev_nav,
         "snapshots": snapshots,
-        "lastCollectedAt": snapshots[-1]["time"] if snapshots else None
+        "lastCollectedAt": snapshots[-1].get("time") if snapshots else None
     }
+    return _series_response(body, "snapshots", INTRADAY_FIELDS[tier], format, date_offsets)
 
 @router.get("/fund/{fund_id}/backtest")
 def fund_backtest(fund_id: str, days: int = 20):
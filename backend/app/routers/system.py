@@ -1,14 +1,16 @@
 """
 系统管理相关 API 端点
 """
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, status, Depends
 from pydantic import BaseModel
 from ..db import (
     check_database_version,
     drop_all_tables,
     init_db,
+    get_pool_stats,
     CURRENT_SCHEMA_VERSION
 )
+from ..auth import User, require_admin
 import logging
 
 logger = logging.getLogger(__name__)
@@ -53,7 +55,9 @@ def get_db_status():
         from ..db import get_all_tables
 
         version = check_database_version()
-        needs_rebuild = version > 0 and version != CURRENT_SCHEMA_VERSION
+        # Older schemas are migrated in place on startup; only a database
+        # written by a newer build cannot be handled here
+        needs_rebuild = version > CURRENT_SCHEMA_VERSION
         table_count = len(get_all_tables())
 
         return DBStatusResponse(
@@ -70,6 +74,17 @@ def get_db_status():
         )
 
 
+@router.get("/db-pool")
+def get_db_pool_stats(current_user: User = Depends(require_admin)):
+    """
+    获取数据库连接池状态（仅管理员）
+
+    Returns:
+        dict: 连接数、等待次数/耗时、超时次数等指标
+    """
+    return get_pool_stats()
+
+
 @router.post("/rebuild-db", response_model=RebuildResponse)
 def rebuild_database():
     """
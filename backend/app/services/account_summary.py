@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+账户汇总：每个账户一行预计算的顶栏数字（account_summary 表）。
+
+- 持仓变化（upsert/remove、待确认流水应用、导入）时，在同一事务内重算该账户；
+- 新一批估值落地（盘中快照采集、净值更新）后，重算持有相关基金的账户：
+  元数据与快照只读一次，全部账户在一个事务内写入；
+- 重算只用库内数据与推送中心缓存（确认净值 + 当日最新快照），不请求上游；
+- 数值未变化时不写入，version / updated_at 不变，ETag 与 Last-Modified 随之稳定。
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List
+
+from ..db import get_db_connection
+from ..dialect import begin_write, bulk_insert
+from .portfolio import load_holdings_by_account, summarize_holdings
+from . import valuation_hub
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ("total_market_value", "total_cost", "total_day_income", "total_income", "total_return_rate")
+# 当日任意时刻的快照都比确认净值更接近实时
+SNAPSHOT_MAX_AGE = 24 * 60
+
+
+def _compute(account_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """按当前持仓与已有估值计算若干账户的汇总（纯查库，元数据与快照只读一次）"""
+    groups = load_holdings_by_account(account_ids)
+    groups = {account_id: groups.get(account_id, []) for account_id in account_ids}
+    codes = {h["code"] for holdings in groups.values() for h in holdings}
+    summaries = summarize_holdings(groups, SNAPSHOT_MAX_AGE, valuation_hub.get_cached(codes))
+    for account_id, summary in summaries.items():
+        summary["position_count"] = len(groups[account_id])
+    return summaries
+
+
+def refresh_many(cursor, account_ids: Iterable[int]) -> int:
+    """
+    在调用方事务内重算并保存若干账户的汇总（不提交），有变化的行一次写入。
+
+    Returns:
+        有变化的账户数
+    """
+    account_ids = sorted(set(account_ids))
+    if not account_ids:
+        return 0
+    summaries = _compute(account_ids)
+
+    placeholders = ",".join("?" * len(account_ids))
+    cursor.execute(f"SELECT * FROM account_summary WHERE account_id IN ({placeholders})", account_ids)
+    existing = {row["account_id"]: row for row in cursor.fetchall()}
+
+    updated_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    rows = []
+    for account_id in account_ids:
+        summary = summaries[account_id]
+        values = tuple(summary[f] for f in SUMMARY_FIELDS) + (summary["position_count"],)
+        row = existing.get(account_id)
+        if row is not None and tuple(row[f] for f in SUMMARY_FIELDS + ("position_count",)) == values:
+            continue
+        version = row["version"] + 1 if row is not None else 1
+        rows.append((account_id,) + values + (version, updated_at))
+
+    if rows:
+        bulk_insert(
+            cursor, "account_summary",
+            ("account_id",) + SUMMARY_FIELDS + ("position_count", "version", "updated_at"),
+            rows,
+            on_conflict="replace",
+        )
+    return len(rows)
+
+
+def refresh(cursor, account_id: int) -> bool:
+    """
+    在调用方事务内重算并保存某账户的汇总（不提交）。
+
+    Returns:
+        数值是否有变化
+    """
+    return refresh_many(cursor, [account_id]) > 0
+
+
+def refresh_accounts(account_ids: Iterable[int]) -> int:
+    """批量重算若干账户并在一个事务内提交，返回有变化的账户数"""
+    account_ids = sorted(set(account_ids))
+    if not account_ids:
+        return 0
+    conn = get_db_connection()
+    try:
+        begin_write(conn)
+        changed = refresh_many(conn.cursor(), account_ids)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Failed to refresh summaries for {len(account_ids)} accounts: {e}")
+        return 0
+    return changed
+
+
+def refresh_for_codes(codes: Iterable[str]) -> int:
+    """一批基金有新估值后，重算持有这些基金的账户"""
+    codes = sorted({c for c in codes if c})
+    if not codes:
+        return 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(codes))
+    cursor.execute(
+        f"SELECT DISTINCT account_id FROM positions WHERE code IN ({placeholders}) AND shares > 0",
+        codes,
+    )
+    changed = refresh_accounts(row["account_id"] for row in cursor.fetchall())
+    if changed:
+        logger.info(f"Refreshed {changed} account summaries after valuation update")
+    return changed
+
+
+def get_summaries(account_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    读取若干账户的汇总行（主键读取）；尚无汇总的账户先补算。
+
+    Returns:
+        [{"account_id", total_*..., "position_count", "version", "updated_at"}, ...]，按 account_id 升序
+    """
+    if not account_ids:
+        return []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(account_ids))
+    query = f"SELECT * FROM account_summary WHERE account_id IN ({placeholders}) ORDER BY account_id"
+    cursor.execute(query, list(account_ids))
+    rows = [dict(row) for row in cursor.fetchall()]
+
+    missing = set(account_ids) - {row["account_id"] for row in rows}
+    if missing:
+        refresh_accounts(missing)
+        cursor.execute(query, list(account_ids))
+        rows = [dict(row) for row in cursor.fetchall()]
+    return rows
+
+
+def combine(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """多个账户汇总相加（收益率按合计成本重算）"""
+    total = {f: 0.0 for f in SUMMARY_FIELDS}
+    for row in rows:
+        for f in SUMMARY_FIELDS:
+            total[f] += row[f] or 0.0
+    cost = total["total_cost"]
+    total["total_return_rate"] = total["total_income"] / cost * 100 if cost > 0 else 0.0
+    return {f: round(v, 2) for f, v in total.items()}
@@ -2,7 +2,10 @@ import datetime
 import logging
 from typing import List, Dict, Any, Optional
 from ..db import get_db_connection
+from ..dialect import savepoint
 from ..auth import User
+from . import account_summary
+from .account import sync_user_holdings
 
 logger = logging.getLogger(__name__)
 
@@ -410,26 +413,27 @@ def _import_settings(conn, data: Dict[str, str], mode: str, user_id: Optional[in
             continue
 
         try:
-            if user_id is None:
-                # 单用户模式：导入到 settings 表（user_id = NULL）
-                cursor.execute("""
-                    INSERT INTO settings (key, value, encrypted, user_id, updated_at)
-                    VALUES (?, ?, 0, NULL, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key, user_id) DO UPDATE SET
-                        value = excluded.value,
-                        updated_at = CURRENT_TIMESTAMP
-                """, (key, value))
-            else:
-                # 多用户模式：导入到 settings 表
-                cursor.execute("""
-                    INSERT INTO settings (key, value, encrypted, user_id, updated_at)
-                    VALUES (?, ?, 0, ?, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key, user_id) DO UPDATE SET
-                        value = excluded.value,
-                        updated_at = CURRENT_TIMESTAMP
-                """, (key, value, user_id))
-
-            result["imported"] += 1
+            with savepoint(cursor):
+                if user_id is None:
+                    # 单用户模式：导入到 settings 表（user_id = NULL）
+                    cursor.execute("""
+                        INSERT INTO settings (key, value, encrypted, user_id, updated_at)
+                        VALUES (?, ?, 0, NULL, CURRENT_TIMESTAMP)
+                        ON CONFLICT(key, user_id) DO UPDATE SET
+                            value = excluded.value,
+                            updated_at = CURRENT_TIMESTAMP
+                    """, (key, value))
+                else:
+                    # 多用户模式：导入到 settings 表
+                    cursor.execute("""
+                        INSERT INTO settings (key, value, encrypted, user_id, updated_at)
+                        VALUES (?, ?, 0, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(key, user_id) DO UPDATE SET
+                            value = excluded.value,
+                            updated_at = CURRENT_TIMESTAMP
+                    """, (key, value, user_id))
+
+                result["imported"] += 1
         except Exception as e:
             result["failed"] += 1
             result["errors"].append(f"Failed to import setting {key}: {str(e)}")
@@ -456,35 +460,36 @@ def _import_ai_prompts(conn, data: List[Dict[str, Any]], mode: str, user_id: Opt
 
     for prompt in data:
         try:
-            name = prompt.get("name")
-            if not name:
-                result["skipped"] += 1
-                result["errors"].append("Missing name field")
-                continue
-
-            # Check if prompt with same name exists (merge mode)
-            if mode == "merge":
-                if user_id is None:
-                    cursor.execute("SELECT id FROM ai_prompts WHERE name = ? AND user_id IS NULL", (name,))
-                else:
-                    cursor.execute("SELECT id FROM ai_prompts WHERE name = ? AND user_id = ?", (name, user_id))
-
-                if cursor.fetchone():
+            with savepoint(cursor):
+                name = prompt.get("name")
+                if not name:
                     result["skipped"] += 1
+                    result["errors"].append("Missing name field")
                     continue
 
-            # Insert with user_id
-            cursor.execute("""
-                INSERT INTO ai_prompts (name, system_prompt, user_prompt, user_id, is_default)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                name,
-                prompt.get("system_prompt", ""),
-                prompt.get("user_prompt", ""),
-                user_id,
-                1 if prompt.get("is_default") else 0
-            ))
-            result["imported"] += 1
+                # Check if prompt with same name exists (merge mode)
+                if mode == "merge":
+                    if user_id is None:
+                        cursor.execute("SELECT id FROM ai_prompts WHERE name = ? AND user_id IS NULL", (name,))
+                    else:
+                        cursor.execute("SELECT id FROM ai_prompts WHERE name = ? AND user_id = ?", (name, user_id))
+
+                    if cursor.fetchone():
+                        result["skipped"] += 1
+                        continue
+
+                # Insert with user_id
+                cursor.execute("""
+                    INSERT INTO ai_prompts (name, system_prompt, user_prompt, user_id, is_default)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (
+                    name,
+                    prompt.get("system_prompt", ""),
+                    prompt.get("user_prompt", ""),
+                    user_id,
+                    1 if prompt.get("is_default") else 0
+                ))
+                result["imported"] += 1
 
         except Exception as e:
             result["failed"] += 1
@@ -501,40 +506,51 @@ def _import_accounts(conn, data: List[Dict[str, Any]], mode: str, user_id: Optio
     cursor = conn.cursor()
     result = {"total": len(data), "imported": 0, "skipped": 0, "failed": 0, "deleted": 0, "errors": []}
 
-    # Replace mode: delete user's existing accounts
+    # Replace mode: delete user's existing accounts (with their summaries and aggregate holdings)
     if mode == "replace":
         if user_id is None:
+            cursor.execute("""
+                DELETE FROM account_summary
+                WHERE account_id IN (SELECT id FROM accounts WHERE user_id IS NULL)
+            """)
             cursor.execute("DELETE FROM accounts WHERE user_id IS NULL")
         else:
+            cursor.execute("""
+                DELETE FROM account_summary
+                WHERE account_id IN (SELECT id FROM accounts WHERE user_id = ?)
+            """, (user_id,))
             cursor.execute("DELETE FROM accounts WHERE user_id = ?", (user_id,))
         deleted_count = cursor.rowcount
         result["deleted"] = deleted_count
+        if user_id is not None:
+            sync_user_holdings(cursor, user_id)
 
     for account in data:
         try:
-            name = account.get("name")
-            if not name:
-                result["skipped"] += 1
-                result["errors"].append("Missing name field")
-                continue
-
-            # Check if account with same name exists (merge mode)
-            if mode == "merge":
-                if user_id is None:
-                    cursor.execute("SELECT id FROM accounts WHERE name = ? AND user_id IS NULL", (name,))
-                else:
-                    cursor.execute("SELECT id FROM accounts WHERE name = ? AND user_id = ?", (name, user_id))
-
-                if cursor.fetchone():
+            with savepoint(cursor):
+                name = account.get("name")
+                if not name:
                     result["skipped"] += 1
+                    result["errors"].append("Missing name field")
                     continue
 
-            # Insert with user_id
-            cursor.execute("""
-                INSERT INTO accounts (name, description, user_id)
-                VALUES (?, ?, ?)
-            """, (name, account.get("description", ""), user_id))
-            result["imported"] += 1
+                # Check if account with same name exists (merge mode)
+                if mode == "merge":
+                    if user_id is None:
+                        cursor.execute("SELECT id FROM accounts WHERE name = ? AND user_id IS NULL", (name,))
+                    else:
+                        cursor.execute("SELECT id FROM accounts WHERE name = ? AND user_id = ?", (name, user_id))
+
+                    if cursor.fetchone():
+                        result["skipped"] += 1
+                        continue
+
+                # Insert with user_id
+                cursor.execute("""
+                    INSERT INTO accounts (name, description, user_id)
+                    VALUES (?, ?, ?)
+                """, (name, account.get("description", ""), user_id))
+                result["imported"] += 1
 
         except Exception as e:
             result["failed"] += 1
@@ -568,43 +584,52 @@ def _import_positions(conn, data: List[Dict[str, Any]], mode: str, user_id: Opti
 
     for position in data:
         try:
-            account_id = position.get("account_id")
-            code = position.get("code")
-
-            if not account_id or not code:
-                result["skipped"] += 1
-                result["errors"].append("Missing account_id or code field")
-                continue
-
-            # Check if account exists and belongs to user
-            if user_id is None:
-                cursor.execute("SELECT id FROM accounts WHERE id = ? AND user_id IS NULL", (account_id,))
-            else:
-                cursor.execute("SELECT id FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
-
-            if not cursor.fetchone():
-                result["skipped"] += 1
-                result["errors"].append(f"account_id={account_id} does not exist or does not belong to user")
-                continue
-
-            # Check if position exists (merge mode)
-            if mode == "merge":
-                cursor.execute("SELECT 1 FROM positions WHERE account_id = ? AND code = ?", (account_id, code))
-                if cursor.fetchone():
+            with savepoint(cursor):
+                account_id = position.get("account_id")
+                code = position.get("code")
+
+                if not account_id or not code:
                     result["skipped"] += 1
+                    result["errors"].append("Missing account_id or code field")
                     continue
 
-            cursor.execute("""
-                INSERT INTO positions (account_id, code, cost, shares)
-                VALUES (?, ?, ?, ?)
-            """, (account_id, code, position.get("cost", 0.0), position.get("shares", 0.0)))
-            result["imported"] += 1
+                # Check if account exists and belongs to user
+                if user_id is None:
+                    cursor.execute("SELECT id FROM accounts WHERE id = ? AND user_id IS NULL", (account_id,))
+                else:
+                    cursor.execute("SELECT id FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
+
+                if not cursor.fetchone():
+                    result["skipped"] += 1
+                    result["errors"].append(f"account_id={account_id} does not exist or does not belong to user")
+                    continue
+
+                # Check if position exists (merge mode)
+                if mode == "merge":
+                    cursor.execute("SELECT 1 FROM positions WHERE account_id = ? AND code = ?", (account_id, code))
+                    if cursor.fetchone():
+                        result["skipped"] += 1
+                        continue
+
+                cursor.execute("""
+                    INSERT INTO positions (account_id, code, cost, shares)
+                    VALUES (?, ?, ?, ?)
+                """, (account_id, code, position.get("cost", 0.0), position.get("shares", 0.0)))
+                result["imported"] += 1
 
         except Exception as e:
             result["failed"] += 1
             result["errors"].append(f"Failed to import position: {str(e)}")
             logger.error(f"Failed to import position: {e}")
 
+    # Recompute aggregate holdings and account summaries inside the import transaction
+    if user_id is None:
+        cursor.execute("SELECT id FROM accounts WHERE user_id IS NULL")
+    else:
+        sync_user_holdings(cursor, user_id)
+        cursor.execute("SELECT id FROM accounts WHERE user_id = ?", (user_id,))
+    account_summary.refresh_many(cursor, [row["id"] for row in cursor.fetchall()])
+
     return result
 
 
@@ -632,44 +657,45 @@ def _import_transactions(conn, data: List[Dict[str, Any]], mode: str, user_id: O
 
     for transaction in data:
         try:
-            account_id = transaction.get("account_id")
-            code = transaction.get("code")
+            with savepoint(cursor):
+                account_id = transaction.get("account_id")
+                code = transaction.get("code")
 
-            if not account_id or not code:
-                result["skipped"] += 1
-                result["errors"].append("Missing account_id or code field")
-                continue
+                if not account_id or not code:
+                    result["skipped"] += 1
+                    result["errors"].append("Missing account_id or code field")
+                    continue
 
-            # Check if account exists and belongs to user
-            if user_id is None:
-                cursor.execute("SELECT id FROM accounts WHERE id = ? AND user_id IS NULL", (account_id,))
-            else:
-                cursor.execute("SELECT id FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
+                # Check if account exists and belongs to user
+                if user_id is None:
+                    cursor.execute("SELECT id FROM accounts WHERE id = ? AND user_id IS NULL", (account_id,))
+                else:
+                    cursor.execute("SELECT id FROM accounts WHERE id = ? AND user_id = ?", (account_id, user_id))
 
-            if not cursor.fetchone():
-                result["skipped"] += 1
-                result["errors"].append(f"account_id={account_id} does not exist or does not belong to user")
-                continue
+                if not cursor.fetchone():
+                    result["skipped"] += 1
+                    result["errors"].append(f"account_id={account_id} does not exist or does not belong to user")
+                    continue
 
-            cursor.execute("""
-                INSERT INTO transactions (
-                    account_id, code, op_type, amount_cny, shares_redeemed,
-                    confirm_date, confirm_nav, shares_added, cost_after, applied_at
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                account_id,
-                code,
-                transaction.get("op_type"),
-                transaction.get("amount_cny"),
-                transaction.get("shares_redeemed"),
-                transaction.get("confirm_date"),
-                transaction.get("confirm_nav"),
-                transaction.get("shares_added"),
-                transaction.get("cost_after"),
-                transaction.get("applied_at")
-            ))
-            result["imported"] += 1
+                cursor.execute("""
+                    INSERT INTO transactions (
+                        account_id, code, op_type, amount_cny, shares_redeemed,
+                        confirm_date, confirm_nav, shares_added, cost_after, applied_at
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    account_id,
+                    code,
+                    transaction.get("op_type"),
+                    transaction.get("amount_cny"),
+                    transaction.get("shares_redeemed"),
+                    transaction.get("confirm_date"),
+                    transaction.get("confirm_nav"),
+                    transaction.get("shares_added"),
+                    transaction.get("cost_after"),
+                    transaction.get("applied_at")
+                ))
+                result["imported"] += 1
 
         except Exception as e:
             result["failed"] += 1
@@ -697,49 +723,50 @@ def _import_subscriptions(conn, data: List[Dict[str, Any]], mode: str, user_id:
 
     for subscription in data:
         try:
-            code = subscription.get("code")
-            email = subscription.get("email")
+            with savepoint(cursor):
+                code = subscription.get("code")
+                email = subscription.get("email")
 
-            if not code or not email:
-                result["skipped"] += 1
-                result["errors"].append("Missing code or email field")
-                continue
-
-            # Check if subscription exists (merge mode)
-            if mode == "merge":
-                if user_id is None:
-                    cursor.execute(
-                        "SELECT id FROM subscriptions WHERE code = ? AND email = ? AND user_id IS NULL",
-                        (code, email)
-                    )
-                else:
-                    cursor.execute(
-                        "SELECT id FROM subscriptions WHERE code = ? AND email = ? AND user_id = ?",
-                        (code, email, user_id)
-                    )
-
-                if cursor.fetchone():
+                if not code or not email:
                     result["skipped"] += 1
+                    result["errors"].append("Missing code or email field")
                     continue
 
-            # Insert with user_id
-            cursor.execute("""
-                INSERT INTO subscriptions (
-                    code, email, user_id, threshold_up, threshold_down,
-                    enable_digest, digest_time, enable_volatility
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                code,
-                email,
-                user_id,
-                subscription.get("threshold_up"),
-                subscription.get("threshold_down"),
-                1 if subscription.get("enable_digest") else 0,
-                subscription.get("digest_time", "14:45"),
-                1 if subscription.get("enable_volatility") else 0
-            ))
-            result["imported"] += 1
+                # Check if subscription exists (merge mode)
+                if mode == "merge":
+                    if user_id is None:
+                        cursor.execute(
+                            "SELECT id FROM subscriptions WHERE code = ? AND email = ? AND user_id IS NULL",
+                            (code, email)
+                        )
+                    else:
+                        cursor.execute(
+                            "SELECT id FROM subscriptions WHERE code = ? AND email = ? AND user_id = ?",
+                            (code, email, user_id)
+                        )
+
+                    if cursor.fetchone():
+                        result["skipped"] += 1
+                        continue
+
+                # Insert with user_id
+                cursor.execute("""
+                    INSERT INTO subscriptions (
+                        code, email, user_id, threshold_up, threshold_down,
+                        enable_digest, digest_time, enable_volatility
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (
+                    code,
+                    email,
+                    user_id,
+                    subscription.get("threshold_up"),
+                    subscription.get("threshold_down"),
+                    1 if subscription.get("enable_digest") else 0,
+                    subscription.get("digest_time", "14:45"),
+                    1 if subscription.get("enable_volatility") else 0
+                ))
+                result["imported"] += 1
 
         except Exception as e:
             result["failed"] += 1
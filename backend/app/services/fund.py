@@ -3,6 +3,7 @@ import json
 import re
 import logging
 import atexit
+from datetime import datetime
 from typing import List, Dict, Any
 
 import pandas as pd
@@ -12,7 +13,11 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
 from ..db import get_db_connection
+from ..dialect import bulk_insert, begin_write, is_postgres, table_exists
 from ..config import Config
+from . import fund_directory
+from .fund_categories import classify_fund_type
+from .nav_watcher import filter_fetch_due, record_fetch_result
 
 logger = logging.getLogger(__name__)
 
@@ -68,8 +73,11 @@ def get_fund_type(code: str, name: str) -> str:
     if row and row["type"]:
         return row["type"]
 
+    return guess_fund_type(name)
 
-    # Fallback: simple heuristics based on name
+
+def guess_fund_type(name: str) -> str:
+    """Fallback fund type from simple name heuristics (no database access)."""
     if "债" in name or "纯债" in name or "固收" in name:
         return "债券"
     if "QDII" in name or "纳斯达克" in name or "标普" in name or "恒生" in name:
@@ -90,38 +98,7 @@ def get_fund_category(fund_type: str) -> str:
     Returns:
         One of: 货币类, 偏债类, 偏股类, 商品类, 未分类
     """
-    if not fund_type:
-        return "未分类"
-
-    # 货币类
-    if fund_type.startswith("货币型") or fund_type == "货币":
-        return "货币类"
-
-    # 偏债类
-    debt_keywords = [
-        "债券型-", "混合型-偏债", "混合型-绝对收益",
-        "QDII-纯债", "QDII-混合债", "指数型-固收"
-    ]
-    if any(fund_type.startswith(k) for k in debt_keywords) or fund_type == "债券":
-        return "偏债类"
-
-    # 商品类
-    commodity_keywords = ["商品", "QDII-商品", "REITs", "Reits", "QDII-REITs"]
-    if any(k in fund_type for k in commodity_keywords):
-        return "商品类"
-
-    # 偏股类（最宽泛，放最后）
-    equity_keywords = [
-        "股票型", "混合型-偏股", "混合型-平衡", "混合型-灵活",
-        "指数型-股票", "指数型-海外股票", "指数型-其他",
-        "QDII-普通股票", "QDII-混合偏股", "QDII-混合平衡", "QDII-混合灵活",
-        "FOF-", "QDII-FOF"
-    ]
-    if any(fund_type.startswith(k) or k in fund_type for k in equity_keywords):
-        return "偏股类"
-
-    # 兜底
-    return "未分类"
+    return classify_fund_type(fund_type)
 
 
 def get_eastmoney_valuation(code: str) -> Dict[str, Any]:
@@ -209,7 +186,6 @@ def get_combined_valuation(code: str) -> Dict[str, Any]:
 
     # 3. Try custom estimation algorithm
     from .estimate import estimate_nav
-    from datetime import datetime
 
     try:
         history = get_fund_history(code, limit=30)
@@ -276,35 +252,96 @@ def get_combined_valuation(code: str) -> Dict[str, Any]:
     return {"code": code, "name": code, "nav": 0, "estimate": 0, "estRate": 0}
 
 
+# FTS5 trigram 索引只能匹配 3 个字符及以上的子串
+FTS_MIN_QUERY_LEN = 3
+_fts_available = None
+
+
+def _has_fts_index(cursor) -> bool:
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = not is_postgres() and table_exists(cursor, "funds_fts")
+    return _fts_available
+
+
+def rebuild_search_index() -> None:
+    """
+    基金列表刷新后重建 SQLite 全文索引（funds_fts 为 external-content 表）。
+    PostgreSQL 的 pg_trgm GIN 索引由数据库自动维护，无需处理。
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if not _has_fts_index(cursor):
+        return
+    try:
+        begin_write(conn)
+        cursor.execute("INSERT INTO funds_fts(funds_fts) VALUES('rebuild')")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
 def search_funds(q: str) -> List[Dict[str, Any]]:
     """
     Search funds by keyword using local SQLite DB.
     Supports both code and name search.
     Results are ordered by relevance: exact code match > code prefix > name match
+
+    Served from the in-memory fund directory (which also matches pinyin
+    initials) once it is loaded. Before that, substring matching goes through
+    the FTS5 trigram index on SQLite (queries of 3+ characters) and the pg_trgm
+    GIN indexes on PostgreSQL; shorter queries fall back to a plain LIKE scan.
+    PostgreSQL matches with ILIKE so letter case is ignored as with SQLite's LIKE.
     """
     if not q:
         return []
 
     q_clean = q.strip()
+    if not q_clean:
+        return []
+
+    results = fund_directory.search(q_clean)
+    if results is not None:
+        return results
     pattern = f"%{q_clean}%"
     prefix_pattern = f"{q_clean}%"
 
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT code, name, type,
-            CASE
-                WHEN code = ? THEN 1
-                WHEN code LIKE ? THEN 2
-                WHEN name LIKE ? THEN 3
-                ELSE 4
-            END as relevance
-        FROM funds
-        WHERE code LIKE ? OR name LIKE ?
-        ORDER BY relevance, code
-        LIMIT 30
-    """, (q_clean, prefix_pattern, pattern, pattern, pattern))
+    if len(q_clean) >= FTS_MIN_QUERY_LEN and _has_fts_index(cursor):
+        # Phrase query; the LIKE recheck drops rows whose index entry is stale mid-refresh
+        match = '"' + q_clean.replace('"', '""') + '"'
+        cursor.execute("""
+            SELECT code, name, type,
+                CASE
+                    WHEN code = ? THEN 1
+                    WHEN code LIKE ? THEN 2
+                    WHEN name LIKE ? THEN 3
+                    ELSE 4
+                END as relevance
+            FROM funds
+            WHERE rowid IN (SELECT rowid FROM funds_fts WHERE funds_fts MATCH ?)
+              AND (code LIKE ? OR name LIKE ?)
+            ORDER BY relevance, code
+            LIMIT 30
+        """, (q_clean, prefix_pattern, pattern, match, pattern, pattern))
+    else:
+        like = "ILIKE" if is_postgres() else "LIKE"
+        cursor.execute(f"""
+            SELECT code, name, type,
+                CASE
+                    WHEN code = ? THEN 1
+                    WHEN code {like} ? THEN 2
+                    WHEN name {like} ? THEN 3
+                    ELSE 4
+                END as relevance
+            FROM funds
+            WHERE code {like} ? OR name {like} ?
+            ORDER BY relevance, code
+            LIMIT 30
+        """, (q_clean, prefix_pattern, pattern, pattern, pattern))
 
     rows = cursor.fetchall()
 
@@ -540,26 +577,39 @@ def get_fund_history(code: str, limit: int = 30) -> List[Dict[str, Any]]:
         latest_nav_date = rows[0]["date"]
         # Parse timestamp
         try:
-            from datetime import datetime
             update_time = datetime.fromisoformat(latest_update)
             age_hours = (datetime.now() - update_time).total_seconds() / 3600
 
+            from .trading_calendar import is_trading_day, prev_trading_day
+
             # Get today's date
-            today_str = datetime.now().strftime("%Y-%m-%d")
+            today = datetime.now().date()
+            today_str = today.strftime("%Y-%m-%d")
             current_hour = datetime.now().hour
+            today_is_trading = is_trading_day(today)
+
+            # Latest NAV date that can possibly be published right now
+            if today_is_trading and current_hour >= 16:
+                expected_nav_date = today_str
+            else:
+                expected_nav_date = prev_trading_day(today).strftime("%Y-%m-%d")
 
             # For "all history" requests, require more data to consider cache valid
             min_rows = 10 if limit < 9999 else 100
+            enough_rows = len(rows) >= min(limit, min_rows)
 
             # Cache invalidation logic:
             # 1. If it's after 16:00 on a trading day and cache doesn't have today's NAV, invalidate
-            # 2. Otherwise, use 24-hour cache
-            if current_hour >= 16 and latest_nav_date < today_str:
+            # 2. If cache already holds the latest publishable NAV, no newer data can exist (holidays, weekends)
+            # 3. Otherwise, use 24-hour cache
+            if today_is_trading and current_hour >= 16 and latest_nav_date < today_str:
                 # After 16:00, if we don't have today's NAV, force refresh
                 cache_valid = False
+            elif latest_nav_date >= expected_nav_date:
+                cache_valid = enough_rows
             else:
                 # Normal 24-hour cache
-                cache_valid = age_hours < 24 and len(rows) >= min(limit, min_rows)
+                cache_valid = age_hours < 24 and enough_rows
         except:
             pass
 
@@ -589,12 +639,12 @@ def get_fund_history(code: str, limit: int = 30) -> List[Dict[str, Any]]:
             nav_value = float(row["单位净值"])
             results.append({"date": date_str, "nav": nav_value})
 
-            # 3. Save to database cache
-            cursor.execute("""
-                INSERT OR REPLACE INTO fund_history (code, date, nav, updated_at)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            """, (code, date_str, nav_value))
-
+        # 3. Save to database cache
+        bulk_insert(
+            cursor, "fund_history", ("code", "date", "nav"),
+            [(code, item["date"], item["nav"]) for item in results],
+            on_conflict="replace", timestamp_columns=("updated_at",)
+        )
         conn.commit()
         
         return results
@@ -603,16 +653,109 @@ def get_fund_history(code: str, limit: int = 30) -> List[Dict[str, Any]]:
         return []
 
 
+def _fetch_navs_from_upstream(code: str, dates: set) -> Dict[str, float]:
+    """
+    Fetch NAVs for specific dates from AkShare.
+    Dates not yet published are simply absent from the result.
+
+    Rows from the earliest requested date onward are cached (not just the
+    requested ones) so the tail of fund_history stays gap-free for
+    get_fund_history's freshness check.
+
+    Dates that came back empty are backed off (see nav_watcher) so an
+    unpublished NAV does not trigger a full download on every call.
+    """
+    now = datetime.now()
+    dates = set(filter_fetch_due(code, dates, now))
+    if not dates:
+        return {}
+
+    try:
+        df = ak.fund_open_fund_info_em(symbol=code, indicator="单位净值走势")
+    except Exception as e:
+        logger.error(f"NAV fetch error for {code}: {e}")
+        record_fetch_result(code, dates, {}, now)
+        return {}
+    if df is None or df.empty:
+        record_fetch_result(code, dates, {}, now)
+        return {}
+
+    earliest = min(dates)
+    found = {}
+    to_cache = []
+    for d, nav in zip(df["净值日期"], df["单位净值"]):
+        date_str = d.strftime("%Y-%m-%d") if hasattr(d, "strftime") else str(d)[:10]
+        if date_str < earliest:
+            continue
+        to_cache.append((code, date_str, float(nav)))
+        if date_str in dates:
+            found[date_str] = float(nav)
+
+    if to_cache:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        bulk_insert(cursor, "fund_history", ("code", "date", "nav"), to_cache,
+                    on_conflict="replace", timestamp_columns=("updated_at",))
+        conn.commit()
+    record_fetch_result(code, dates, found, now)
+    return found
+
+
+def get_navs_on_dates(pairs) -> Dict[tuple, float]:
+    """
+    Batch NAV lookup for many (code, date) pairs.
+
+    Cached rows are read through the fund_history primary key; only the pairs
+    missing from the cache go upstream, with one AkShare call per code.
+    Future dates are never requested upstream.
+
+    Args:
+        pairs: Iterable of (code, "YYYY-MM-DD")
+
+    Returns:
+        {(code, date): nav} for pairs whose NAV is available
+    """
+    dates_by_code: Dict[str, set] = {}
+    for code, date_str in pairs:
+        if code and date_str:
+            dates_by_code.setdefault(code, set()).add(date_str[:10])
+    if not dates_by_code:
+        return {}
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    result = {}
+    for code, dates in dates_by_code.items():
+        date_list = sorted(dates)
+        placeholders = ",".join("?" * len(date_list))
+        cursor.execute(f"""
+            SELECT date, nav FROM fund_history
+            WHERE code = ? AND date IN ({placeholders})
+        """, [code] + date_list)
+        for row in cursor.fetchall():
+            if row["nav"] and float(row["nav"]) > 0:
+                result[(code, row["date"])] = float(row["nav"])
+
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    for code, dates in dates_by_code.items():
+        missing = {d for d in dates if (code, d) not in result and d <= today_str}
+        if not missing:
+            continue
+        for d, nav in _fetch_navs_from_upstream(code, missing).items():
+            if nav > 0:
+                result[(code, d)] = nav
+
+    return result
+
+
 def get_nav_on_date(code: str, date_str: str) -> float | None:
     """
     Get fund NAV on a specific date (YYYY-MM-DD). Used for T+1 confirm.
     Returns None if that date's NAV is not yet available.
     """
-    history = get_fund_history(code, limit=90)
-    for item in history:
-        if item["date"][:10] == date_str[:10]:
-            return item["nav"]
-    return None
+    date_key = date_str[:10]
+    return get_navs_on_dates([(code, date_key)]).get((code, date_key))
 
 
 def _calculate_technical_indicators(history: List[Dict[str, Any]]) -> Dict[str, Any]:
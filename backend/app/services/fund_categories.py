@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+基金分类：编译后的类型分类器，以及基金列表刷新后计算一次的类型直方图缓存。
+
+分类在入库时写入 funds.category（有索引），读取侧直接在 SQL 中过滤/分组。
+
+基金列表刷新时调用 invalidate() 递增代数（generation），下一次读取时按需重算；
+/categories 用结果内容的哈希作为 ETag，客户端可用 If-None-Match 廉价校验。
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from ..db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+UNCATEGORIZED = "未分类"
+
+# 按顺序匹配的分类规则（偏股类最宽泛，放最后）
+_CATEGORY_RULES = [
+    ("货币类", re.compile(r"^货币(?:型|$)")),
+    ("偏债类", re.compile(r"^(?:债券型-|混合型-偏债|混合型-绝对收益|QDII-纯债|QDII-混合债|指数型-固收)|^债券$")),
+    ("商品类", re.compile(r"商品|REITs|Reits")),
+    ("偏股类", re.compile(
+        r"股票型|混合型-偏股|混合型-平衡|混合型-灵活|指数型-股票|指数型-海外股票|指数型-其他"
+        r"|QDII-普通股票|QDII-混合偏股|QDII-混合平衡|QDII-混合灵活|FOF-|QDII-FOF"
+    )),
+]
+CATEGORIES = tuple(name for name, _ in _CATEGORY_RULES) + (UNCATEGORIZED,)
+
+
+@lru_cache(maxsize=256)
+def classify_fund_type(fund_type: Optional[str]) -> str:
+    """
+    官方类型 -> 4 大分类。
+
+    Returns:
+        One of: 货币类, 偏债类, 偏股类, 商品类, 未分类
+    """
+    if not fund_type:
+        return UNCATEGORIZED
+    for category, pattern in _CATEGORY_RULES:
+        if pattern.search(fund_type):
+            return category
+    return UNCATEGORIZED
+
+
+def get_major_category(fund_type: str) -> str:
+    """官方类型 -> /categories 展示用的大类"""
+    if "股票" in fund_type or "偏股" in fund_type:
+        return "股票型"
+    if "混合" in fund_type:
+        return "混合型"
+    if "债" in fund_type:
+        return "债券型"
+    if "指数" in fund_type:
+        return "指数型"
+    if "QDII" in fund_type:
+        return "QDII"
+    if "货币" in fund_type:
+        return "货币型"
+    if "FOF" in fund_type:
+        return "FOF"
+    if "REITs" in fund_type or "Reits" in fund_type:
+        return "REITs"
+    return "其他"
+
+
+@dataclass
+class CategorySnapshot:
+    generation: int
+    # 大类按基金数量降序
+    categories: List[str]
+    counts: Dict[str, int]
+    etag: str = ""
+
+
+_generation = 0
+_snapshot = None
+_lock = threading.Lock()
+
+
+def invalidate() -> int:
+    """基金列表变化后调用，返回新的代数"""
+    global _generation
+    with _lock:
+        _generation += 1
+        return _generation
+
+
+def _build(generation: int) -> CategorySnapshot:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT type, COUNT(*) as count
+        FROM funds
+        WHERE type IS NOT NULL AND type != ''
+        GROUP BY type
+    """)
+    rows = cursor.fetchall()
+
+    counts: Dict[str, int] = {}
+    for row in rows:
+        major = get_major_category(row["type"])
+        counts[major] = counts.get(major, 0) + row["count"]
+
+    categories = sorted(counts, key=lambda x: counts[x], reverse=True)
+    digest = hashlib.sha1(json.dumps(categories, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    return CategorySnapshot(generation, categories, counts, f'"{digest}"')
+
+
+def get_snapshot() -> CategorySnapshot:
+    """当前代数的分类快照（过期则重算）"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.generation == _generation:
+        return snapshot
+    with _lock:
+        if _snapshot is None or _snapshot.generation != _generation:
+            _snapshot = _build(_generation)
+            logger.info(f"Fund categories rebuilt (generation {_generation}, {len(_snapshot.counts)} groups)")
+        return _snapshot
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+内存基金目录：启动时从 funds 表加载，基金列表刷新后热替换。
+
+每只基金保存代码、简称、类型及预计算的拼音首字母（"yfd"）/全拼（"yifangda"）。
+所有可检索字段以 \\x00 分隔拼接成一个字符串，每个相关度等级一份后缀数组
+（array('I') 存后缀起点及所属基金）。查询按等级依次二分出命中区间，
+凑满 limit 即停止，排序为：
+代码完全匹配 > 代码前缀 > 简称前缀 > 简称包含 > 首字母前缀 > 拼音包含 > 代码包含，
+同一等级内按代码升序。
+
+拼音依赖可选的 pypinyin；未安装时只支持代码/简称检索。
+"""
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional
+
+from ..db import get_db_connection
+
+try:
+    from pypinyin import Style, lazy_pinyin
+    PYPINYIN_AVAILABLE = True
+except ImportError:
+    PYPINYIN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 后缀排序只比较前 KEY_LEN 个字符，更长的查询在区间内逐条校验
+KEY_LEN = 16
+SEPARATOR = "\x00"
+
+
+def _to_pinyin(name: str):
+    """返回 (首字母串, 全拼串, 全拼中各音节的起始偏移)"""
+    if not PYPINYIN_AVAILABLE or not name:
+        return "", "", []
+    syllables = [s.lower() for s in lazy_pinyin(name, style=Style.NORMAL)]
+    letters = [s.lower() for s in lazy_pinyin(name, style=Style.FIRST_LETTER)]
+    offsets, pos = [], 0
+    for s in syllables:
+        offsets.append(pos)
+        pos += len(s)
+    return "".join(letters), "".join(syllables), offsets
+
+
+class _SuffixIndex:
+    """一个相关度等级的后缀数组：positions 为后缀起点，owners 为对应基金下标。"""
+    __slots__ = ("positions", "owners")
+
+    def __init__(self, text: str, entries):
+        entries.sort(key=lambda e: text[e[0]:e[0] + KEY_LEN])
+        self.positions = array("I", (e[0] for e in entries))
+        self.owners = array("I", (e[1] for e in entries))
+
+    def __len__(self):
+        return len(self.positions)
+
+    def lookup(self, text: str, q: str):
+        """命中后缀对应的基金下标（可能重复）"""
+        key = q[:KEY_LEN]
+        n = len(key)
+        positions = self.positions
+        lo = bisect_left(positions, key, key=lambda p: text[p:p + n])
+        hi = bisect_right(positions, key, lo=lo, key=lambda p: text[p:p + n])
+        if len(q) <= KEY_LEN:
+            return self.owners[lo:hi]
+        return [self.owners[i] for i in range(lo, hi) if text.startswith(q, positions[i])]
+
+
+class _Directory:
+    # 按相关度从高到低检索的后缀数组（代码完全匹配/前缀直接在有序 codes 上二分）
+    TIERS = ("name_prefix", "name_infix", "initials_prefix", "pinyin", "code_infix")
+
+    def __init__(self, rows):
+        self.codes: List[str] = []
+        self.names: List[str] = []
+        self.types: List[str] = []
+
+        parts: List[str] = []
+        entries = {tier: [] for tier in self.TIERS}
+        offset = 0
+
+        def add_field(value: str):
+            nonlocal offset
+            start = offset
+            parts.append(value)
+            parts.append(SEPARATOR)
+            offset += len(value) + 1
+            return start
+
+        for i, (code, name, type_) in enumerate(sorted(rows, key=lambda r: str(r[0]))):
+            code, name = str(code), name or ""
+            initials, full, syllable_offsets = _to_pinyin(name)
+
+            self.codes.append(code)
+            self.names.append(name)
+            self.types.append(type_ or "未知")
+
+            base = add_field(code)
+            entries["code_infix"].extend((base + k, i) for k in range(1, len(code)))
+
+            base = add_field(name.lower())
+            if name:
+                entries["name_prefix"].append((base, i))
+                entries["name_infix"].extend((base + k, i) for k in range(1, len(name)))
+
+            base = add_field(initials)
+            if initials:
+                entries["initials_prefix"].append((base, i))
+                entries["pinyin"].extend((base + k, i) for k in range(1, len(initials)))
+
+            # 全拼只在音节边界建索引（"fangda" 命中"易方达"，"angda" 不命中）
+            base = add_field(full)
+            entries["pinyin"].extend((base + k, i) for k in syllable_offsets)
+
+        self.text = "".join(parts)
+        self.tiers = [_SuffixIndex(self.text, entries[tier]) for tier in self.TIERS]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def suffix_count(self) -> int:
+        return sum(len(t) for t in self.tiers)
+
+    def search(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        codes = self.codes
+        # 代码完全匹配 / 代码前缀：codes 有序，命中为连续区间，按代码顺序即可
+        lo = bisect_left(codes, q)
+        hi = bisect_left(codes, q + "\uffff", lo=lo)
+        picked = list(range(lo, min(hi, lo + limit)))
+        seen = set(picked)
+
+        for tier in self.tiers:
+            if len(picked) >= limit:
+                break
+            owners = tier.lookup(self.text, q)
+            if not len(owners):
+                continue
+            fresh = sorted(set(owners) - seen)[:limit - len(picked)]
+            picked.extend(fresh)
+            seen.update(fresh)
+
+        return [{"id": codes[i], "name": self.names[i], "type": self.types[i]} for i in picked]
+
+
+_directory: Optional[_Directory] = None
+_reload_lock = threading.Lock()
+
+
+def reload() -> int:
+    """从 funds 表重建目录并原子替换，返回基金数量"""
+    global _directory
+    with _reload_lock:
+        started = time.perf_counter()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT code, name, type FROM funds")
+        directory = _Directory([(row["code"], row["name"], row["type"]) for row in cursor.fetchall()])
+        _directory = directory
+
+    logger.info(
+        f"Fund directory loaded: {len(directory)} funds, {directory.suffix_count} suffixes "
+        f"in {time.perf_counter() - started:.2f}s (pinyin={'on' if PYPINYIN_AVAILABLE else 'off'})"
+    )
+    return len(directory)
+
+
+def search(q: str, limit: int = 30) -> Optional[List[Dict[str, Any]]]:
+    """
+    在内存目录中检索基金。
+
+    Returns:
+        结果列表（格式同 search_funds）；目录尚未加载时返回 None，由调用方回退到数据库检索
+    """
+    directory = _directory
+    if directory is None or not len(directory):
+        return None
+    q = q.strip().lower()
+    if not q:
+        return []
+    return directory.search(q, limit)
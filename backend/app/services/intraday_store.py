@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+盘中估值快照存储：按交易日分区。
+
+- 基金代码映射为整数 fund_id（fund_ids 表），时间编码为当日分钟数（HH*60+MM）；
+- SQLite：每个交易日一张 WITHOUT ROWID 表 fund_intraday_YYYYMMDD，主键 (fund_id, minute)；
+- PostgreSQL：父表 fund_intraday 按 day（YYYYMMDD 整数）范围分区，每日一个分区，主键 (day, fund_id, minute)；
+- 过期清理直接 DROP 整个分区，不产生碎片；
+- 同一天多个基金的序列通过一次主键范围扫描读出。
+
+分级存储（rollup tiers）：
+- raw：当日原始快照（日分区），跨日前先汇总再删除；
+- 15m：15 分钟 OHLC（fund_intraday_15m），保留 30 天；
+- daily：每日开/收/高/低（fund_intraday_daily），保留 365 天。
+每次采集写入后只重算当前 15 分钟桶及当日汇总（增量）。
+映射表、分区父表与汇总表由 migrations.py（v4 / v5）创建，本模块只负责日分区与读写。
+"""
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ..db import get_db_connection
+from ..dialect import is_postgres, bulk_insert, list_tables, table_exists
+
+PARTITION_PREFIX = "fund_intraday_"
+BUCKET_MINUTES = 15
+BAR_RETENTION_DAYS = 30
+DAILY_RETENTION_DAYS = 365
+_PARTITION_RE = re.compile(r"^fund_intraday_(\d{8})$")
+# 快照的日期与时刻均为北京时间（采集任务按 CST 记录）
+CST = timezone(timedelta(hours=8))
+
+
+def time_to_minute(time_str: str) -> int:
+    """'HH:MM' -> 当日分钟数"""
+    hh, mm = time_str[:5].split(":")
+    return int(hh) * 60 + int(mm)
+
+
+def minute_to_time(minute: int) -> str:
+    """当日分钟数 -> 'HH:MM'"""
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def date_to_day(date_str: str) -> int:
+    """'YYYY-MM-DD' -> YYYYMMDD 整数"""
+    return int(date_str[:10].replace("-", ""))
+
+
+def day_to_date(day: int) -> str:
+    s = str(day)
+    return f"{s[:4]}-{s[4:6]}-{s[6:8]}"
+
+
+def partition_name(date_str: str) -> str:
+    return f"{PARTITION_PREFIX}{date_to_day(date_str)}"
+
+
+def ensure_partition(cursor, date_str: str) -> str:
+    """确保某交易日的分区存在，返回分区表名"""
+    name = partition_name(date_str)
+    if is_postgres():
+        day = date_to_day(date_str)
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF fund_intraday "
+            f"FOR VALUES FROM ({day}) TO ({day + 1})"
+        )
+    else:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                fund_id INTEGER NOT NULL,
+                minute INTEGER NOT NULL,
+                estimate REAL NOT NULL,
+                PRIMARY KEY (fund_id, minute)
+            ) WITHOUT ROWID
+        """)
+    return name
+
+
+def list_partition_dates(cursor) -> List[str]:
+    """已存在分区对应的日期（升序）"""
+    days = []
+    for table in list_tables(cursor):
+        m = _PARTITION_RE.match(table)
+        if m:
+            days.append(day_to_date(int(m.group(1))))
+    return sorted(days)
+
+
+def get_fund_ids(cursor, codes: Iterable[str], create: bool = False) -> Dict[str, int]:
+    """基金代码 -> fund_id，create=True 时为新代码分配 id"""
+    codes = sorted({c for c in codes if c})
+    if not codes:
+        return {}
+    if create:
+        bulk_insert(cursor, "fund_ids", ("code",), [(c,) for c in codes], on_conflict="ignore")
+
+    placeholders = ",".join("?" * len(codes))
+    cursor.execute(f"SELECT id, code FROM fund_ids WHERE code IN ({placeholders})", codes)
+    return {row["code"]: row["id"] for row in cursor.fetchall()}
+
+
+def write_snapshots(cursor, date_str: str, rows: Sequence[Tuple[str, str, float]]) -> int:
+    """
+    在调用方事务内写入快照（不提交）。
+
+    Args:
+        rows: [(code, "HH:MM", estimate), ...]
+    """
+    if not rows:
+        return 0
+    table = ensure_partition(cursor, date_str)
+    ids = get_fund_ids(cursor, (r[0] for r in rows), create=True)
+
+    if is_postgres():
+        day = date_to_day(date_str)
+        bulk_insert(cursor, "fund_intraday", ("day", "fund_id", "minute", "estimate"),
+                    [(day, ids[code], time_to_minute(t), float(est)) for code, t, est in rows],
+                    on_conflict="replace")
+    else:
+        bulk_insert(cursor, table, ("fund_id", "minute", "estimate"),
+                    [(ids[code], time_to_minute(t), float(est)) for code, t, est in rows],
+                    on_conflict="replace")
+    return len(rows)
+
+
+def save_snapshots(date_str: str, rows: Sequence[Tuple[str, str, float]]) -> int:
+    """写入一批快照（并增量更新所在 15 分钟桶及当日汇总）后提交，返回写入条数"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        n = write_snapshots(cursor, date_str, rows)
+        if n:
+            update_rollups(cursor, date_str, since_minute=min(time_to_minute(r[1]) for r in rows))
+        conn.commit()
+        return n
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def get_day_series(date_str: str, codes: Iterable[str]) -> Dict[str, List[Dict[str, float]]]:
+    """
+    读取某交易日多个基金的盘中序列（一次主键范围扫描）。
+
+    Returns:
+        {code: [{"time": "HH:MM", "estimate": float}, ...]}，按时间升序
+    """
+    codes = list(codes)
+    result = {code: [] for code in codes}
+    if not codes:
+        return result
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    table = partition_name(date_str)
+    if not table_exists(cursor, table):
+        return result
+
+    ids = get_fund_ids(cursor, codes)
+    if not ids:
+        return result
+    code_by_id = {fid: code for code, fid in ids.items()}
+    placeholders = ",".join("?" * len(code_by_id))
+    cursor.execute(f"""
+        SELECT fund_id, minute, estimate FROM {table}
+        WHERE fund_id IN ({placeholders})
+        ORDER BY fund_id, minute
+    """, list(code_by_id))
+
+    for row in cursor.fetchall():
+        result[code_by_id[row["fund_id"]]].append({
+            "time": minute_to_time(row["minute"]),
+            "estimate": float(row["estimate"]),
+        })
+    return result
+
+
+def get_series(code: str, date_str: str) -> List[Dict[str, float]]:
+    """单个基金某交易日的盘中序列"""
+    return get_day_series(date_str, [code])[code]
+
+
+def get_latest_snapshots(date_str: str, codes: Iterable[str]) -> Dict[str, Dict]:
+    """
+    某交易日每个基金的最新一条快照（每个基金一次主键查找，不读整条序列）。
+
+    Returns:
+        {code: {"time": "HH:MM", "estimate": float}}（无快照的基金不在结果中）
+    """
+    codes = list(codes)
+    if not codes:
+        return {}
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    table = partition_name(date_str)
+    if not table_exists(cursor, table):
+        return {}
+
+    ids = get_fund_ids(cursor, codes)
+    if not ids:
+        return {}
+    code_by_id = {fid: code for code, fid in ids.items()}
+    placeholders = ",".join("?" * len(code_by_id))
+    cursor.execute(f"""
+        SELECT s.fund_id, s.minute, s.estimate
+        FROM {table} s
+        JOIN (
+            SELECT fund_id, MAX(minute) AS minute
+            FROM {table}
+            WHERE fund_id IN ({placeholders})
+            GROUP BY fund_id
+        ) m ON m.fund_id = s.fund_id AND m.minute = s.minute
+    """, list(code_by_id))
+    return {
+        code_by_id[row["fund_id"]]: {"time": minute_to_time(row["minute"]), "estimate": float(row["estimate"])}
+        for row in cursor.fetchall()
+    }
+
+
+def get_fresh_snapshots(codes: Iterable[str], max_age_minutes: int,
+                        now: Optional[datetime] = None) -> Dict[str, Dict]:
+    """
+    今日（北京时间）不超过 max_age_minutes 分钟的最新快照。
+
+    Returns:
+        {code: {"time": "HH:MM", "estimate": float, "age": 分钟数}}（过期或无快照的基金不在结果中）
+    """
+    if max_age_minutes <= 0:
+        return {}
+    now = now or datetime.now(CST)
+    now_minute = now.hour * 60 + now.minute
+    fresh = {}
+    for code, snap in get_latest_snapshots(now.strftime("%Y-%m-%d"), codes).items():
+        age = now_minute - time_to_minute(snap["time"])
+        if 0 <= age <= max_age_minutes:
+            fresh[code] = {**snap, "age": age}
+    return fresh
+
+
+# ============================================================================
+# Rollup tiers
+# ============================================================================
+
+
+def update_rollups(cursor, date_str: str, since_minute: int = 0) -> int:
+    """
+    重算某交易日 since_minute 所在桶及之后的 15 分钟 OHLC，并刷新涉及基金的当日汇总（不提交）。
+
+    Returns:
+        int: 重算的 15 分钟桶数
+    """
+    table = partition_name(date_str)
+    if not table_exists(cursor, table):
+        return 0
+    day = date_to_day(date_str)
+    start = since_minute - since_minute % BUCKET_MINUTES
+
+    cursor.execute(f"""
+        SELECT fund_id, minute, estimate FROM {table}
+        WHERE minute >= ?
+        ORDER BY fund_id, minute
+    """, (start,))
+
+    bars: Dict[Tuple[int, int], List[float]] = {}
+    for row in cursor.fetchall():
+        key = (row["fund_id"], row["minute"] - row["minute"] % BUCKET_MINUTES)
+        est = float(row["estimate"])
+        bar = bars.get(key)
+        if bar is None:
+            bars[key] = [est, est, est, est]
+        else:
+            bar[1] = max(bar[1], est)
+            bar[2] = min(bar[2], est)
+            bar[3] = est
+    if not bars:
+        return 0
+
+    bulk_insert(cursor, "fund_intraday_15m", ("fund_id", "day", "bucket", "open", "high", "low", "close"),
+                [(fid, day, bucket, *bar) for (fid, bucket), bar in bars.items()],
+                on_conflict="replace")
+
+    # 当日汇总由当日全部 15 分钟桶合成（主键 (fund_id, day) 前缀查找）
+    fund_ids = sorted({fid for fid, _ in bars})
+    placeholders = ",".join("?" * len(fund_ids))
+    cursor.execute(f"""
+        SELECT fund_id, open, high, low, close FROM fund_intraday_15m
+        WHERE fund_id IN ({placeholders}) AND day = ?
+        ORDER BY fund_id, bucket
+    """, fund_ids + [day])
+
+    summary: Dict[int, List[float]] = {}
+    for row in cursor.fetchall():
+        s = summary.get(row["fund_id"])
+        if s is None:
+            summary[row["fund_id"]] = [row["open"], row["high"], row["low"], row["close"]]
+        else:
+            s[1] = max(s[1], row["high"])
+            s[2] = min(s[2], row["low"])
+            s[3] = row["close"]
+
+    bulk_insert(cursor, "fund_intraday_daily", ("fund_id", "day", "open", "high", "low", "close"),
+                [(fid, day, *s) for fid, s in summary.items()],
+                on_conflict="replace")
+    return len(bars)
+
+
+def get_bars(code: str, start_date: str, end_date: str) -> List[Dict]:
+    """15 分钟 OHLC（区间含首尾），estimate 为收盘值"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    ids = get_fund_ids(cursor, [code])
+    if not ids:
+        return []
+    cursor.execute("""
+        SELECT day, bucket, open, high, low, close FROM fund_intraday_15m
+        WHERE fund_id = ? AND day BETWEEN ? AND ?
+        ORDER BY day, bucket
+    """, (ids[code], date_to_day(start_date), date_to_day(end_date)))
+    return [{
+        "date": day_to_date(row["day"]),
+        "time": minute_to_time(row["bucket"]),
+        "open": float(row["open"]),
+        "high": float(row["high"]),
+        "low": float(row["low"]),
+        "estimate": float(row["close"]),
+    } for row in cursor.fetchall()]
+
+
+def get_daily_summaries(code: str, start_date: str, end_date: str) -> List[Dict]:
+    """每日盘中汇总（区间含首尾），estimate 为收盘值，range 为 high - low"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    ids = get_fund_ids(cursor, [code])
+    if not ids:
+        return []
+    cursor.execute("""
+        SELECT day, open, high, low, close FROM fund_intraday_daily
+        WHERE fund_id = ? AND day BETWEEN ? AND ?
+        ORDER BY day
+    """, (ids[code], date_to_day(start_date), date_to_day(end_date)))
+    return [{
+        "date": day_to_date(row["day"]),
+        "open": float(row["open"]),
+        "high": float(row["high"]),
+        "low": float(row["low"]),
+        "estimate": float(row["close"]),
+        "range": round(float(row["high"]) - float(row["low"]), 6),
+    } for row in cursor.fetchall()]
+
+
+def has_raw(date_str: str) -> bool:
+    conn = get_db_connection()
+    return table_exists(conn.cursor(), partition_name(date_str))
+
+
+def apply_retention(today: date) -> Dict[str, int]:
+    """
+    执行分级保留策略：
+    - 今日之前的原始分区：完整重算汇总后整表删除；
+    - 15 分钟桶保留 BAR_RETENTION_DAYS 天，日汇总保留 DAILY_RETENTION_DAYS 天。
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    today_str = today.strftime("%Y-%m-%d")
+    stats = {"partitions": 0, "bars": 0, "daily": 0}
+    try:
+        for d in list_partition_dates(cursor):
+            if d < today_str:
+                update_rollups(cursor, d)
+                cursor.execute(f"DROP TABLE IF EXISTS {partition_name(d)}")
+                stats["partitions"] += 1
+
+        bar_cutoff = date_to_day((today - timedelta(days=BAR_RETENTION_DAYS)).strftime("%Y-%m-%d"))
+        cursor.execute("DELETE FROM fund_intraday_15m WHERE day < ?", (bar_cutoff,))
+        stats["bars"] = cursor.rowcount
+
+        daily_cutoff = date_to_day((today - timedelta(days=DAILY_RETENTION_DAYS)).strftime("%Y-%m-%d"))
+        cursor.execute("DELETE FROM fund_intraday_daily WHERE day < ?", (daily_cutoff,))
+        stats["daily"] = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return stats
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+净值公布跟踪：记录每个基金 "D 日净值已获取"，收盘后只轮询尚未公布的基金。
+
+- 普通基金目标净值日为当日（交易日 16:00 后）；
+- QDII 基金按 T+2 节奏，目标净值日为上一交易日；
+- 每个基金的典型公布时间从 nav_publications 历史中学习，未到时间前不轮询，
+  未公布时按指数退避推迟下一次轮询；
+- 按日期补取净值（fund.get_navs_on_dates）沿用同一退避，上游尚无该日净值时不会每次都全量下载。
+"""
+import logging
+import threading
+from datetime import datetime, date, timedelta
+from statistics import median
+from typing import Dict, List, Tuple
+
+from ..db import get_db_connection
+from .trading_calendar import prev_trading_day
+
+logger = logging.getLogger(__name__)
+
+# 典型公布时间之前提前多少分钟开始轮询
+EARLY_MARGIN_MINUTES = 15
+# 退避：首次未公布后 10 分钟，之后翻倍，最长 60 分钟
+BACKOFF_BASE_MINUTES = 10
+BACKOFF_MAX_MINUTES = 60
+# 学习典型公布时间使用的最近记录数
+HISTORY_WINDOW = 20
+
+# code -> {"target": nav_date, "misses": int, "next_poll": minute_of_day}
+_poll_state: Dict[str, Dict] = {}
+# (code, nav_date) -> {"misses": int, "next_fetch": datetime}
+_fetch_state: Dict[Tuple[str, str], Dict] = {}
+_lock = threading.Lock()
+
+
+def _minute_of_day(dt: datetime) -> int:
+    return dt.hour * 60 + dt.minute
+
+
+def _backoff_minutes(misses: int) -> int:
+    return min(BACKOFF_BASE_MINUTES * (2 ** misses), BACKOFF_MAX_MINUTES)
+
+
+def _is_qdii(fund_type: str, name: str) -> bool:
+    return "QDII" in (fund_type or "") or "QDII" in (name or "")
+
+
+def get_target_nav_dates(codes: List[str], today: date) -> Dict[str, str]:
+    """每个基金今天应等待的净值日期（QDII 为上一交易日，其余为当日）"""
+    if not codes:
+        return {}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(codes))
+    cursor.execute(f"SELECT code, name, type FROM funds WHERE code IN ({placeholders})", codes)
+    qdii = {row["code"] for row in cursor.fetchall() if _is_qdii(row["type"], row["name"])}
+
+    today_str = today.strftime("%Y-%m-%d")
+    prev_str = prev_trading_day(today).strftime("%Y-%m-%d")
+    return {code: prev_str if code in qdii else today_str for code in codes}
+
+
+def get_typical_publish_minutes(codes: List[str]) -> Dict[str, int]:
+    """从公布日志学习每个基金的典型公布时间（分钟数，取最近记录中位数）"""
+    if not codes:
+        return {}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(codes))
+    cursor.execute(f"""
+        SELECT code, obtained_at FROM nav_publications
+        WHERE code IN ({placeholders})
+        ORDER BY code, nav_date DESC
+    """, codes)
+
+    samples: Dict[str, List[int]] = {}
+    for row in cursor.fetchall():
+        bucket = samples.setdefault(row["code"], [])
+        if len(bucket) < HISTORY_WINDOW:
+            hh, mm = row["obtained_at"][:5].split(":")
+            bucket.append(int(hh) * 60 + int(mm))
+    return {code: int(median(values)) for code, values in samples.items() if values}
+
+
+def get_outstanding_codes(codes: List[str], now: datetime) -> List[Tuple[str, str]]:
+    """
+    返回此刻需要轮询的 (code, target_nav_date)。
+
+    已在 fund_history 中拿到目标净值的基金直接标记为已公布；
+    其余基金按典型公布时间和退避计划筛选。
+    """
+    if not codes:
+        return []
+
+    targets = get_target_nav_dates(codes, now.date())
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(codes))
+    cursor.execute(f"""
+        SELECT code, MAX(date) AS latest_date FROM fund_history
+        WHERE code IN ({placeholders})
+        GROUP BY code
+    """, codes)
+    latest = {row["code"]: row["latest_date"] for row in cursor.fetchall()}
+
+    typical = get_typical_publish_minutes(codes)
+    now_minute = _minute_of_day(now)
+
+    due = []
+    with _lock:
+        for code in codes:
+            target = targets[code]
+            if latest.get(code) and latest[code] >= target:
+                _poll_state.pop(code, None)
+                continue
+
+            state = _poll_state.get(code)
+            if state is None or state["target"] != target:
+                state = {"target": target, "misses": 0, "next_poll": 0}
+                _poll_state[code] = state
+
+            if now_minute < state["next_poll"]:
+                continue
+            if code in typical and now_minute < typical[code] - EARLY_MARGIN_MINUTES:
+                continue
+            due.append((code, target))
+    return due
+
+
+def record_poll_result(code: str, target: str, latest_date: str, now: datetime) -> bool:
+    """
+    记录一次轮询结果，返回目标净值是否已公布。
+    已公布则写入公布日志；未公布则按指数退避安排下一次轮询。
+    """
+    if latest_date and latest_date >= target:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT OR IGNORE INTO nav_publications (code, nav_date, obtained_at)
+            VALUES (?, ?, ?)
+        """, (code, target, now.strftime("%H:%M")))
+        conn.commit()
+        with _lock:
+            _poll_state.pop(code, None)
+        return True
+
+    with _lock:
+        state = _poll_state.setdefault(code, {"target": target, "misses": 0, "next_poll": 0})
+        delay = _backoff_minutes(state["misses"])
+        state["misses"] += 1
+        state["next_poll"] = _minute_of_day(now) + delay
+    return False
+
+
+def filter_fetch_due(code: str, nav_dates, now: datetime) -> List[str]:
+    """按日期补取净值时，返回此刻可以请求上游的日期（排除仍在退避中的日期）"""
+    with _lock:
+        return sorted(d for d in nav_dates
+                      if (code, d) not in _fetch_state or now >= _fetch_state[(code, d)]["next_fetch"])
+
+
+def record_fetch_result(code: str, requested, found, now: datetime):
+    """记录一次按日期补取的结果：取到的日期清除退避，未取到的按指数退避推迟下一次请求"""
+    with _lock:
+        for nav_date in requested:
+            if nav_date in found:
+                _fetch_state.pop((code, nav_date), None)
+                continue
+            state = _fetch_state.setdefault((code, nav_date), {"misses": 0, "next_fetch": now})
+            state["next_fetch"] = now + timedelta(minutes=_backoff_minutes(state["misses"]))
+            state["misses"] += 1
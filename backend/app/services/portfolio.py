@@ -0,0 +1,546 @@
+# -*- coding: utf-8 -*-
+"""
+组合估值引擎：单账户持仓、多账户聚合持仓等视图共用。
+
+输入一组持仓 (code, shares, cost)，批量读取基金元数据与最新净值日期，
+并行拉取一次实时估值（或经 stream_holdings 随到随推），再在对齐的 NumPy 数组（份额、成本、净值、估值、有效性掩码）
+上一次性计算盈亏并归约出汇总；结果可按行或按列（columnar JSON）输出。
+传入 max_age 时，不超过该分钟数的盘中快照直接用作估值（纯查库），只为过期或缺失的基金实时拉取。
+各视图只负责组装持仓集合。
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ..db import get_db_connection, db_scope
+from .fund import get_combined_valuation, guess_fund_type
+from .fund_categories import classify_fund_type
+from .intraday_store import get_fresh_snapshots
+from . import valuation_hub
+
+logger = logging.getLogger(__name__)
+
+# Defensive: Limit batch size to prevent SQL statement overflow
+MAX_HOLDINGS = 500
+MAX_WORKERS = 10
+VALUATION_TIMEOUT = 30  # 全部估值的总超时（秒）
+FUTURE_TIMEOUT = 5  # 单只基金取结果的超时（秒）
+
+
+def empty_portfolio() -> Dict[str, Any]:
+    return {
+        "summary": {
+            "total_market_value": 0.0,
+            "total_cost": 0.0,
+            "total_day_income": 0.0,
+            "total_income": 0.0,
+            "total_return_rate": 0.0
+        },
+        "positions": []
+    }
+
+
+def load_holdings(account_ids: List[int], category: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    读取若干账户的持仓，按基金代码合并（份额相加、成本按份额加权平均），
+    并带出基金名称/类型/分类。
+
+    Args:
+        account_ids: 账户 ID 列表（单账户视图传一个）
+        category: 只返回该分类（funds.category）的持仓
+    """
+    if not account_ids:
+        return []
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(account_ids))
+    category_filter = " AND f.category = ?" if category else ""
+    cursor.execute(f"""
+        SELECT p.code, SUM(p.shares) AS shares, SUM(p.shares * p.cost) AS cost_basis,
+               f.name, f.type, f.category
+        FROM positions p
+        LEFT JOIN funds f ON f.code = p.code
+        WHERE p.account_id IN ({placeholders}) AND p.shares > 0{category_filter}
+        GROUP BY p.code, f.name, f.type, f.category
+    """, list(account_ids) + ([category] if category else []))
+    return _to_holdings(cursor.fetchall())
+
+
+def load_user_holdings(user_id: int, category: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    读取用户全部账户的合并持仓：直接读物化的 user_holdings（每只基金一行），不再逐账户分组。
+
+    Args:
+        user_id: 用户 ID
+        category: 只返回该分类（funds.category）的持仓
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    category_filter = " AND f.category = ?" if category else ""
+    cursor.execute(f"""
+        SELECT h.code, h.shares, h.cost_basis, f.name, f.type, f.category
+        FROM user_holdings h
+        LEFT JOIN funds f ON f.code = h.code
+        WHERE h.user_id = ?{category_filter}
+    """, [user_id] + ([category] if category else []))
+    return _to_holdings(cursor.fetchall())
+
+
+def load_holdings_by_account(account_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    一次查询读取若干账户各自的持仓（不跨账户合并），带出基金名称/类型/分类。
+
+    Returns:
+        {account_id: holdings}，无持仓的账户不出现
+    """
+    if not account_ids:
+        return {}
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(account_ids))
+    cursor.execute(f"""
+        SELECT p.account_id, p.code, p.shares, p.shares * p.cost AS cost_basis,
+               f.name, f.type, f.category
+        FROM positions p
+        LEFT JOIN funds f ON f.code = p.code
+        WHERE p.account_id IN ({placeholders}) AND p.shares > 0
+        ORDER BY p.account_id
+    """, list(account_ids))
+    rows_by_account: Dict[int, list] = {}
+    for row in cursor.fetchall():
+        rows_by_account.setdefault(row["account_id"], []).append(row)
+    return {account_id: _to_holdings(rows) for account_id, rows in rows_by_account.items()}
+
+
+def _to_holdings(rows) -> List[Dict[str, Any]]:
+    """(code, shares, cost_basis, name, type, category) 行 -> 持仓（成本按份额加权平均）"""
+    holdings = []
+    for row in rows:
+        shares = float(row["shares"])
+        if shares <= 0:
+            continue
+        holdings.append({
+            "code": row["code"],
+            "shares": shares,
+            "cost": float(row["cost_basis"]) / shares,
+            "name": row["name"],
+            "type": row["type"],
+            "category": row["category"],
+        })
+    return holdings
+
+
+def _load_metadata(holdings: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """补齐缺失的基金元数据并批量读取最新净值日期"""
+    codes = [h["code"] for h in holdings]
+    meta = {h["code"]: {"name": h.get("name"), "type": h.get("type"), "category": h.get("category")}
+            for h in holdings}
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(codes))
+
+    missing = [h["code"] for h in holdings if "name" not in h]
+    if missing:
+        cursor.execute(f"""
+            SELECT code, name, type, category FROM funds WHERE code IN ({",".join("?" * len(missing))})
+        """, missing)
+        for row in cursor.fetchall():
+            meta[row["code"]].update(name=row["name"], type=row["type"], category=row["category"])
+
+    # 最新确认净值（流式视图的首帧直接用它展示）
+    cursor.execute(f"""
+        SELECT h.code, h.date AS latest_date, h.nav AS latest_nav
+        FROM fund_history h
+        JOIN (
+            SELECT code, MAX(date) AS date
+            FROM fund_history
+            WHERE code IN ({placeholders})
+            GROUP BY code
+        ) m ON m.code = h.code AND m.date = h.date
+    """, codes)
+    for row in cursor.fetchall():
+        meta[row["code"]].update(latest_date=row["latest_date"], latest_nav=row["latest_nav"])
+    return meta
+
+
+def _valuation_task(code: str):
+    """执行器任务：每个任务在独立的 db_scope 内运行，结束即归还连接"""
+    with db_scope():
+        return get_combined_valuation(code)
+
+
+def _iter_valuations(codes: Iterable[str]) -> Iterator[Tuple[str, Any]]:
+    """
+    并行拉取实时估值，按完成顺序逐只产出 (code, data dict | TimeoutError | Exception)。
+
+    总超时后仍未完成的基金产出 TimeoutError；调用方提前关闭生成器时取消未开始的任务。
+    """
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    try:
+        future_to_code = {executor.submit(_valuation_task, code): code for code in codes}
+        pending = set(future_to_code.values())
+        try:
+            for future in as_completed(future_to_code, timeout=VALUATION_TIMEOUT):
+                code = future_to_code[future]
+                pending.discard(code)
+                try:
+                    data = future.result(timeout=FUTURE_TIMEOUT) or {}
+                except Exception as e:
+                    data = e
+                yield code, data
+        except TimeoutError:
+            logger.error("Overall timeout in parallel valuation fetch")
+            for code in pending:
+                yield code, TimeoutError()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _fetch_valuations(codes: Iterable[str]) -> Dict[str, Any]:
+    """
+    并行拉取实时估值。
+
+    Returns:
+        {code: data dict | TimeoutError | Exception}
+    """
+    return dict(_iter_valuations(codes))
+
+
+def _confirmed_valuation(info: Dict[str, Any]) -> Dict[str, Any]:
+    """只有最新确认净值、没有实时估值时的估值数据"""
+    if not info.get("latest_nav"):
+        return {"valuationSource": "nav"}
+    return {"nav": info["latest_nav"], "navDate": info["latest_date"], "valuationSource": "nav"}
+
+
+def _snapshot_valuations(meta: Dict[str, Dict[str, Any]], max_age: int) -> Dict[str, Dict[str, Any]]:
+    """
+    用不超过 max_age 分钟的盘中快照构造估值数据（纯查库）。
+
+    快照只存估算净值，涨跌幅相对最新确认净值计算；当日净值已公布的基金不用快照。
+    """
+    if max_age <= 0:
+        return {}
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    candidates = [code for code, info in meta.items()
+                  if info.get("latest_nav") and info.get("latest_date") != today_str]
+    result = {}
+    for code, snap in get_fresh_snapshots(candidates, max_age).items():
+        info = meta[code]
+        nav = float(info["latest_nav"])
+        result[code] = {
+            "nav": nav,
+            "navDate": info["latest_date"],
+            "estimate": snap["estimate"],
+            "est_rate": round((snap["estimate"] / nav - 1) * 100, 2),
+            "time": snap["time"],
+            "valuationSource": "snapshot",
+            "valuationAge": snap["age"],
+        }
+    return result
+
+
+# Column order of the columnar layout (same fields as a row)
+COLUMNS = (
+    "code", "name", "type", "category", "cost", "shares", "nav", "nav_date", "nav_updated_today",
+    "estimate", "est_rate", "is_est_valid", "cost_basis", "nav_market_value", "est_market_value",
+    "accumulated_income", "accumulated_return_rate", "day_income", "total_income", "total_return_rate",
+    "update_time", "valuation_source", "valuation_age",
+)
+# Fields present on Timeout/Error rows in the row layout
+_FAILED_FIELDS = (
+    "code", "name", "cost", "shares", "nav", "estimate", "est_market_value", "day_income",
+    "total_income", "total_return_rate", "accumulated_income", "est_rate", "is_est_valid", "update_time",
+)
+# valuation_source：live 实时拉取 / snapshot 盘中快照 / nav 仅确认净值；valuation_age：快照距今分钟数
+
+
+class _Failed(Exception):
+    """估值未取得（Timeout / Error），异常信息即该行显示的名称"""
+
+
+def _rate(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """numerator / denominator * 100，分母非正时为 0"""
+    out = np.zeros_like(numerator)
+    np.divide(numerator * 100, denominator, out=out, where=denominator > 0)
+    return out
+
+
+def _compute_pnl(shares, cost, nav, estimate, est_rate, volatile) -> Dict[str, np.ndarray]:
+    """
+    对齐数组上一次性计算盈亏。
+
+    Args:
+        volatile: ETF / 联接基金掩码（允许超过 10% 的估算涨跌幅）
+    """
+    # Validation: If estRate is absurdly high for a fund (abs > 10%), ignore estimate
+    # unless it is an ETF / feeder fund, which may legitimately move more
+    valid = (estimate > 0) & (nav > 0) & ((np.abs(est_rate) < 10.0) | volatile)
+
+    # A. Confirmed (Based on Yesterday's NAV)
+    nav_market_value = nav * shares
+    cost_basis = cost * shares
+    accumulated_income = nav_market_value - cost_basis
+
+    # B. Intraday (Based on Real-time Estimate), fallback to confirmed value
+    day_income = np.where(valid, (estimate - nav) * shares, 0.0)
+    est_market_value = np.where(valid, estimate * shares, nav_market_value)
+
+    # C. Total Projected
+    total_income = accumulated_income + day_income
+
+    return {
+        "is_est_valid": valid,
+        "cost_basis": cost_basis,
+        "nav_market_value": nav_market_value,
+        "est_market_value": est_market_value,
+        "accumulated_income": accumulated_income,
+        "accumulated_return_rate": _rate(accumulated_income, cost_basis),
+        "day_income": day_income,
+        "total_income": total_income,
+        "total_return_rate": _rate(total_income, cost_basis),
+    }
+
+
+def value_holdings(holdings: List[Dict[str, Any]], columnar: bool = False, max_age: int = 0) -> Dict[str, Any]:
+    """
+    对一组持仓做实时估值并计算组合盈亏。
+
+    Args:
+        holdings: [{"code", "shares", "cost"}, ...]，可带 name/type/category（如 load_holdings 的结果），
+                  未带时从 funds 表批量补齐
+        columnar: True 时 positions 以列式返回 {"columns": [...], "data": {列名: [...]}}
+        max_age: 大于 0 时优先使用不超过该分钟数的盘中快照，只为过期/缺失的基金实时拉取
+
+    Returns:
+        {"summary": {...}, "positions": ...}，按预估市值降序
+    """
+    if not holdings:
+        result = empty_portfolio()
+        if columnar:
+            result["positions"] = {"columns": list(COLUMNS), "data": {c: [] for c in COLUMNS}}
+        return result
+    if len(holdings) > MAX_HOLDINGS:
+        raise ValueError(f"Too many positions ({len(holdings)}), maximum {MAX_HOLDINGS} allowed")
+
+    meta = _load_metadata(holdings)
+    valuations = _snapshot_valuations(meta, max_age)
+    valuations.update(_fetch_valuations(h["code"] for h in holdings if h["code"] not in valuations))
+    return _evaluate(holdings, meta, valuations, columnar)
+
+
+def _evaluate(holdings: List[Dict[str, Any]], meta: Dict[str, Dict[str, Any]],
+              valuations: Dict[str, Any], columnar: bool = False) -> Dict[str, Any]:
+    """在已取得的元数据与估值上计算盈亏，输出同 value_holdings"""
+    today_str = datetime.now().strftime("%Y-%m-%d")
+
+    n = len(holdings)
+    shares = np.fromiter((h["shares"] for h in holdings), dtype=np.float64, count=n)
+    cost = np.fromiter((h["cost"] for h in holdings), dtype=np.float64, count=n)
+    nav = np.zeros(n)
+    estimate = np.zeros(n)
+    est_rate = np.zeros(n)
+    volatile = np.zeros(n, dtype=bool)
+    # 估值失败的行（Timeout / Error）不计入汇总，盈亏字段置 0
+    failed = np.zeros(n, dtype=bool)
+
+    text = {c: [None] * n for c in ("code", "name", "type", "category", "nav_date", "nav_updated_today", "update_time",
+                                    "valuation_source", "valuation_age")}
+    for i, holding in enumerate(holdings):
+        code = holding["code"]
+        text["code"][i] = code
+        text["update_time"][i] = "--"
+        data = valuations.get(code)
+        try:
+            if data is None or isinstance(data, TimeoutError):
+                logger.warning(f"Timeout fetching valuation for {code}")
+                raise _Failed("Timeout")
+            if isinstance(data, Exception):
+                logger.error(f"Error processing position {code}: {data}")
+                raise _Failed("Error")
+
+            info = meta[code]
+            name = data.get("name") or info.get("name") or code
+            fund_type, fund_category = info.get("type"), info.get("category")
+            # Fund not in the funds table (meta already carries funds.type): fall back to name heuristics
+            if not fund_type:
+                fund_type = guess_fund_type(name)
+                fund_category = classify_fund_type(fund_type)
+
+            # est_rate is percent, e.g. 1.5 for +1.5%
+            nav[i] = float(data.get("nav") or 0.0)
+            estimate[i] = float(data.get("estimate") or 0.0)
+            est_rate[i] = float(data.get("est_rate", data.get("estRate")) or 0.0)
+            volatile[i] = "ETF" in name or "联接" in name
+
+            latest_date = info.get("latest_date")
+            text["name"][i] = name
+            text["type"][i] = fund_type
+            text["category"][i] = fund_category
+            text["nav_date"][i] = data.get("navDate", "--")  # If available, else implicit
+            text["nav_updated_today"][i] = latest_date == today_str if latest_date else False
+            text["update_time"][i] = data.get("time", "--")
+            text["valuation_source"][i] = data.get("valuationSource", "live")
+            text["valuation_age"][i] = data.get("valuationAge", 0 if text["valuation_source"][i] == "live" else None)
+        except _Failed as e:
+            failed[i] = True
+            text["name"][i] = str(e)
+        except Exception as e:
+            logger.error(f"Error processing position {code}: {e}")
+            failed[i] = True
+            text["name"][i] = "Error"
+
+    # Failed rows carry zero prices so they contribute nothing below
+    nav[failed] = estimate[failed] = est_rate[failed] = 0.0
+    pnl = _compute_pnl(shares, cost, nav, estimate, est_rate, volatile)
+    counted = ~failed
+
+    total_market_value = float(pnl["est_market_value"][counted].sum())
+    total_day_income = float(pnl["day_income"][counted].sum())
+    total_cost = float(pnl["cost_basis"][counted].sum())
+    total_income = total_market_value - total_cost
+    total_return_rate = (total_income / total_cost * 100) if total_cost > 0 else 0.0
+
+    # Failed rows report zeros across the board
+    for key in ("cost_basis", "nav_market_value", "est_market_value", "accumulated_income",
+                "accumulated_return_rate", "day_income", "total_income", "total_return_rate"):
+        pnl[key] = np.where(failed, 0.0, pnl[key])
+
+    # 按预估市值降序（稳定排序）
+    order = np.argsort(-pnl["est_market_value"], kind="stable")
+    columns = {
+        "cost": cost, "shares": shares, "nav": nav, "estimate": estimate, "est_rate": est_rate,
+        "is_est_valid": pnl["is_est_valid"],
+    }
+    for key in ("cost_basis", "nav_market_value", "est_market_value", "accumulated_income",
+                "accumulated_return_rate", "day_income", "total_income", "total_return_rate"):
+        columns[key] = np.round(pnl[key], 2)
+    data = {c: (columns[c][order].tolist() if c in columns else [text[c][i] for i in order]) for c in COLUMNS}
+
+    summary = {
+        "total_market_value": round(total_market_value, 2),  # Projected
+        "total_cost": round(total_cost, 2),
+        "total_day_income": round(total_day_income, 2),
+        "total_income": round(total_income, 2),
+        "total_return_rate": round(total_return_rate, 2)
+    }
+    if columnar:
+        return {"summary": summary, "positions": {"columns": list(COLUMNS), "data": data}}
+
+    failed_sorted = failed[order].tolist()
+    positions = []
+    for j in range(n):
+        fields = _FAILED_FIELDS if failed_sorted[j] else COLUMNS
+        positions.append({c: data[c][j] for c in fields})
+    return {"summary": summary, "positions": positions}
+
+
+def summarize_holdings(groups: Dict[Any, List[Dict[str, Any]]], max_age: int = 0,
+                       valuations: Optional[Dict[str, Any]] = None) -> Dict[Any, Dict[str, Any]]:
+    """
+    多组持仓共用一次元数据与快照读取，分别算出各组汇总（纯查库，不请求上游）。
+
+    Args:
+        groups: {key: holdings}，如 load_holdings_by_account 的结果
+        max_age: 大于 0 时使用不超过该分钟数的盘中快照，否则按最新确认净值
+        valuations: 覆盖在快照之上的估值（如推送中心缓存）
+
+    Returns:
+        {key: summary}，空持仓组为全 0 汇总
+    """
+    union = list({h["code"]: h for holdings in groups.values() for h in holdings}.values())
+    meta = _load_metadata(union) if union else {}
+    shared = {code: _confirmed_valuation(info) for code, info in meta.items()}
+    shared.update(_snapshot_valuations(meta, max_age))
+    shared.update(valuations or {})
+    return {
+        key: _evaluate(holdings, meta, shared)["summary"] if holdings else empty_portfolio()["summary"]
+        for key, holdings in groups.items()
+    }
+
+
+def value_accounts(account_ids: List[int], category: Optional[str] = None,
+                   columnar: bool = False, max_age: int = 0) -> Dict[str, Any]:
+    """若干账户（单账户或家庭视图）的合并估值"""
+    return value_holdings(load_holdings(account_ids, category), columnar=columnar, max_age=max_age)
+
+
+def value_user(user_id: int, category: Optional[str] = None,
+               columnar: bool = False, max_age: int = 0) -> Dict[str, Any]:
+    """用户全部账户的聚合估值（读物化聚合持仓）"""
+    return value_holdings(load_user_holdings(user_id, category), columnar=columnar, max_age=max_age)
+
+
+class LivePortfolio:
+    """
+    一个持仓视图的增量估值状态：元数据只读一次，估值按基金逐只更新。
+
+    初始估值为各基金最新确认净值（max_age > 0 时优先用新鲜的盘中快照），可用 update() 覆盖。
+    库只在构造时读取；update() / snapshot() 为纯计算（NumPy），异步调用方应放入线程池执行。
+    """
+
+    def __init__(self, holdings: List[Dict[str, Any]], max_age: int = 0):
+        if len(holdings) > MAX_HOLDINGS:
+            raise ValueError(f"Too many positions ({len(holdings)}), maximum {MAX_HOLDINGS} allowed")
+        self.holdings = holdings
+        self.by_code = {h["code"]: h for h in holdings}
+        self.meta = _load_metadata(holdings) if holdings else {}
+        self.valuations: Dict[str, Any] = {code: _confirmed_valuation(info) for code, info in self.meta.items()}
+        snapshots = _snapshot_valuations(self.meta, max_age)
+        self.valuations.update(snapshots)
+        # 仍需实时拉取的基金
+        self.stale_codes = [code for code in self.by_code if code not in snapshots]
+
+    @property
+    def codes(self) -> List[str]:
+        return list(self.by_code)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前估值下的完整结果（同 value_holdings）"""
+        if not self.holdings:
+            return empty_portfolio()
+        return _evaluate(self.holdings, self.meta, self.valuations)
+
+    def update(self, code: str, data: Any) -> Dict[str, Any]:
+        """记录一只基金的估值（data dict 或异常），返回该基金的持仓行"""
+        self.valuations[code] = data
+        return _evaluate([self.by_code[code]], self.meta, {code: data})["positions"][0]
+
+
+def stream_holdings(holdings: List[Dict[str, Any]], max_age: int = 0) -> Iterator[Dict[str, Any]]:
+    """
+    流式估值：先产出确认净值骨架，再随实时估值到达逐只推送，最后产出汇总。
+    max_age > 0 时骨架已含新鲜的盘中快照，只为过期/缺失的基金实时拉取。
+
+    Frames:
+        {"type": "skeleton", "summary": {...}, "positions": [...]}  按最新确认净值（及快照）计算，仅需查库
+        {"type": "position", "position": {...}}                     某只基金的实时估值行（字段同 value_holdings）
+        {"type": "summary", "summary": {...}}                       全部到达（或总超时）后的汇总，与 value_holdings 一致
+    """
+    view = LivePortfolio(holdings, max_age)
+    yield {"type": "skeleton", **view.snapshot()}
+
+    for code, data in _iter_valuations(view.stale_codes):
+        # 顺带预热推送中心缓存，随后建立的实时订阅无需重新拉取
+        if not isinstance(data, Exception):
+            valuation_hub.publish({code: data})
+        yield {"type": "position", "position": view.update(code, data)}
+
+    yield {"type": "summary", "summary": view.snapshot()["summary"]}
+
+
+def stream_accounts(account_ids: List[int], category: Optional[str] = None,
+                    max_age: int = 0) -> Iterator[Dict[str, Any]]:
+    """若干账户合并持仓的流式估值（帧格式见 stream_holdings）"""
+    return stream_holdings(load_holdings(account_ids, category), max_age)
+
+
+def stream_user(user_id: int, category: Optional[str] = None, max_age: int = 0) -> Iterator[Dict[str, Any]]:
+    """用户全部账户聚合持仓的流式估值（帧格式见 stream_holdings）"""
+    return stream_holdings(load_user_holdings(user_id, category), max_age)
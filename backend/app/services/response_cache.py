@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+接口响应缓存的条目存储（由 main.ResponseCacheMiddleware 读写）。
+
+条目键为 (路径, 查询串, user_id)，不按用户区分的条目 user_id 为 None。
+请求以外改动用户数据的地方（如调度器确认待处理流水）调用 invalidate_users 清空相关用户的条目。
+"""
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+# key -> (expires_at, status, headers, body, etag)
+_entries: "OrderedDict[Tuple, tuple]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def get(key: Tuple, now: float) -> Optional[tuple]:
+    """未过期的条目（命中时移到 LRU 末尾），否则返回 None"""
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        _entries.move_to_end(key)
+        return entry
+
+
+def put(key: Tuple, entry: tuple, max_entries: int):
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > max_entries:
+            _entries.popitem(last=False)
+
+
+def invalidate_users(user_ids: Iterable[int]) -> int:
+    """清空这些用户的按用户缓存条目，返回清除条数"""
+    users = set(user_ids)
+    if not users:
+        return 0
+    with _lock:
+        keys = [k for k in _entries if k[2] in users]
+        for key in keys:
+            del _entries[key]
+    return len(keys)
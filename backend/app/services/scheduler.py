@@ -1,33 +1,64 @@
+import hashlib
+import json
 import logging
 import threading
 import time
 from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
 import akshare as ak
 import pandas as pd
-from ..db import get_db_connection
+from ..db import get_db_connection, db_scope
+from ..dialect import begin_write, bulk_insert
 from ..config import Config
-from ..services.fund import get_combined_valuation
+from ..services.fund import get_combined_valuation, rebuild_search_index
 from ..services.subscription import get_active_subscriptions, update_notification_time
 from ..services.email import send_email
 from ..services.trade import process_pending_transactions
+from ..services.intraday_store import save_snapshots, apply_retention
+from ..services import fund_directory, fund_categories, account_summary
+from ..services.fund_categories import classify_fund_type
 
 logger = logging.getLogger(__name__)
 
 # Define China Standard Time (UTC+8)
 CST = timezone(timedelta(hours=8))
 
-def fetch_and_update_funds():
+# Refuse to delete more than this share of stored funds in one refresh
+# (protects against a truncated upstream list wiping the table)
+MAX_FUND_DELETE_RATIO = 0.1
+
+_last_fund_list_digest = None
+
+
+def _normalize_fund_rows(df: pd.DataFrame) -> Dict[str, Tuple[str, Optional[str]]]:
+    rows = {}
+    for code, name, type_ in df[["code", "name", "type"]].itertuples(index=False, name=None):
+        if pd.isna(code) or not str(code).strip():
+            continue
+        rows[str(code).strip()] = (
+            "" if pd.isna(name) else str(name),
+            None if pd.isna(type_) else str(type_),
+        )
+    return rows
+
+
+def fetch_and_update_funds() -> Optional[Dict[str, int]]:
     """
     Fetches the complete fund list from AkShare and updates the SQLite DB.
     This is a blocking operation, should be run in a background thread.
+
+    Only the difference against the stored rows is written: new funds are
+    inserted, changed name/type rows updated and vanished funds deleted, so an
+    unchanged list costs no writes at all. Returns the change counts.
     """
+    global _last_fund_list_digest
     logger.info("Starting fund list update...")
     try:
         # Fetch data
         df = ak.fund_name_em()
         if df is None or df.empty:
             logger.warning("Fetched empty fund list from AkShare.")
-            return
+            return None
 
         # Rename columns to match our simple schema
         # Expected cols: "基金代码", "基金简称", "基金类型"
@@ -36,46 +67,93 @@ def fetch_and_update_funds():
             "基金简称": "name",
             "基金类型": "type"
         })
-        
-        # Select only relevant columns
-        data_to_insert = df[["code", "name", "type"]].to_dict(orient="records")
-        
+        incoming = _normalize_fund_rows(df)
+
+        # Whole-frame fingerprint: identical to the last applied list -> nothing to do
+        digest = hashlib.sha1(
+            json.dumps(sorted(incoming.items()), ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        if digest == _last_fund_list_digest:
+            logger.info(f"Fund list unchanged ({len(incoming)} funds), skipping write.")
+            return {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": len(incoming)}
+
         conn = get_db_connection()
         cursor = conn.cursor()
+        cursor.execute("SELECT code, name, type FROM funds")
+        stored = {row["code"]: (row["name"], row["type"]) for row in cursor.fetchall()}
+
+        # category is derived from type at ingest (indexed, filtered/grouped in SQL)
+        inserts = [(code, name, type_, classify_fund_type(type_))
+                   for code, (name, type_) in incoming.items() if code not in stored]
+        updates = [(name, type_, classify_fund_type(type_), code) for code, (name, type_) in incoming.items()
+                   if code in stored and stored[code] != (name, type_)]
+        deletes = [(code,) for code in stored if code not in incoming]
+
+        if stored and len(deletes) > len(stored) * MAX_FUND_DELETE_RATIO:
+            logger.warning(
+                f"Fund list refresh would delete {len(deletes)} of {len(stored)} funds; "
+                f"upstream list looks truncated, keeping them"
+            )
+            deletes = []
 
         # Split into smaller batches to avoid long locks
         batch_size = 1000
-        total = len(data_to_insert)
+        writes = [("insert", r) for r in inserts] + [("update", r) for r in updates] + [("delete", r) for r in deletes]
 
-        for i in range(0, total, batch_size):
-            batch = data_to_insert[i:i+batch_size]
+        for i in range(0, len(writes), batch_size):
+            batch = writes[i:i+batch_size]
 
             try:
-                # Use IMMEDIATE to acquire write lock immediately
-                conn.execute("BEGIN IMMEDIATE")
-
-                cursor.executemany("""
-                    INSERT OR REPLACE INTO funds (code, name, type, updated_at)
-                    VALUES (:code, :name, :type, CURRENT_TIMESTAMP)
-                """, batch)
+                # Acquire write lock immediately (BEGIN IMMEDIATE on SQLite)
+                begin_write(conn)
+
+                bulk_insert(cursor, "funds", ("code", "name", "type", "category"),
+                            [r for kind, r in batch if kind == "insert"],
+                            on_conflict="replace", timestamp_columns=("updated_at",))
+                batch_updates = [r for kind, r in batch if kind == "update"]
+                if batch_updates:
+                    cursor.executemany(
+                        "UPDATE funds SET name = ?, type = ?, category = ?, updated_at = CURRENT_TIMESTAMP WHERE code = ?",
+                        batch_updates
+                    )
+                batch_deletes = [r for kind, r in batch if kind == "delete"]
+                if batch_deletes:
+                    cursor.executemany("DELETE FROM funds WHERE code = ?", batch_deletes)
 
                 conn.commit()
             except Exception as e:
                 conn.rollback()
-                logger.error(f"Batch insert failed at offset {i}: {e}")
+                logger.error(f"Batch write failed at offset {i}: {e}")
                 raise
 
             # Give other threads a chance between batches
-            if i + batch_size < total:
+            if i + batch_size < len(writes):
                 time.sleep(0.01)
 
-        logger.info(f"Fund list updated. Total funds: {total}")
-        
+        _last_fund_list_digest = digest
+        counts = {
+            "inserted": len(inserts),
+            "updated": len(updates),
+            "deleted": len(deletes),
+            "unchanged": len(incoming) - len(inserts) - len(updates),
+        }
+        logger.info(
+            f"Fund list updated. Total funds: {len(incoming)} "
+            f"(+{counts['inserted']} ~{counts['updated']} -{counts['deleted']}, {counts['unchanged']} unchanged)"
+        )
+
+        if writes:
+            rebuild_search_index()
+            fund_directory.reload()
+            fund_categories.invalidate()
+        return counts
+
     except Exception as e:
         logger.error(f"Failed to update fund list: {e}")
+        return None
 
-from ..services.subscription import get_active_subscriptions, update_notification_time, update_digest_time
-from ..services.trading_calendar import is_trading_day
+from ..services.subscription import get_active_subscriptions, update_notification_time, update_digest_times
+from ..services.trading_calendar import is_trading_day, refresh_from_akshare
 
 def collect_intraday_snapshots():
     """
@@ -145,18 +223,13 @@ def collect_intraday_snapshots():
     date_str = today.strftime("%Y-%m-%d")
     time_str = now_cst.strftime("%H:%M")
 
-    collected = 0
+    rows = []
     skipped = 0
     for code in codes:
         try:
             data = get_combined_valuation(code)
             if data and data.get("estimate"):
-                cursor.execute("""
-                    INSERT OR REPLACE INTO fund_intraday_snapshots
-                    (fund_code, date, time, estimate)
-                    VALUES (?, ?, ?, ?)
-                """, (code, date_str, time_str, float(data["estimate"])))
-                collected += 1
+                rows.append((code, time_str, float(data["estimate"])))
             else:
                 skipped += 1
                 logger.warning(f"Skipped {code}: no estimate data (data={data})")
@@ -164,40 +237,42 @@ def collect_intraday_snapshots():
         except Exception as e:
             logger.error(f"Intraday collect failed for {code}: {e}")
 
-    conn.commit()
+    # 5. Write the whole tick into today's partition in one batch
+    collected = save_snapshots(date_str, rows)
 
     if collected > 0:
         logger.info(f"Collected {collected} intraday snapshots at {time_str} (skipped {skipped})")
+        account_summary.refresh_for_codes(r[0] for r in rows)
 
 def cleanup_old_intraday_data():
     """
-    Clean up intraday snapshots older than 30 days.
-    Runs once per day at 00:00.
+    Apply intraday retention tiers. Runs once per day at 00:00.
+    Raw day partitions before today are rolled up and dropped whole;
+    15-minute bars keep 30 days and daily summaries keep a year.
     """
-    now_cst = datetime.now(CST)
-    cutoff = (now_cst - timedelta(days=30)).strftime("%Y-%m-%d")
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM fund_intraday_snapshots WHERE date < ?", (cutoff,))
-    deleted = cursor.rowcount
-    conn.commit()
-    if deleted > 0:
-        logger.info(f"Cleaned up {deleted} old intraday records (before {cutoff})")
+    stats = apply_retention(datetime.now(CST).date())
+    if any(stats.values()):
+        logger.info(
+            f"Intraday retention: dropped {stats['partitions']} raw partitions, "
+            f"{stats['bars']} bars, {stats['daily']} daily summaries"
+        )
 
 def update_holdings_nav():
     """
     Update NAV (net asset value) for all holdings.
     Fetches latest NAV from AkShare and updates fund_history table.
     Runs between 16:00-24:00 on trading days.
-    Only counts as success if today's NAV is available.
+
+    Only funds whose target NAV has not been obtained yet are polled
+    (see nav_watcher): QDII funds wait for the previous trading day's NAV,
+    and each fund is polled around its learned publication time with backoff.
     """
     from .fund import get_fund_history
     from .trading_calendar import is_trading_day
+    from .nav_watcher import get_outstanding_codes, record_poll_result
 
     now_cst = datetime.now(CST)
     today = now_cst.date()
-    today_str = today.strftime("%Y-%m-%d")
 
     # Only run on trading days
     if not is_trading_day(today):
@@ -217,31 +292,70 @@ def update_holdings_nav():
     if not codes:
         return
 
-    # Update NAV for each fund
-    updated = 0  # Today's NAV available
-    pending = 0  # Today's NAV not yet published
+    outstanding = get_outstanding_codes(codes, now_cst)
+    if not outstanding:
+        return
 
-    for code in codes:
+    # Update NAV for each outstanding fund
+    updated = 0  # Target NAV available
+    pending = 0  # Target NAV not yet published
+    updated_codes = []
+
+    for code, target in outstanding:
         try:
             # Fetch latest 5 days history
             history = get_fund_history(code, limit=5)
-            if history:
-                # Check if latest NAV is today's
-                latest_date = history[-1]["date"]
-                if latest_date == today_str:
-                    updated += 1
-                else:
-                    pending += 1
+            latest_date = history[-1]["date"] if history else None
+            if record_poll_result(code, target, latest_date, now_cst):
+                updated += 1
+                updated_codes.append(code)
+            else:
+                pending += 1
             time.sleep(0.3)  # Avoid API rate limiting
         except Exception as e:
             logger.error(f"Failed to update NAV for {code}: {e}")
+            # 失败按未公布处理，同样退避，避免每轮都重试
+            record_poll_result(code, target, None, now_cst)
+            pending += 1
 
     if updated > 0 or pending > 0:
-        logger.info(f"NAV update: {updated} updated, {pending} pending (total {len(codes)})")
+        logger.info(f"NAV update: {updated} updated, {pending} pending (polled {len(outstanding)} of {len(codes)})")
+    if updated_codes:
+        account_summary.refresh_for_codes(updated_codes)
+
+def _build_digest_content(items: list, now_cst: datetime) -> str:
+    """
+    Render one digest email covering all of a recipient's funds.
+
+    Args:
+        items: [{"code", "name", "estimate", "est_rate"}, ...]
+        now_cst: Current CST time
+    """
+    rows = []
+    for item in sorted(items, key=lambda x: x["est_rate"], reverse=True):
+        color = "#d32f2f" if item["est_rate"] > 0 else ("#388e3c" if item["est_rate"] < 0 else "#333")
+        rows.append(f"""
+                    <tr>
+                        <td>{item['name']} ({item['code']})</td>
+                        <td style="text-align:right">{item['estimate']}</td>
+                        <td style="text-align:right;color:{color}"><b>{item['est_rate']}%</b></td>
+                    </tr>""")
+
+    return f"""
+                    <h3>每日基金总结</h3>
+                    <table border="1" cellspacing="0" cellpadding="6" style="border-collapse:collapse">
+                        <tr><th>基金</th><th>今日收盘/最新估值</th><th>今日涨跌幅</th></tr>{''.join(rows)}
+                    </table>
+                    <p>总结时间: {now_cst.strftime('%Y-%m-%d %H:%M:%S')}</p>
+                    <hr/>
+                    <p>祝您投资愉快！</p>
+                    """
 
 def check_subscriptions():
     """
     Check all subscriptions and send alerts (Volatility & Digest).
+    Volatility alerts go out per subscription; digests are grouped per recipient
+    so each email address gets a single summary covering all of its funds.
     """
     logger.info("Checking subscriptions...")
     subs = get_active_subscriptions()
@@ -255,6 +369,9 @@ def check_subscriptions():
     # Cache valuations during this run to avoid duplicate API calls
     valuations = {}
 
+    # email -> {"sub_ids": [...], "items": [...], "codes": set()}
+    digests = {}
+
     for sub in subs:
         code = sub["code"]
         sub_id = sub["id"]
@@ -299,25 +416,48 @@ def check_subscriptions():
                     if send_email(email, subject, content, is_html=True):
                         update_notification_time(sub_id)
 
-        # --- Sub-task B: Daily Scheduled Digest ---
+        # --- Sub-task B: Daily Scheduled Digest (collect only) ---
         # Logic: If digest enabled AND current time >= digest time AND not yet sent today
         if sub["enable_digest"]:
             last_digest = sub["last_digest_at"]
             if not (last_digest and last_digest.startswith(today_str)):
                 # If we are at or past the scheduled time
                 if current_time_str >= sub["digest_time"]:
-                    subject = f"【每日总结】{fund_name} ({code}) 今日估值汇总"
-                    content = f"""
-                    <h3>每日基金总结</h3>
-                    <p>基金: {fund_name} ({code})</p>
-                    <p>今日收盘/最新估值: {data.get('estimate', 'N/A')}</p>
-                    <p>今日涨跌幅: <b>{est_rate}%</b></p>
-                    <p>总结时间: {now_cst.strftime('%Y-%m-%d %H:%M:%S')}</p>
-                    <hr/>
-                    <p>祝您投资愉快！</p>
-                    """
-                    if send_email(email, subject, content, is_html=True):
-                        update_digest_time(sub_id)
+                    digest = digests.setdefault(email, {"sub_ids": [], "items": [], "codes": set()})
+                    digest["sub_ids"].append(sub_id)
+                    # Same fund subscribed by several users with one email: list it once
+                    if code not in digest["codes"]:
+                        digest["codes"].add(code)
+                        digest["items"].append({
+                            "code": code,
+                            "name": fund_name,
+                            "estimate": data.get("estimate", "N/A"),
+                            "est_rate": est_rate,
+                        })
+
+    # --- Send one digest per recipient ---
+    for email, digest in digests.items():
+        items = digest["items"]
+        if len(items) == 1:
+            subject = f"【每日总结】{items[0]['name']} ({items[0]['code']}) 今日估值汇总"
+        else:
+            subject = f"【每日总结】{len(items)} 只基金今日估值汇总"
+        content = _build_digest_content(items, now_cst)
+        if send_email(email, subject, content, is_html=True):
+            update_digest_times(digest["sub_ids"])
+
+    if digests:
+        logger.info(f"Sent {len(digests)} digest emails covering {sum(len(d['items']) for d in digests.values())} funds")
+
+def refresh_trading_calendar():
+    """
+    Refresh exchange holidays from AkShare. On failure the bundled holiday
+    dataset stays in effect.
+    """
+    try:
+        refresh_from_akshare()
+    except Exception as e:
+        logger.warning(f"Trading calendar refresh failed, using bundled holidays: {e}")
 
 def start_scheduler():
     """
@@ -325,64 +465,74 @@ def start_scheduler():
     """
     def _run():
         # 1. Initial fund list update
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT count(*) as cnt FROM funds")
-        count = cursor.fetchone()["cnt"]
-        
+        with db_scope():
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT count(*) as cnt FROM funds")
+            count = cursor.fetchone()["cnt"]
+
+            if count == 0:
+                logger.info("DB is empty. Performing initial fetch.")
+                fetch_and_update_funds()
+            else:
+                try:
+                    fund_directory.reload()
+                except Exception as e:
+                    logger.error(f"Failed to load fund directory: {e}")
 
-        if count == 0:
-            logger.info("DB is empty. Performing initial fetch.")
-            fetch_and_update_funds()
+            refresh_trading_calendar()
 
         # 2. Main loop
         last_cleanup_date = None
-        last_nav_update_hour = None
         last_session_cleanup_hour = None  # Track session cleanup
+        interval_minutes = 5
 
         while True:
+            # Each tick runs in its own db_scope, so its connection goes back to the pool before sleeping
             try:
-                now_cst = datetime.now(CST)
-                today_str = now_cst.strftime("%Y-%m-%d")
-
-                # Get collection interval from settings (single-user mode: user_id IS NULL)
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT value FROM settings
-                    WHERE key = 'INTRADAY_COLLECT_INTERVAL' AND user_id IS NULL
-                """)
-                row = cursor.fetchone()
-                interval_minutes = int(row["value"]) if row and row["value"] else 5
-
-                # 24/7 Monitoring
-                check_subscriptions()
-
-                # Intraday data collection (trading hours only)
-                collect_intraday_snapshots()
-
-                # 待确认加仓/减仓：用当日已公布净值更新持仓
-                n = process_pending_transactions()
-                if n:
-                    logger.info(f"Applied {n} pending add/reduce transactions.")
-
-                # Daily cleanup (once per day at 00:00)
-                if last_cleanup_date != today_str and now_cst.hour == 0:
-                    cleanup_old_intraday_data()
-                    last_cleanup_date = today_str
-
-                # NAV update (once per hour between 16:00-24:00)
-                if 16 <= now_cst.hour <= 23 and last_nav_update_hour != now_cst.hour:
-                    update_holdings_nav()
-                    last_nav_update_hour = now_cst.hour
-
-                # Session cleanup (once per hour to prevent memory leak)
-                if last_session_cleanup_hour != now_cst.hour:
-                    from ..auth import cleanup_expired_sessions
-                    cleaned = cleanup_expired_sessions()
-                    if cleaned > 0:
-                        logger.info(f"Cleaned up {cleaned} expired sessions")
-                    last_session_cleanup_hour = now_cst.hour
+                with db_scope():
+                    now_cst = datetime.now(CST)
+                    today_str = now_cst.strftime("%Y-%m-%d")
+
+                    # Get collection interval from settings (single-user mode: user_id IS NULL)
+                    conn = get_db_connection()
+                    cursor = conn.cursor()
+                    cursor.execute("""
+                        SELECT value FROM settings
+                        WHERE key = 'INTRADAY_COLLECT_INTERVAL' AND user_id IS NULL
+                    """)
+                    row = cursor.fetchone()
+                    interval_minutes = int(row["value"]) if row and row["value"] else 5
+
+                    # 24/7 Monitoring
+                    check_subscriptions()
+
+                    # Intraday data collection (trading hours only)
+                    collect_intraday_snapshots()
+
+                    # 待确认加仓/减仓：用当日已公布净值更新持仓
+                    n = process_pending_transactions()
+                    if n:
+                        logger.info(f"Applied {n} pending add/reduce transactions.")
+
+                    # Daily cleanup (once per day at 00:00)
+                    if last_cleanup_date != today_str and now_cst.hour == 0:
+                        cleanup_old_intraday_data()
+                        refresh_trading_calendar()
+                        fetch_and_update_funds()
+                        last_cleanup_date = today_str
+
+                    # NAV update (16:00-24:00, every tick; the NAV watcher decides which funds are due)
+                    if 16 <= now_cst.hour <= 23:
+                        update_holdings_nav()
+
+                    # Session cleanup (once per hour to prevent memory leak)
+                    if last_session_cleanup_hour != now_cst.hour:
+                        from ..auth import cleanup_expired_sessions
+                        cleaned = cleanup_expired_sessions()
+                        if cleaned > 0:
+                            logger.info(f"Cleaned up {cleaned} expired sessions")
+                        last_session_cleanup_hour = now_cst.hour
 
             except Exception as e:
                 logger.error(f"Scheduler loop error: {e}")
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+时间序列的紧凑编码（净值历史、盘中序列共用）。
+
+- rows:     [{"date": ..., "nav": ...}, ...]（默认，兼容旧客户端）
+- columnar: {"dates": [...], "navs": [...]}，每个字段一列，键名为字段名复数；
+            offsets=True 时日期写成相对 base_date 的天数，时间写成当日分钟数
+- binary:   小端二进制 [uint32 头长度][JSON 头][补齐到 4 字节][各列依次排列]，
+            日期/时间列为 int32（同 offsets），其余列为 float32（缺失值为 NaN）；
+            头中 columns 给出 [[列名, "i4"|"f4"], ...]，每列 count 个元素，
+            客户端可直接在 ArrayBuffer 上建 Int32Array / Float32Array 视图
+"""
+import json
+import struct
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+FORMAT_PATTERN = "^(rows|columnar|binary)$"
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+_DATE_FIELDS = ("date",)
+_TIME_FIELDS = ("time",)
+
+
+def _plural(field: str) -> str:
+    return field + "s"
+
+
+def _day_offsets(values: Sequence[str], base: Optional[np.datetime64]) -> np.ndarray:
+    """YYYY-MM-DD -> 相对 base 的天数"""
+    if base is None:
+        return np.zeros(0, dtype="<i4")
+    return (np.asarray(values, dtype="datetime64[D]") - base).astype("<i4")
+
+
+def _minutes(values: Sequence[str]) -> np.ndarray:
+    """HH:MM -> 当日分钟数"""
+    parts = np.asarray([v[:2] + v[3:5] for v in values], dtype="<i4")
+    return (parts // 100 * 60 + parts % 100).astype("<i4")
+
+
+def _base_date(rows: List[Dict[str, Any]], fields: Sequence[str]) -> Optional[np.datetime64]:
+    if not rows or not any(f in _DATE_FIELDS for f in fields):
+        return None
+    return np.asarray([row["date"] for row in rows], dtype="datetime64[D]").min()
+
+
+def to_columnar(rows: List[Dict[str, Any]], fields: Sequence[str], offsets: bool = False) -> Dict[str, Any]:
+    """
+    行转列。
+
+    Args:
+        rows: 序列行（按时间升序）
+        fields: 输出的字段（按此顺序）
+        offsets: 日期写成相对 base_date 的天数、时间写成分钟数
+
+    Returns:
+        {"count": n, "dates": [...], "navs": [...], ...}；offsets 时另含 "base_date"
+    """
+    result: Dict[str, Any] = {"count": len(rows)}
+    base = _base_date(rows, fields) if offsets else None
+    if base is not None:
+        result["base_date"] = str(base)
+    for field in fields:
+        values = [row.get(field) for row in rows]
+        if offsets and field in _DATE_FIELDS:
+            values = _day_offsets(values, base).tolist()
+        elif offsets and field in _TIME_FIELDS:
+            values = _minutes(values).tolist()
+        result[_plural(field)] = values
+    return result
+
+
+def to_binary(rows: List[Dict[str, Any]], fields: Sequence[str], meta: Optional[Dict[str, Any]] = None) -> bytes:
+    """
+    打包为二进制（布局见模块说明）。
+
+    Args:
+        rows: 序列行（按时间升序）
+        fields: 输出的字段（按此顺序）
+        meta: 写入 JSON 头的其他字段（如 prevNav、transactions）
+    """
+    base = _base_date(rows, fields)
+    columns, chunks = [], []
+    for field in fields:
+        values = [row.get(field) for row in rows]
+        if field in _DATE_FIELDS:
+            columns.append([field, "i4"])
+            chunks.append(_day_offsets(values, base).tobytes())
+        elif field in _TIME_FIELDS:
+            columns.append([field, "i4"])
+            chunks.append(_minutes(values).tobytes())
+        else:
+            # None 转为 NaN
+            columns.append([field, "f4"])
+            chunks.append(np.asarray(values, dtype="<f8").astype("<f4").tobytes())
+
+    header = dict(meta or {})
+    header.update({"count": len(rows), "columns": columns})
+    if base is not None:
+        header["base_date"] = str(base)
+    head = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # 列数据从 4 字节对齐处开始
+    head += b" " * (-(4 + len(head)) % 4)
+    return struct.pack("<I", len(head)) + head + b"".join(chunks)
@@ -1,5 +1,5 @@
 import logging
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from ..db import get_db_connection
 
@@ -61,9 +61,14 @@ def update_notification_time(sub_id: int):
     cursor.execute("UPDATE subscriptions SET last_notified_at = CURRENT_TIMESTAMP WHERE id = ?", (sub_id,))
     conn.commit()
 
-def update_digest_time(sub_id: int):
+def update_digest_times(sub_ids: List[int]):
+    """Mark a recipient's grouped digest as sent for all of its subscriptions."""
+    if not sub_ids:
+        return
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE subscriptions SET last_digest_at = CURRENT_TIMESTAMP WHERE id = ?", (sub_id,))
+    cursor.executemany(
+        "UPDATE subscriptions SET last_digest_at = CURRENT_TIMESTAMP WHERE id = ?",
+        [(sub_id,) for sub_id in sub_ids]
+    )
     conn.commit()
-    
@@ -7,9 +7,10 @@ from datetime import datetime
 from typing import List, Dict, Any, Optional
 
 from ..db import get_db_connection
-from .fund import get_nav_on_date
-from .account import upsert_position, remove_position
+from .fund import get_nav_on_date, get_navs_on_dates
+from .account import upsert_position, remove_position, _upsert_position, _remove_position
 from .trading_calendar import get_confirm_date, confirm_date_to_str
+from . import account_summary, response_cache
 
 logger = logging.getLogger(__name__)
 
@@ -214,27 +215,90 @@ def list_transactions(account_id: int, code: Optional[str] = None, limit: int =
 
 
 def process_pending_transactions() -> int:
-    """处理待确认流水：对 confirm_nav 为空的记录拉取确认日净值并更新持仓。"""
+    """
+    处理待确认流水：对 confirm_nav 为空的记录拉取确认日净值并更新持仓。
+
+    批量处理：
+    1. 确认日净值按 (code, date) 批量点查，每个基金最多请求一次上游；
+    2. 按账户分组，在单个事务内按 (confirm_date, id) 顺序依次应用，保证结果确定；
+    3. 清空有流水被确认的用户的接口响应缓存（流水列表、历史图上的交易标记）。
+    """
+    today_str = confirm_date_to_str(datetime.now().date())
+
     conn = get_db_connection()
     cursor = conn.cursor()
+    # 确认日在未来的流水不可能已有净值，直接跳过
     cursor.execute(
-        "SELECT id, account_id, code, op_type, amount_cny, shares_redeemed, confirm_date FROM transactions WHERE applied_at IS NULL AND confirm_nav IS NULL"
+        """
+        SELECT id, account_id, code, op_type, amount_cny, shares_redeemed, confirm_date
+        FROM transactions
+        WHERE applied_at IS NULL AND confirm_nav IS NULL AND confirm_date <= ?
+        ORDER BY confirm_date, id
+        """,
+        (today_str,),
     )
     pending = cursor.fetchall()
-    
-    applied = 0
-    for row in pending:
-        tid, account_id, code, op_type, amount_cny, shares_redeemed, confirm_date = (
-            row["id"], row["account_id"], row["code"], row["op_type"], row["amount_cny"], row["shares_redeemed"], row["confirm_date"]
+    if not pending:
+        return 0
+
+    # 1. 批量解析确认日净值（主键点查，缺失日期每个基金只请求一次上游）
+    try:
+        nav_map = get_navs_on_dates(
+            (row["code"], row["confirm_date"][:10]) for row in pending if row["confirm_date"]
         )
-        nav = get_nav_on_date(code, confirm_date) if confirm_date else None
-        if not nav or nav <= 0:
-            continue
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    except Exception as e:
+        logger.error(f"Failed to load confirm NAVs: {e}")
+        return 0
+
+    # 2. 按账户分组（pending 已按 confirm_date, id 排序，分组后保持顺序）
+    by_account: Dict[int, List[Any]] = {}
+    for row in pending:
+        nav = nav_map.get((row["code"], (row["confirm_date"] or "")[:10]))
+        if nav:
+            by_account.setdefault(row["account_id"], []).append((row, nav))
+
+    applied = 0
+    touched = []
+    for account_id, items in by_account.items():
+        try:
+            n = _apply_account_transactions(conn, account_id, items)
+            applied += n
+            if n:
+                touched.append(account_id)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Failed to apply pending transactions for account {account_id}: {e}")
+
+    if touched:
+        placeholders = ",".join("?" * len(touched))
+        cursor.execute(f"SELECT DISTINCT user_id FROM accounts WHERE id IN ({placeholders})", touched)
+        response_cache.invalidate_users(row["user_id"] for row in cursor.fetchall())
+    return applied
+
+
+def _apply_account_transactions(conn, account_id: int, items: List[Any]) -> int:
+    """在单个事务内将某账户的待确认流水依次应用到持仓，返回应用条数。"""
+    cursor = conn.cursor()
+
+    codes = sorted({row["code"] for row, _ in items})
+    placeholders = ",".join("?" * len(codes))
+    cursor.execute(
+        f"SELECT code, cost, shares FROM positions WHERE account_id = ? AND code IN ({placeholders})",
+        [account_id] + codes,
+    )
+    positions: Dict[str, Optional[Dict[str, float]]] = {code: None for code in codes}
+    for r in cursor.fetchall():
+        positions[r["code"]] = {"cost": float(r["cost"]), "shares": float(r["shares"])}
+    dirty = set()
+
+    applied = 0
+    for row, nav in items:
+        tid, code, op_type = row["id"], row["code"], row["op_type"]
+        amount_cny, shares_redeemed = row["amount_cny"], row["shares_redeemed"]
+        pos = positions[code]
+
         if op_type == "add" and amount_cny:
             shares_added = round(amount_cny / nav, 4)
-            pos = _get_position(account_id, code)
             if pos:
                 old_c, old_s = pos["cost"], pos["shares"]
                 new_shares = old_s + shares_added
@@ -242,31 +306,35 @@ def process_pending_transactions() -> int:
             else:
                 new_shares = shares_added
                 new_cost = nav
-            upsert_position(account_id, code, new_cost, new_shares)
+            positions[code] = {"cost": new_cost, "shares": new_shares}
             cursor.execute(
                 "UPDATE transactions SET confirm_nav = ?, shares_added = ?, cost_after = ?, applied_at = CURRENT_TIMESTAMP WHERE id = ?",
                 (nav, shares_added, new_cost, tid),
             )
         elif op_type == "reduce" and shares_redeemed:
-            pos = _get_position(account_id, code)
             if not pos:
-                
                 continue
             amount_cny = round(shares_redeemed * nav, 2)
             new_shares = round(pos["shares"] - shares_redeemed, 4)
             cost_after = pos["cost"] if new_shares > 0 else 0.0
-            if new_shares <= 0:
-                remove_position(account_id, code)
-            else:
-                upsert_position(account_id, code, pos["cost"], new_shares)
+            positions[code] = {"cost": pos["cost"], "shares": new_shares} if new_shares > 0 else None
             cursor.execute(
                 "UPDATE transactions SET confirm_nav = ?, amount_cny = ?, cost_after = ?, applied_at = CURRENT_TIMESTAMP WHERE id = ?",
                 (nav, amount_cny, cost_after, tid),
             )
         else:
-            
             continue
-        conn.commit()
-        
+        dirty.add(code)
         applied += 1
+
+    for code in sorted(dirty):
+        pos = positions[code]
+        if pos:
+            _upsert_position(cursor, account_id, code, pos["cost"], pos["shares"])
+        else:
+            _remove_position(cursor, account_id, code)
+    if dirty:
+        account_summary.refresh(cursor, account_id)
+
+    conn.commit()
     return applied
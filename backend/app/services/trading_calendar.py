@@ -1,26 +1,202 @@
 # -*- coding: utf-8 -*-
 """
 A股交易日历：15:00 前按当日净值，15:00 后按下一交易日净值。
-仅考虑周末，节假日可后续扩展。
+
+节假日数据：内置沪深交易所休市日（工作日休市部分），可通过 AkShare
+`tool_trade_date_hist_sina` 刷新覆盖。每年预计算一份按日序号索引的位图、
+累计交易日计数和"下一/上一交易日"跳转表，is_trading_day / next_trading_day /
+prev_trading_day / trading_days_between 均为 O(1)。内置数据未覆盖的年份退化为仅排除周末。
 """
+import logging
+import threading
+from array import array
 from datetime import datetime, date, timedelta
-from typing import Optional
+from typing import Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
 
 # 15:00 为分界（同一日 15:00 整算当日）
 CUTOFF_HOUR, CUTOFF_MINUTE = 15, 0
 
+# 内置休市日（仅列出落在周一至周五的休市日，周末本身即休市）
+_BUNDLED_HOLIDAYS: Dict[int, Set[str]] = {
+    2024: {
+        "2024-01-01",
+        "2024-02-09", "2024-02-12", "2024-02-13", "2024-02-14", "2024-02-15", "2024-02-16",
+        "2024-04-04", "2024-04-05",
+        "2024-05-01", "2024-05-02", "2024-05-03",
+        "2024-06-10",
+        "2024-09-16", "2024-09-17",
+        "2024-10-01", "2024-10-02", "2024-10-03", "2024-10-04", "2024-10-07",
+    },
+    2025: {
+        "2025-01-01",
+        "2025-01-28", "2025-01-29", "2025-01-30", "2025-01-31", "2025-02-03", "2025-02-04",
+        "2025-04-04",
+        "2025-05-01", "2025-05-02", "2025-05-05",
+        "2025-06-02",
+        "2025-10-01", "2025-10-02", "2025-10-03", "2025-10-06", "2025-10-07", "2025-10-08",
+    },
+    2026: {
+        "2026-01-01", "2026-01-02",
+        "2026-02-16", "2026-02-17", "2026-02-18", "2026-02-19", "2026-02-20", "2026-02-23",
+        "2026-04-06",
+        "2026-05-01", "2026-05-04", "2026-05-05",
+        "2026-06-19",
+        "2026-09-25",
+        "2026-10-01", "2026-10-02", "2026-10-05", "2026-10-06", "2026-10-07",
+    },
+}
+
+# 运行期休市日（内置数据 + AkShare 刷新结果），按年份存储
+_holidays: Dict[int, Set[date]] = {
+    year: {date.fromisoformat(d) for d in days} for year, days in _BUNDLED_HOLIDAYS.items()
+}
+
+
+class _YearCalendar:
+    """单年预计算表，下标为 date.toordinal() - 当年 1 月 1 日的 ordinal。"""
+    __slots__ = ("base", "bits", "cum", "next_idx", "prev_idx", "total")
+
+    def __init__(self, year: int, holidays: Set[date]):
+        start = date(year, 1, 1)
+        days = (date(year + 1, 1, 1) - start).days
+        self.base = start.toordinal()
+
+        bits = bytearray(days)
+        for i in range(days):
+            d = start + timedelta(days=i)
+            bits[i] = 1 if d.weekday() < 5 and d not in holidays else 0
+        self.bits = bits
+
+        # cum[i] = 当年 1 月 1 日至第 i 天（含）的交易日数
+        cum = array("H", bytes(2 * days))
+        running = 0
+        for i in range(days):
+            running += bits[i]
+            cum[i] = running
+        self.cum = cum
+        self.total = running
+
+        # next_idx[i] = 第 i 天之后（不含）当年第一个交易日的下标，不存在则为 -1
+        next_idx = array("h", [-1]) * days
+        nxt = -1
+        for i in range(days - 1, -1, -1):
+            next_idx[i] = nxt
+            if bits[i]:
+                nxt = i
+        self.next_idx = next_idx
+
+        # prev_idx[i] = 第 i 天之前（不含）当年最后一个交易日的下标，不存在则为 -1
+        prev_idx = array("h", [-1]) * days
+        prv = -1
+        for i in range(days):
+            prev_idx[i] = prv
+            if bits[i]:
+                prv = i
+        self.prev_idx = prev_idx
+
+
+_calendars: Dict[int, _YearCalendar] = {}
+_lock = threading.Lock()
+
+
+def _year_calendar(year: int) -> _YearCalendar:
+    cal = _calendars.get(year)
+    if cal is None:
+        with _lock:
+            cal = _calendars.get(year)
+            if cal is None:
+                cal = _YearCalendar(year, _holidays.get(year, set()))
+                _calendars[year] = cal
+    return cal
+
+
+def set_holidays(year: int, holidays: Iterable[date]) -> None:
+    """覆盖某年的休市日并使该年的预计算表失效"""
+    with _lock:
+        _holidays[year] = set(holidays)
+        _calendars.pop(year, None)
+
+
+def refresh_from_akshare() -> int:
+    """
+    用新浪交易日历（AkShare tool_trade_date_hist_sina）刷新休市日。
+    仅覆盖数据延伸到当年 12 月的完整年份，返回刷新的年份数。
+    """
+    import akshare as ak
+
+    df = ak.tool_trade_date_hist_sina()
+    if df is None or df.empty:
+        return 0
+
+    trade_days: Dict[int, Set[date]] = {}
+    for value in df["trade_date"]:
+        d = value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+        trade_days.setdefault(d.year, set()).add(d)
+
+    refreshed = 0
+    for year, days in trade_days.items():
+        if max(days).month != 12:
+            continue  # 当年数据不完整，保留内置数据
+        start = date(year, 1, 1)
+        n = (date(year + 1, 1, 1) - start).days
+        holidays = set()
+        for i in range(n):
+            d = start + timedelta(days=i)
+            if d.weekday() < 5 and d not in days:
+                holidays.add(d)
+        set_holidays(year, holidays)
+        refreshed += 1
+
+    logger.info(f"Trading calendar refreshed from AkShare ({refreshed} years)")
+    return refreshed
+
 
 def is_trading_day(d: date) -> bool:
-    """是否为交易日（先只排除周末）"""
-    return d.weekday() < 5  # 0-4 周一到周五
+    """是否为交易日（排除周末及交易所休市日）"""
+    cal = _year_calendar(d.year)
+    return bool(cal.bits[d.toordinal() - cal.base])
 
 
 def next_trading_day(d: date) -> date:
     """下一交易日"""
-    n = d + timedelta(days=1)
-    while not is_trading_day(n):
-        n += timedelta(days=1)
-    return n
+    cal = _year_calendar(d.year)
+    idx = cal.next_idx[d.toordinal() - cal.base]
+    if idx >= 0:
+        return date.fromordinal(cal.base + idx)
+    # 当年已无交易日，跳到下一年第一个交易日
+    n = date(d.year + 1, 1, 1)
+    return n if is_trading_day(n) else next_trading_day(n)
+
+
+def prev_trading_day(d: date) -> date:
+    """上一交易日"""
+    cal = _year_calendar(d.year)
+    idx = cal.prev_idx[d.toordinal() - cal.base]
+    if idx >= 0:
+        return date.fromordinal(cal.base + idx)
+    # 当年此前已无交易日，跳到上一年最后一个交易日
+    p = date(d.year - 1, 12, 31)
+    return p if is_trading_day(p) else prev_trading_day(p)
+
+
+def trading_days_between(start: date, end: date) -> int:
+    """区间 (start, end] 内的交易日数；end <= start 时返回 0"""
+    if end <= start:
+        return 0
+
+    def _count_through(d: date) -> int:
+        cal = _year_calendar(d.year)
+        return cal.cum[d.toordinal() - cal.base]
+
+    if start.year == end.year:
+        return _count_through(end) - _count_through(start)
+
+    count = _year_calendar(start.year).total - _count_through(start)
+    for year in range(start.year + 1, end.year):
+        count += _year_calendar(year).total
+    return count + _count_through(end)
 
 
 def get_confirm_date(trade_ts: Optional[datetime] = None) -> date:
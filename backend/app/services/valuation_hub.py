@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+实时估值推送中心：所有连接共享一份估值缓存，由一个后台线程刷新。
+
+客户端按基金代码订阅（见 /valuations/stream、/account/positions/live），
+刷新线程每 REFRESH_INTERVAL 秒对「当前被订阅的基金」并集拉取一次估值，
+只把发生变化的基金推给订阅了它的连接。上游请求量随不同基金数增长，
+与打开的页面数无关。
+
+订阅者运行在事件循环上（SSE 的异步生成器），线程侧通过 call_soon_threadsafe 投递。
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from ..db import db_scope
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 15  # 秒，与原前端轮询周期一致
+# 每个订阅者最多积压的更新批次，超出时丢弃最旧的（慢客户端不拖累其他人）
+MAX_PENDING = 32
+
+
+class Subscription:
+    """一个连接的订阅：关注的基金代码 + 事件循环上的更新队列"""
+
+    def __init__(self, codes: Iterable[str], loop: asyncio.AbstractEventLoop):
+        self.codes: Set[str] = set(codes)
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDING)
+
+    def _deliver(self, updates: Dict[str, Dict[str, Any]]):
+        # 事件循环线程内执行
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(updates)
+
+    def push(self, updates: Dict[str, Dict[str, Any]]):
+        """线程安全地投递 {code: data}（只保留本订阅关注的基金）"""
+        mine = {code: data for code, data in updates.items() if code in self.codes}
+        if not mine:
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, mine)
+        except RuntimeError:
+            # 事件循环已关闭，连接随之结束
+            pass
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Dict[str, Any]]]:
+        """等待下一批更新；超时返回 None（调用方可借此发心跳）"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+_cache: Dict[str, Dict[str, Any]] = {}
+_fetched_at: Dict[str, float] = {}
+_subscriptions: List[Subscription] = []
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def subscribe(codes: Iterable[str]) -> Subscription:
+    """在事件循环内调用：登记订阅并确保刷新线程已启动"""
+    sub = Subscription(codes, asyncio.get_running_loop())
+    with _lock:
+        _subscriptions.append(sub)
+        fresh = not sub.codes.issubset(_cache)
+    _ensure_thread()
+    if fresh:
+        # 有未缓存的基金，立即刷新一轮而不是等到下个周期
+        _wakeup.set()
+    return sub
+
+
+def unsubscribe(sub: Subscription):
+    with _lock:
+        try:
+            _subscriptions.remove(sub)
+        except ValueError:
+            pass
+
+
+def get_cached(codes: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """缓存中已有的估值（不触发拉取）"""
+    with _lock:
+        return {code: _cache[code] for code in codes if code in _cache}
+
+
+def subscribed_codes() -> Set[str]:
+    with _lock:
+        return set().union(*(sub.codes for sub in _subscriptions)) if _subscriptions else set()
+
+
+def publish(updates: Dict[str, Dict[str, Any]]) -> int:
+    """
+    写入缓存并把有变化的基金推给订阅者（刷新线程与盘中采集共用）。
+
+    Returns:
+        发生变化的基金数量
+    """
+    now = time.monotonic()
+    with _lock:
+        changed = {}
+        for code, data in updates.items():
+            _fetched_at[code] = now
+            if _cache.get(code) != data:
+                _cache[code] = data
+                changed[code] = data
+        subscribers = list(_subscriptions)
+    if changed:
+        for sub in subscribers:
+            sub.push(changed)
+    return len(changed)
+
+
+def _refresh_once():
+    codes = subscribed_codes()
+    # 无人订阅的基金不再保留
+    with _lock:
+        for code in list(_cache):
+            if code not in codes:
+                _cache.pop(code, None)
+                _fetched_at.pop(code, None)
+        cutoff = time.monotonic() - REFRESH_INTERVAL
+        due = [code for code in codes if _fetched_at.get(code, 0) <= cutoff]
+    if not due:
+        return
+
+    # 延迟导入：portfolio 依赖 numpy 与估值服务
+    from .portfolio import _iter_valuations
+    updates = {}
+    for code, data in _iter_valuations(due):
+        if isinstance(data, Exception):
+            logger.warning(f"Hub valuation failed for {code}: {data!r}")
+            continue
+        updates[code] = data
+    changed = publish(updates)
+    logger.debug(f"Valuation hub refreshed {len(updates)}/{len(due)} funds, {changed} changed")
+
+
+def _run():
+    while True:
+        try:
+            with db_scope():
+                _refresh_once()
+        except Exception as e:
+            logger.error(f"Valuation hub refresh error: {e}")
+        _wakeup.wait(REFRESH_INTERVAL)
+        _wakeup.clear()
+
+
+def _ensure_thread():
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="valuation-hub", daemon=True)
+            _thread.start()
@@ -1,7 +1,8 @@
 """
 工具函数
 """
-from typing import Optional
+import json
+from typing import Any, Dict, Optional
 from fastapi import HTTPException, status
 from .db import get_db_connection
 from .auth import User
@@ -37,3 +38,19 @@ def verify_account_ownership(account_id: int, user: User) -> None:
             status_code=status.HTTP_403_FORBIDDEN,
             detail="无权访问此账户"
         )
+
+
+# 流式响应公共头：禁止缓存与反向代理缓冲，保证逐帧到达
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# SSE 注释行，用作心跳（防止空闲连接被代理断开）
+SSE_KEEPALIVE = ": keepalive\n\n"
+
+
+def encode_frame(frame: Dict[str, Any], fmt: str = "sse") -> str:
+    """
+    把一帧写成 SSE（event 为帧的 type）或 NDJSON（每行一个 JSON）
+    """
+    payload = json.dumps(frame, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {frame['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
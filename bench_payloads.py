@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大响应序列化与压缩基准
+对比标准库 json 与 orjson 的序列化耗时，以及 identity / gzip / zstd 的传输字节数
+
+负载:
+    history    /api/fund/{id}/history?limit=9999 （全量净值历史，另比较 format=columnar / binary）
+    positions  /api/account/positions            （持仓明细 + 汇总）
+
+用法:
+    python bench_payloads.py                    # 生成 9999 条净值 + 200 只持仓的模拟数据
+    python bench_payloads.py --positions 500 --rounds 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from app.config import Config
+
+
+def seed(history_days: int, positions: int):
+    from app.db import get_db_connection
+    from app.dialect import bulk_insert
+
+    rng = random.Random(42)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    start = date.today() - timedelta(days=history_days)
+    codes = [f"{i:06d}" for i in range(max(positions, 1))]
+    bulk_insert(cursor, "funds", ("code", "name", "type"),
+                [(c, f"模拟基金{c}混合A", "混合型-偏股") for c in codes], on_conflict="replace")
+
+    nav, rows = 1.0, []
+    for i in range(history_days):
+        nav = max(0.1, nav * (1 + rng.gauss(0, 0.012)))
+        rows.append((codes[0], (start + timedelta(days=i)).strftime("%Y-%m-%d"), round(nav, 4)))
+    # 其余基金各一条最新净值，供持仓估值
+    yesterday = (date.today() - timedelta(days=1)).strftime("%Y-%m-%d")
+    rows += [(c, yesterday, round(rng.uniform(0.5, 3.0), 4)) for c in codes[1:]]
+    bulk_insert(cursor, "fund_history", ("code", "date", "nav"), rows, on_conflict="replace")
+
+    cursor.execute("INSERT INTO users (username, password_hash) VALUES ('bench', '-')")
+    cursor.execute("INSERT INTO accounts (name, user_id) VALUES ('bench', ?)", (cursor.lastrowid,))
+    account_id = cursor.lastrowid
+    bulk_insert(cursor, "positions", ("account_id", "code", "cost", "shares"),
+                [(account_id, c, round(rng.uniform(0.5, 3.0), 4), round(rng.uniform(100, 50000), 2))
+                 for c in codes[:positions]], on_conflict="replace")
+    conn.commit()
+    return codes[0], account_id
+
+
+def history_payload(code: str):
+    """与 get_fund_history(limit=9999) 命中缓存时返回的结构一致"""
+    from app.db import get_db_connection
+
+    cursor = get_db_connection().cursor()
+    cursor.execute("SELECT date, nav FROM fund_history WHERE code = ? ORDER BY date DESC", (code,))
+    return [{"date": row["date"], "nav": float(row["nav"])} for row in reversed(cursor.fetchall())]
+
+
+def positions_payload(account_id: int):
+    """持仓接口的响应结构（按确认净值估值，不请求上游）"""
+    from app.services.portfolio import LivePortfolio, load_holdings
+
+    return LivePortfolio(load_holdings([account_id])).snapshot()
+
+
+def time_render(response_class, payload, rounds: int):
+    timings = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        body = response_class(payload).body
+        timings.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(timings), body
+
+
+def run(label: str, payload, rounds: int):
+    from fastapi.responses import JSONResponse
+    from app.main import DefaultResponse, ZSTD_AVAILABLE, compress_body
+
+    print(f"[{label}]")
+    json_ms, json_body = time_render(JSONResponse, payload, rounds)
+    print(f"  {'json':<8} p50={json_ms:8.3f}ms  bytes={len(json_body)}")
+    if DefaultResponse is not JSONResponse:
+        orjson_ms, orjson_body = time_render(DefaultResponse, payload, rounds)
+        print(f"  {'orjson':<8} p50={orjson_ms:8.3f}ms  bytes={len(orjson_body)}  "
+              f"speedup={json_ms / orjson_ms:.1f}x")
+    else:
+        orjson_body = json_body
+        print("  orjson   not installed")
+
+    encodings = ["gzip"] + (["zstd"] if ZSTD_AVAILABLE else [])
+    for encoding in encodings:
+        t0 = time.perf_counter()
+        compressed = compress_body(orjson_body, encoding)
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"  {encoding:<8} {ms:8.3f}ms  bytes={len(compressed)}  "
+              f"ratio={len(compressed) / len(orjson_body):.1%}")
+    if not ZSTD_AVAILABLE:
+        print("  zstd     not installed")
+
+
+def run_formats(rows, rounds: int):
+    """净值历史在各 format 下的编码耗时与传输字节数"""
+    from app.main import DefaultResponse, ZSTD_AVAILABLE, compress_body
+    from app.services.series_codec import to_binary, to_columnar
+
+    fields = ("date", "nav")
+    variants = [
+        ("rows", lambda: DefaultResponse({"history": rows}).body),
+        ("columnar", lambda: DefaultResponse({"history": to_columnar(rows, fields)}).body),
+        ("offsets", lambda: DefaultResponse({"history": to_columnar(rows, fields, offsets=True)}).body),
+        ("binary", lambda: to_binary(rows, fields)),
+    ]
+    print("[history formats]")
+    for label, encode in variants:
+        timings = []
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            body = encode()
+            timings.append((time.perf_counter() - t0) * 1000)
+        sizes = [f"gzip={len(compress_body(body, 'gzip'))}"]
+        if ZSTD_AVAILABLE:
+            sizes.append(f"zstd={len(compress_body(body, 'zstd'))}")
+        print(f"  {label:<8} p50={statistics.median(timings):8.3f}ms  bytes={len(body)}  {'  '.join(sizes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response serialization and compression benchmark")
+    parser.add_argument("--days", type=int, default=9999, help="净值历史条数")
+    parser.add_argument("--positions", type=int, default=200, help="持仓基金数量")
+    parser.add_argument("--rounds", type=int, default=100, help="每种序列化的重复次数")
+    args = parser.parse_args()
+
+    Config.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+    from app.db import init_db
+
+    init_db()
+    code, account_id = seed(args.days, args.positions)
+
+    print(f"Database: {Config.DB_PATH}")
+    history = history_payload(code)
+    run(f"history limit=9999 ({args.days} rows)", history, args.rounds)
+    run_formats(history, args.rounds)
+    run(f"positions ({args.positions} funds)", positions_payload(account_id), args.rounds)
+
+
+if __name__ == "__main__":
+    main()
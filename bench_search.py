@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基金搜索延迟基准
+对比 LIKE 全表扫描与 FTS5 trigram 索引的 p50 / p99 查询延迟
+
+用法:
+    python bench_search.py                  # 生成 20000 条模拟基金数据
+    python bench_search.py --db data/fundval.db --rounds 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from app.config import Config
+
+WORDS = ["易方达", "华夏", "南方", "嘉实", "广发", "招商", "富国", "汇添富", "博时", "工银",
+         "沪深300", "中证500", "创业板", "科创50", "消费", "医药", "白酒", "新能源", "半导体", "红利",
+         "联接", "指数", "混合", "债券", "ETF", "LOF", "增强", "精选", "成长", "价值"]
+TYPES = ["混合型-偏股", "指数型-股票", "债券型-长债", "股票型", "QDII-普通股票", "货币型-普通货币"]
+
+
+def seed_funds(n: int):
+    from app.db import get_db_connection
+    from app.dialect import bulk_insert
+
+    rng = random.Random(42)
+    rows = []
+    for i in range(n):
+        name = "".join(rng.sample(WORDS, 3)) + rng.choice("ABCE")
+        rows.append((f"{i:06d}", name, rng.choice(TYPES)))
+    conn = get_db_connection()
+    bulk_insert(conn.cursor(), "funds", ("code", "name", "type"), rows, on_conflict="replace")
+    conn.commit()
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def run(label: str, queries, rounds: int):
+    from app.services.fund import search_funds
+
+    timings = []
+    for i in range(rounds):
+        q = queries[i % len(queries)]
+        t0 = time.perf_counter()
+        search_funds(q)
+        timings.append((time.perf_counter() - t0) * 1000)
+    print(f"{label:<12} p50={statistics.median(timings):7.3f}ms  "
+          f"p99={percentile(timings, 0.99):7.3f}ms  max={max(timings):7.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fund search latency benchmark")
+    parser.add_argument("--db", help="已有的 SQLite 数据库（默认生成临时库）")
+    parser.add_argument("--funds", type=int, default=20000, help="模拟基金数量")
+    parser.add_argument("--rounds", type=int, default=1000, help="每组查询次数")
+    args = parser.parse_args()
+
+    Config.DB_PATH = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+
+    from app.db import init_db
+    from app.services import fund
+
+    init_db()
+    if not args.db:
+        seed_funds(args.funds)
+        fund.rebuild_search_index()
+
+    # 模拟逐字输入：代码前缀、代码子串、名称子串（3 字符及以上）
+    queries = ["000", "0012", "123", "易方达", "沪深300", "新能源混", "半导体ETF", "白酒指数"]
+
+    print(f"Database: {Config.DB_PATH}")
+    run("fts5", queries, args.rounds)
+
+    fund._fts_available = False
+    run("like", queries, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
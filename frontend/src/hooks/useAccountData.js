@@ -1,12 +1,35 @@
-import { useState, useEffect, useCallback } from 'react';
-import { getAccountPositions } from '../services/api';
+import { useState, useEffect, useCallback, useRef } from 'react';
+import { streamAccountPositions, getPositionsLiveUrl, getAccountSummary } from '../services/api';
+
+/**
+ * 把一帧流式持仓合并进当前数据
+ * skeleton 整体替换；position 按基金代码替换对应行；summary 更新汇总并按预估市值重新排序
+ */
+function applyFrame(prev, frame) {
+  switch (frame.type) {
+    case 'skeleton':
+      return { summary: frame.summary, positions: frame.positions };
+    case 'position':
+      return {
+        ...prev,
+        positions: prev.positions.map(p => (p.code === frame.position.code ? frame.position : p))
+      };
+    case 'summary':
+      return {
+        summary: frame.summary,
+        positions: [...prev.positions].sort((a, b) => b.est_market_value - a.est_market_value)
+      };
+    default:
+      return prev;
+  }
+}
 
 /**
  * 账户数据管理 Hook
- * 负责数据获取、轮询、重试、错误处理
+ * 负责数据获取、实时推送订阅、重试、错误处理
  *
  * @param {number} currentAccount - 当前账户 ID
- * @param {boolean} isActive - 是否激活轮询
+ * @param {boolean} isActive - 是否订阅实时推送
  * @returns {Object} { data, loading, error, refetch }
  */
 export function useAccountData(currentAccount, isActive = true) {
@@ -14,17 +37,47 @@ export function useAccountData(currentAccount, isActive = true) {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
 
+  const streamRef = useRef(null);
+  // 每次完整加载成功后递增，触发实时推送重新订阅（持仓集合可能已变化）
+  const [liveKey, setLiveKey] = useState(0);
+
   /**
    * 获取数据（带重试逻辑）
+   * 走流式端点：骨架（确认净值）到达即结束 loading，实时估值随后逐只填充
    */
   const fetchData = useCallback(async (retryCount = 0) => {
+    streamRef.current?.abort();
+    const controller = new AbortController();
+    streamRef.current = controller;
+
     setLoading(true);
     setError(null);
 
+    // 预计算汇总通常先于持仓骨架到达，先填顶栏数字
+    let skeletonArrived = false;
+    getAccountSummary(currentAccount)
+      .then(res => {
+        if (!skeletonArrived && !controller.signal.aborted) {
+          setData(prev => ({ ...prev, summary: res.summary }));
+        }
+      })
+      .catch(e => console.warn('Load account summary failed:', e));
+
     try {
-      const res = await getAccountPositions(currentAccount);
-      setData(res);
+      await streamAccountPositions(currentAccount, (frame) => {
+        if (frame.type === 'error') {
+          console.error('Position stream error:', frame.detail);
+          return;
+        }
+        if (frame.type === 'skeleton') {
+          skeletonArrived = true;
+          setLoading(false);
+        }
+        setData(prev => applyFrame(prev, frame));
+      }, controller.signal);
+      setLiveKey(k => k + 1);
     } catch (e) {
+      if (controller.signal.aborted) return;
       console.error(e);
 
       // 重试逻辑：最多重试 2 次，指数退避
@@ -36,37 +89,33 @@ export function useAccountData(currentAccount, isActive = true) {
         setError('加载账户数据失败，请检查后端服务是否启动');
       }
     } finally {
-      setLoading(false);
-    }
-  }, [currentAccount]);
-
-  /**
-   * 静默刷新（轮询时使用，不显示 loading）
-   */
-  const silentRefresh = useCallback(async () => {
-    try {
-      const res = await getAccountPositions(currentAccount);
-      setData(res);
-    } catch (e) {
-      console.error('Silent refresh failed:', e);
+      if (streamRef.current === controller) {
+        streamRef.current = null;
+        setLoading(false);
+      }
     }
   }, [currentAccount]);
 
-  // 账户切换时重新加载数据
+  // 账户切换时重新加载数据（卸载或切换时取消进行中的流）
   useEffect(() => {
     fetchData();
+    return () => streamRef.current?.abort();
   }, [currentAccount, fetchData]);
 
-  // 轮询机制：每 15 秒自动刷新数据
+  // 实时推送：服务端共享估值缓存更新时推送变化的持仓与新汇总（取代定时轮询）
   useEffect(() => {
-    if (!isActive) return;
+    if (!isActive || liveKey === 0) return;
 
-    const interval = setInterval(() => {
-      silentRefresh();
-    }, 15000);
+    const source = new EventSource(getPositionsLiveUrl(currentAccount), { withCredentials: true });
+    const handleFrame = (event) => {
+      setData(prev => applyFrame(prev, JSON.parse(event.data)));
+    };
+    ['skeleton', 'position', 'summary'].forEach(type => source.addEventListener(type, handleFrame));
+    // EventSource 断线后自动重连，重连时的 skeleton 帧会整体校正数据
+    source.onerror = () => console.warn('Live positions connection interrupted, reconnecting...');
 
-    return () => clearInterval(interval);
-  }, [isActive, silentRefresh]);
+    return () => source.close();
+  }, [isActive, currentAccount, liveKey]);
 
   return {
     data,
@@ -325,7 +325,8 @@ const Account = ({ currentAccount = 1, onSelectFund, onPositionChange, onSyncWat
                       <div className="flex items-center justify-end gap-1">
                         <div
                           className={`font-bold text-[15px] ${!hasValidEstimate ? 'text-slate-400' : getRateColor(pos.est_rate)}`}
-                          title={!pos.is_est_valid && hasValidEstimate ? "ML估算" : "实时估值"}
+                          title={!pos.is_est_valid && hasValidEstimate ? "ML估算"
+                            : pos.valuation_source === 'snapshot' ? `盘中快照（${pos.valuation_age} 分钟前）` : "实时估值"}
                         >
                           {hasValidEstimate ? pos.estimate.toFixed(4) + (!pos.is_est_valid ? '*' : '') : '--'}
                         </div>
@@ -27,14 +27,24 @@ export const getFundDetail = async (fundId) => {
   }
 };
 
+// 列式序列 {"dates": [...], "navs": [...]} 还原为 [{date, nav}, ...]
+export const expandSeries = (series, fields) => {
+    const columns = fields.map(field => series[`${field}s`] || []);
+    return Array.from({ length: series.count || 0 }, (_, i) =>
+        Object.fromEntries(fields.map((field, j) => [field, columns[j][i]]))
+    );
+};
+
 export const getFundHistory = async (fundId, limit = 30, accountId = null) => {
     try {
-        const params = { limit };
+        // 列式传输：不再为每个点重复键名
+        const params = { limit, format: 'columnar' };
         if (accountId) {
             params.account_id = accountId;
         }
         const response = await api.get(`/fund/${fundId}/history`, { params });
-        return response.data;
+        const { history, transactions } = response.data;
+        return { history: expandSeries(history, ['date', 'nav']), transactions };
     } catch (error) {
         console.error("Get history failed", error);
         return { history: [], transactions: [] };
@@ -79,15 +89,18 @@ export const deleteAccount = async (accountId) => {
 };
 
 // Position management
+// 盘中快照在该分钟数内视为新鲜，直接用于估值（只为过期/缺失的基金实时拉取）
+export const SNAPSHOT_MAX_AGE = 10;
+
 export const getAccountPositions = async (accountId) => {
     try {
         // 如果 accountId 为 0，调用聚合端点
         if (accountId === 0) {
-            const response = await api.get('/positions/aggregate');
+            const response = await api.get('/positions/aggregate', { params: { max_age: SNAPSHOT_MAX_AGE } });
             return response.data;
         }
 
-        const response = await api.get('/positions', { params: { account_id: accountId } });
+        const response = await api.get('/positions', { params: { account_id: accountId, max_age: SNAPSHOT_MAX_AGE } });
         return response.data;
     } catch (error) {
         console.error("Get positions failed", error);
@@ -95,6 +108,61 @@ export const getAccountPositions = async (accountId) => {
     }
 };
 
+/**
+ * 预计算的账户汇总（顶栏数字，单次主键读取；浏览器按 ETag 自动做条件请求）
+ *
+ * @param {number} accountId - 账户 ID（0 为所有账户合计）
+ */
+export const getAccountSummary = async (accountId) => {
+    const response = accountId === 0
+        ? await api.get('/accounts/summary')
+        : await api.get('/account/summary', { params: { account_id: accountId } });
+    return response.data;
+};
+
+/**
+ * 流式获取持仓（NDJSON）：骨架帧立即到达，之后逐只推送实时估值，最后推送汇总。
+ *
+ * @param {number} accountId - 账户 ID（0 为聚合视图）
+ * @param {Function} onFrame - 每帧回调：{type: 'skeleton'|'position'|'summary'|'error', ...}
+ * @param {AbortSignal} [signal] - 用于取消请求
+ */
+export const streamAccountPositions = async (accountId, onFrame, signal) => {
+    const url = accountId === 0
+        ? `${API_BASE_URL}/positions/aggregate/stream?max_age=${SNAPSHOT_MAX_AGE}`
+        : `${API_BASE_URL}/account/positions/stream?account_id=${encodeURIComponent(accountId)}&max_age=${SNAPSHOT_MAX_AGE}`;
+    const response = await fetch(url, { credentials: 'include', signal });
+    if (!response.ok || !response.body) {
+        throw new Error(`Stream positions failed: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let newline;
+        while ((newline = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newline).trim();
+            buffer = buffer.slice(newline + 1);
+            if (line) onFrame(JSON.parse(line));
+        }
+    }
+};
+
+/**
+ * 持仓实时推送（SSE）地址：估值变化时推送 position / summary 帧
+ *
+ * @param {number} accountId - 账户 ID（0 为聚合视图）
+ */
+export const getPositionsLiveUrl = (accountId) => (
+    accountId === 0
+        ? `${API_BASE_URL}/positions/aggregate/live`
+        : `${API_BASE_URL}/account/positions/live?account_id=${encodeURIComponent(accountId)}`
+);
+
 export const updatePosition = async (data, accountId) => {
     return api.post('/positions', data, { params: { account_id: accountId } });
 };